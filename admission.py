@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from fastapi import HTTPException, Request
+from metrics import command_metrics
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Admission control for wallet mutations, checked in this order:
+#   1. a global cap on admitted mutations (503), tightened while Mongo command
+#      latency is above ADMISSION_SHED_LATENCY_MS;
+#   2. a token bucket per (route, account) (429);
+#   3. a per-account in-flight limit: requests for the same wallet wait in
+#      arrival order for a slot instead of racing each other's read-check-write
+#      (429 once the account's queue is full or the wait times out).
+#
+# rate: tokens per second, burst: bucket size, in_flight: concurrent requests
+# per account, queue: waiters per account. Override per route with
+# ADMISSION_ROUTE_LIMITS, e.g. '{"withdraw": {"rate": 2, "burst": 5}}'.
+# ADMISSION_ACCOUNT_IN_FLIGHT sets in_flight for the single-wallet routes;
+# the default of 1 runs each account's requests one at a time in arrival order.
+DEFAULT_LIMITS = {
+    "withdraw": {"rate": 100.0, "burst": 200, "in_flight": 1, "queue": 64},
+    "add_money": {"rate": 100.0, "burst": 200, "in_flight": 1, "queue": 64},
+    "transaction": {"rate": 200.0, "burst": 400, "in_flight": 1, "queue": 128},
+    "transfer": {"rate": 100.0, "burst": 200, "in_flight": 1, "queue": 64},
+    "transfer_batch": {"rate": 5.0, "burst": 10, "in_flight": 1, "queue": 8},
+}
+_SINGLE_WALLET = ("withdraw", "add_money", "transaction", "transfer")
+
+
+def _route_limits():
+    limits = {name: dict(values) for name, values in DEFAULT_LIMITS.items()}
+    for name in _SINGLE_WALLET:
+        limits[name]["in_flight"] = settings.ADMISSION_ACCOUNT_IN_FLIGHT
+    overrides = json.loads(settings.ADMISSION_ROUTE_LIMITS) if settings.ADMISSION_ROUTE_LIMITS else {}
+    for name, values in overrides.items():
+        limits.setdefault(name, dict(DEFAULT_LIMITS["transaction"])).update(values)
+    return limits
+
+
+class _Account:
+    __slots__ = ("in_flight", "waiters")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.waiters = deque()
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int, max_buckets: int, queue_timeout_ms: float,
+                 shed_latency_ms: float, enabled: bool = True):
+        self.max_in_flight = max_in_flight
+        self.max_buckets = max_buckets
+        self.queue_timeout = queue_timeout_ms / 1000
+        self.shed_latency_ms = shed_latency_ms
+        self.enabled = enabled
+        self.limits = _route_limits()
+        self.in_flight = 0
+        # (route, account) -> [tokens, last refill], least recently used first.
+        # Evicting a bucket only forgets that an idle account spent tokens.
+        self._buckets = OrderedDict()
+        # Accounts with requests running or queued; removed when both reach 0.
+        self._accounts = {}
+        self.admitted = 0
+        self.rejected = {"overloaded": 0, "rate_limited": 0, "queue_full": 0, "queue_timeout": 0}
+        self.evictions = 0
+
+    def capacity(self):
+        # Scale the global cap down in proportion to how far Mongo latency is
+        # over target, so a slow database sheds new work instead of queueing it.
+        latency_ms = command_metrics.latency_ewma * 1000
+        if self.shed_latency_ms <= 0 or latency_ms <= self.shed_latency_ms:
+            return self.max_in_flight
+        return max(1, int(self.max_in_flight * self.shed_latency_ms / latency_ms))
+
+    def _take_token(self, route: str, account: str, limits: dict):
+        key = (route, account)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(limits["burst"]), now]
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(float(limits["burst"]), bucket[0] + (now - bucket[1]) * limits["rate"])
+            bucket[1] = now
+        if bucket[0] < 1:
+            return (1 - bucket[0]) / limits["rate"] if limits["rate"] > 0 else None
+        bucket[0] -= 1
+        return 0
+
+    async def _enter_account(self, account: str, limits: dict):
+        state = self._accounts.get(account)
+        if state is None:
+            state = self._accounts[account] = _Account()
+        if state.in_flight < limits["in_flight"] and not state.waiters:
+            state.in_flight += 1
+            return None
+        if len(state.waiters) >= limits["queue"]:
+            return "queue_full"
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout or None)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot just as we gave up: pass it to the next waiter.
+                self._leave_account(account)
+            else:
+                # _leave_account may already have popped it while skipping
+                # done waiters.
+                if waiter in state.waiters:
+                    state.waiters.remove(waiter)
+                self._drop_idle(account, state)
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+            return "queue_timeout"
+        return None
+
+    def _leave_account(self, account: str):
+        state = self._accounts[account]
+        while state.waiters:
+            waiter = state.waiters.popleft()
+            if not waiter.done():
+                # The slot moves to the waiter as is; in_flight stays the same.
+                waiter.set_result(None)
+                return
+        state.in_flight -= 1
+        self._drop_idle(account, state)
+
+    def _drop_idle(self, account: str, state: _Account):
+        if state.in_flight == 0 and not state.waiters:
+            self._accounts.pop(account, None)
+
+    def _reject(self, reason: str, status_code: int, detail: str, retry_after: float):
+        self.rejected[reason] += 1
+        raise HTTPException(status_code=status_code, detail=detail,
+                            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))})
+
+    async def acquire(self, route: str, account):
+        if self.in_flight >= self.capacity():
+            self._reject("overloaded", 503, "Server busy, retry shortly", 1)
+        limits = self.limits[route]
+        if account is not None:
+            wait = self._take_token(route, account, limits)
+            if wait is None or wait > 0:
+                self._reject("rate_limited", 429, "Too many requests for this account", wait or 60)
+        self.in_flight += 1
+        try:
+            if account is not None:
+                reason = await self._enter_account(account, limits)
+                if reason is not None:
+                    self._reject(reason, 429, "Too many concurrent requests for this account", 1)
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        self.admitted += 1
+
+    def release(self, account):
+        self.in_flight -= 1
+        if account is not None:
+            self._leave_account(account)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "in_flight": self.in_flight,
+            "capacity": self.capacity(),
+            "max_in_flight": self.max_in_flight,
+            "accounts_active": len(self._accounts),
+            "buckets": len(self._buckets),
+            "bucket_evictions": self.evictions,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected)
+        }
+
+
+admission = AdmissionController(
+    settings.ADMISSION_MAX_IN_FLIGHT,
+    settings.ADMISSION_MAX_BUCKETS,
+    settings.ADMISSION_QUEUE_TIMEOUT_MS,
+    settings.ADMISSION_SHED_LATENCY_MS,
+    settings.ADMISSION_ENABLED
+)
+
+
+async def _account_id(request: Request, field: str):
+    value = request.path_params.get(field)
+    if value is None:
+        # FastAPI has already read and cached the body for the endpoint.
+        try:
+            body = await request.json()
+        except ValueError:
+            return None
+        value = body.get(field) if isinstance(body, dict) else None
+    return str(value) if value is not None else None
+
+
+def limit(route: str, account_field: str = "user_id"):
+    # Route dependency: Depends(limit("withdraw")). The slot is held until the
+    # endpoint returns.
+    if route not in admission.limits:
+        raise ValueError(f"No admission limits for route {route!r}")
+
+    async def dependency(request: Request):
+        if not admission.enabled:
+            yield
+            return
+        account = await _account_id(request, account_field)
+        await admission.acquire(route, account)
+        try:
+            yield
+        finally:
+            admission.release(account)
+    return dependency
@@ -9,6 +9,17 @@
 #   "created_at": "2024-01-01T00:00:00Z"
 # }
 
+# GET /users?format=json|ndjson&fields=username,balance&after=<user_id>&limit=100
+# Streams users in _id order straight from the cursor; password is never returned.
+# Pass the last user_id of a page as `after` to continue from it.
+
+# GET /users?ids=<user_id>,<user_id>,...
+# Fetches the listed users with one query: {"users": [...], "missing": [ids not found]}.
+
+# GET /users/search?q=jo&field=username|email|phone_number&limit=20&cursor=<next_cursor>
+# Case-insensitive prefix match on one field, ordered by that field. Returns
+# display fields only; pass next_cursor back to fetch the following page.
+
 # PUT /users/{user_id}
 # Request Body:
 # {
@@ -18,39 +29,69 @@
 # Response: 200 OK
 
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket
+from fastapi.responses import StreamingResponse
+from datetime import date, datetime
 from typing import Optional , List 
 from service import *
 from model import *
+from schema import (AnalyticsOut, BalanceOut, BulkTransactionsOut, FastJSONResponse, TransactionOut,
+                    TransactionPage, TransferBatchOut, TransferOut, UserOut, UserSearchPage, WalletOperationOut)
+from admission import limit
+import events
+import settings
+import shards
 
 
-router = APIRouter()
+# Handlers return FastJSONResponse themselves so the body is encoded once,
+# without a jsonable_encoder pass; response_model only documents the shape.
+router = APIRouter(default_response_class=FastJSONResponse)
 
-@router.post("/users", response_model=dict , status_code=201)
+@router.post("/users", response_model=UserOut , status_code=201)
 async def create_new_user(user_data: User):
     user = await create_user(user_data)
+    if "error" in user:
+        raise HTTPException(status_code=400, detail=user["error"])
     if user:
-        return user
+        return FastJSONResponse(user, status_code=201)
     raise HTTPException(status_code=400, detail="User creation failed")
 
 @router.get("/users" , status_code=200)
-async def list_all_users_detail():
-    users = await get_all_users()
-    return users
+async def list_all_users_detail(format: str = "json", fields: Optional[str] = None,
+                                after: Optional[str] = None, limit: Optional[int] = None, ids: Optional[str] = None):
+    if ids is not None:
+        user_ids, error = validate_user_ids(ids)
+        if error:
+            raise HTTPException(status_code=400, detail=error)
+        return FastJSONResponse(await get_users(user_ids))
+    error = validate_user_listing(format, fields, after)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(stream_users(format, fields, after, limit), media_type=media_type)
+
+@router.get("/users/search", response_model=UserSearchPage , status_code=200)
+async def search_users_endpoint(q: str, field: str = "username", limit: int = 20, cursor: Optional[str] = None):
+    result = await search_users(q, field, limit, cursor)
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return FastJSONResponse(result)
 
-@router.get("/users/{user_id}", response_model=dict , status_code=200)
+@router.get("/users/{user_id}", response_model=UserOut , status_code=200)
 async def get_user_details(user_id):
     user = await get_user(user_id)
-    if user:
-        return user
+    if "error" not in user:
+        return FastJSONResponse(user)
     raise HTTPException(status_code=404, detail="User not found")
 
 
-@router.put("/users/{user_id}", response_model=dict , status_code=200)
+@router.put("/users/{user_id}", response_model=UserOut , status_code=200)
 async def update_user_details(user_id, user_data: User):
-    updated_user = await update_user(user_id, user_data)
-    if updated_user:
-        return updated_user
+    updated_user = await update_user(user_id, user_data.model_dump())
+    if "error" not in updated_user:
+        return FastJSONResponse(updated_user)
+    if updated_user["error"] == "Username already exists":
+        raise HTTPException(status_code=400, detail=updated_user["error"])
     raise HTTPException(status_code=404, detail="User not found")
 
 
@@ -87,32 +128,88 @@ async def update_user_details(user_id, user_data: User):
 #   "last_updated": "2024-01-01T12:30:00Z"
 # }
 
-@router.post("/wallet/{user_id}/withdraw", response_model=dict , status_code=201)
+# GET /wallet/{user_id}/balance?as_of=2024-01-01T00:00:00
+# Response: 200 OK
+# {
+#   "user_id": 1,
+#   "as_of": "2024-01-01T00:00:00",
+#   "balance": 120.00,
+#   "checkpoint_as_of": "2023-12-31T18:02:11",
+#   "entries_replayed": 37
+# }
+# Ledger balance at that moment, from the nearest checkpoint plus the
+# entries after it.
+
+# Wallet mutations (withdraw, add-money, POST /transactions, /transfer and
+# /transfer/batch) pass admission control first: 429 with Retry-After when an
+# account exceeds its rate or has too many requests queued, 503 when the
+# server is at its global cap. Requests for one account run one at a time, in
+# arrival order.
+
+@router.post("/wallet/{user_id}/withdraw", response_model=WalletOperationOut , status_code=201,
+             dependencies=[Depends(limit("withdraw"))])
 async def withdraw_money_endpoint(user_id: str, transaction_data: dict):
     amount = transaction_data.get("amount")
     description = transaction_data.get("description")
     result = await withdraw_money(user_id, amount, description)
     if "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
-    return result
+    return FastJSONResponse(result, status_code=201)
 
 
-@router.post("/wallet/{user_id}/add-money", response_model=dict , status_code=201)
+@router.post("/wallet/{user_id}/add-money", response_model=WalletOperationOut , status_code=201,
+             dependencies=[Depends(limit("add_money"))])
 async def add_money_endpoint(user_id: str, transaction_data: dict):
     amount = transaction_data.get("amount")
     description = transaction_data.get("description")
     result = await add_money(user_id, amount, description)
     if "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
-    return result
-
-@router.get("/wallet/{user_id}/balance", response_model=dict , status_code=200)
-async def get_balance(user_id):
-    result = await get_balance(user_id)
-    if result:
-        return result
-    raise HTTPException(status_code=404, detail="User not found")
-
+    return FastJSONResponse(result, status_code=201)
+
+@router.get("/wallet/{user_id}/balance", response_model=BalanceOut , status_code=200)
+async def get_balance_endpoint(user_id, as_of: Optional[datetime] = None):
+    if as_of is not None:
+        result = await get_balance_as_of(user_id, as_of)
+    else:
+        result = await get_balance(user_id)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return FastJSONResponse(result)
+
+# GET /wallet/{user_id}/events   (text/event-stream)
+# id: 3f9a1c02-1841
+# event: balance
+# data: {"user_id": "...", "balance": 150.5, "balance_version": 12, "last_updated": "..."}
+#
+# id: 3f9a1c02-1842
+# event: ledger
+# data: {"transaction_id": "...", "transaction_type": "CREDIT", "amount": 25.0, ...}
+# Reconnect with the Last-Event-ID header (or ?last_event_id=) to receive what
+# was missed. "reset" means the gap could not be replayed: re-read the balance.
+# "evicted" means this client fell too far behind: reconnect from its last id.
+# "unavailable" means live events are off (no replica set): poll instead.
+
+# WS /events/ws
+# Send {"subscribe": user_id, "last_event_id": "..."} or {"unsubscribe": user_id};
+# receive {"id", "type", "user_id", "data"} frames with the same event types.
+
+@router.get("/wallet/{user_id}/events", status_code=200)
+async def wallet_events(user_id: str, request: Request, last_event_id: Optional[str] = None):
+    if "error" in await get_user(user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    if not events.hub.available:
+        raise HTTPException(status_code=503, detail="Live events are unavailable")
+    if events.hub.full():
+        raise HTTPException(status_code=503, detail="Too many subscribers", headers={"Retry-After": "5"})
+    stream = events.sse_stream(user_id, request.headers.get("last-event-id") or last_event_id)
+    return StreamingResponse(stream, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.websocket("/events/ws")
+async def events_socket(websocket: WebSocket):
+    await events.serve_socket(websocket)
 
 
 #transaction endpoint
@@ -128,6 +225,21 @@ async def get_balance(user_id):
 # Response: 201 Created
 
 
+# POST /transactions/bulk?chunk_size=1000
+# Body: JSON array of transactions, or NDJSON (Content-Type: application/x-ndjson)
+# Response: 201 Created
+# {
+#   "inserted": 2,
+#   "failed": 1,
+#   "results": [
+#     {"index": 0, "transaction_id": "..."},
+#     {"index": 1, "error": "User not found"},
+#     {"index": 2, "transaction_id": "..."}
+#   ]
+# }
+# Inserted entries also move the users' balances (one $inc per user per chunk).
+
+
 # GET /transactions/detail/{transaction_id}
 # Response: 200 OK
 # {
@@ -155,29 +267,80 @@ async def get_balance(user_id):
 #   ],
 #   "total": 50,
 #   "page": 1,
-#   "limit": 10
+#   "limit": 10,
+#   "next_cursor": "MjAyNC0wMS0wMVQxMjozMDowMHw2NTk..."
 # }
 
+# GET /transactions/{user_id}/export?format=csv|ndjson&from=2024-01-01T00:00:00&to=2024-01-31T23:59:59&gzip=false
+# Response: 200 OK, streamed as an attachment
+# transaction_id,created_at,transaction_type,amount,description,recipient_user_id,reference_transaction_id
+# 659...,2024-01-01T12:30:00,CREDIT,100.0,Added money,,
+# Whole history in ledger order from a single cursor; gzip=true sends it as
+# a .gz file.
+
+# GET /transactions/{user_id}?cursor=<next_cursor>&limit=10
+# Keyset mode: follows next_cursor from the previous page. "total" is null
+# unless include_total=true is passed.
 
-@router.post("/transactions", response_model=dict , status_code=201)
-async def create_transaction(transaction_data: Transaction):
-    result = await create_transaction(transaction_data)
+
+@router.post("/transactions", status_code=201,
+             dependencies=[Depends(limit("transaction"))])
+async def create_transaction_endpoint(transaction_data: Transaction):
+    result = await create_transaction(transaction_data.model_dump())
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
     if result:
-        return result
+        return FastJSONResponse(result, status_code=201)
     raise HTTPException(status_code=400, detail="Transaction creation failed")
 
-@router.get("/transactions/detail/{transaction_id}", response_model=dict , status_code=200)
+@router.post("/transactions/bulk", response_model=BulkTransactionsOut , status_code=201)
+async def create_transactions_bulk(request: Request, chunk_size: Optional[int] = None):
+    if "ndjson" in request.headers.get("content-type", ""):
+        records = parse_ndjson(request.stream())
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        records = iterate_records(body)
+    if chunk_size is not None and chunk_size <= 0:
+        raise HTTPException(status_code=400, detail="chunk_size must be positive")
+    result = await bulk_create_transactions(records, chunk_size or settings.BULK_CHUNK_SIZE)
+    return FastJSONResponse(result, status_code=201)
+
+@router.get("/transactions/detail/{transaction_id}", response_model=TransactionOut , status_code=200)
 async def get_transaction_detail(transaction_id):
     result = await get_transaction(transaction_id)
-    if result:
-        return result
+    if "error" not in result:
+        return FastJSONResponse(result)
     raise HTTPException(status_code=404, detail="Transaction not found")
 
-@router.get("/transactions/{user_id}", response_model=dict , status_code=200) 
-async def list_transactions(user_id, page: int = 1, limit: int = 10):
-    result = await get_user_transactions(user_id, page, limit)
+@router.get("/transactions/{user_id}/export" , status_code=200)
+async def export_transactions(user_id: str, format: str = "csv", from_: Optional[datetime] = Query(None, alias="from"),
+                              to: Optional[datetime] = None, gzip: bool = False):
+    error = await validate_transaction_export(user_id, format, from_, to)
+    if error:
+        raise HTTPException(status_code=404 if error == "User not found" else 400, detail=error)
+    body = stream_user_transactions(user_id, format, from_, to)
+    filename = f"transactions-{user_id}.{format}"
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    if gzip:
+        body = gzip_chunks(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@router.get("/transactions/{user_id}", response_model=TransactionPage , status_code=200)
+async def list_transactions(user_id, page: int = 1, limit: int = 10,
+                            cursor: Optional[str] = None, include_total: Optional[bool] = None):
+    result = await get_user_transactions(user_id, page, limit, cursor, include_total)
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
     if result:
-        return result
+        return FastJSONResponse(result)
     raise HTTPException(status_code=404, detail="User not found")
 
 
@@ -223,7 +386,8 @@ async def list_transactions(user_id, page: int = 1, limit: int = 10):
 # }
 
 
-@router.post("/transfer", response_model=dict , status_code=201)
+@router.post("/transfer", response_model=TransferOut , status_code=201,
+             dependencies=[Depends(limit("transfer", "sender_user_id"))])
 async def create_transfer(transfer_data: dict):
     # Logic to create a new transfer
     result = await transfer_money(
@@ -232,14 +396,128 @@ async def create_transfer(transfer_data: dict):
         amount=transfer_data["amount"],
         description=transfer_data.get("description")
     )
-    if result:
-        return result
-    raise HTTPException(status_code=400, detail="Transfer creation failed")
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return FastJSONResponse(result, status_code=201)
 
-@router.get("/transfer/{transfer_id}", response_model=dict , status_code=200)
+# POST /transfer/batch
+# Request Body:
+# {
+#   "sender_user_id": 1,
+#   "description": "Payroll June",
+#   "transfers": [
+#     {"recipient_user_id": 2, "amount": 25.00},
+#     {"recipient_user_id": 3, "amount": 40.00, "description": "Bonus"}
+#   ]
+# }
+# Response: 201 Created
+# {
+#   "batch_id": "...",
+#   "status": "completed",
+#   "total_transfers": 2,
+#   "transfers_completed": 2,
+#   "total_amount": 65.00,
+#   "amount_completed": 65.00,
+#   ...
+# }
+# Recipients are settled in chunks, one transaction per chunk. A batch that
+# stops part way reports status "failed" and can be continued with
+# POST /transfer/batch/{batch_id}/resume.
+
+@router.post("/transfer/batch", response_model=TransferBatchOut , status_code=201,
+             dependencies=[Depends(limit("transfer_batch", "sender_user_id"))])
+async def create_transfer_batch(batch_data: dict):
+    result = await transfer_money_batch(
+        sender_id=batch_data.get("sender_user_id"),
+        transfers=batch_data.get("transfers") or [],
+        description=batch_data.get("description"),
+        chunk_size=batch_data.get("chunk_size") or settings.TRANSFER_BATCH_CHUNK_SIZE
+    )
+    if "batch_id" not in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return FastJSONResponse(result, status_code=201)
+
+@router.post("/transfer/batch/{batch_id}/resume", response_model=TransferBatchOut , status_code=200)
+async def resume_transfer_batch_endpoint(batch_id):
+    result = await resume_transfer_batch(batch_id)
+    if "batch_id" not in result:
+        raise HTTPException(status_code=409 if result["error"] == BATCH_BUSY else 404, detail=result["error"])
+    return FastJSONResponse(result)
+
+@router.get("/transfer/batch/{batch_id}", response_model=TransferBatchOut , status_code=200)
+async def get_transfer_batch_detail(batch_id):
+    result = await get_transfer_batch(batch_id)
+    if "batch_id" not in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return FastJSONResponse(result)
+
+@router.get("/transfer/{transfer_id}", response_model=TransactionOut , status_code=200)
 async def get_transfer_detail(transfer_id):
     # Logic to retrieve transfer details by transfer_id
     result = await get_transaction(transfer_id)
-    if result:
-        return result
-    raise HTTPException(status_code=404, detail="Transfer not found")
\ No newline at end of file
+    if "error" not in result:
+        return FastJSONResponse(result)
+    raise HTTPException(status_code=404, detail="Transfer not found")
+
+
+
+# Analytics endpoints
+
+# GET /analytics/{user_id}?from=2024-01-01&to=2024-03-31&granularity=day|week|month
+# Response: 200 OK
+# {
+#   "user_id": 1,
+#   "from": "2024-01-01",
+#   "to": "2024-03-31",
+#   "granularity": "month",
+#   "periods": [
+#     {
+#       "period": "2024-01-01",
+#       "inflow": 300.00,
+#       "outflow": 125.00,
+#       "net": 175.00,
+#       "count": 9,
+#       "by_type": {"CREDIT": {"amount": 300.00, "count": 3}, "DEBIT": {"amount": 125.00, "count": 6}}
+#     }
+#   ],
+#   "totals": {"inflow": 300.00, "outflow": 125.00, "net": 175.00, "count": 9, "by_type": {...}}
+# }
+# Served from the daily rollups only; weeks start on Monday. Defaults to the
+# last 30 days.
+
+@router.get("/analytics/{user_id}", response_model=AnalyticsOut , status_code=200)
+async def get_analytics_endpoint(user_id: str, from_: Optional[date] = Query(None, alias="from"),
+                                 to: Optional[date] = None, granularity: str = "day"):
+    result = await get_analytics(user_id, from_, to, granularity)
+    if "error" in result:
+        raise HTTPException(status_code=404 if result["error"] == "User not found" else 400, detail=result["error"])
+    return FastJSONResponse(result)
+
+
+# Admin endpoints
+
+# POST /admin/wallet/{user_id}/hot
+# Request Body:
+# {
+#   "shards": 8
+# }
+# Spreads the wallet's credits over `shards` counter documents so a busy
+# merchant account stops serialising on one document. Debits drain the
+# shards back as needed; the balance endpoints report the combined total.
+
+# DELETE /admin/wallet/{user_id}/hot
+# Folds the shards back into the wallet and returns it to a single counter.
+
+@router.post("/admin/wallet/{user_id}/hot", status_code=200)
+async def promote_hot_wallet(user_id: str, shard_data: dict):
+    result = await shards.promote(user_id, shard_data.get("shards", 8))
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return FastJSONResponse(result)
+
+@router.delete("/admin/wallet/{user_id}/hot", status_code=200)
+async def demote_hot_wallet(user_id: str):
+    result = await shards.demote(user_id)
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return FastJSONResponse(result)
@@ -0,0 +1,138 @@
+import threading
+from pymongo import monitoring
+import core
+import settings
+
+# Where the benchmarked app keeps its data. "mongod" points the service at a
+# real server and counts wire round trips with command monitoring; "mock"
+# swaps in mongomock-motor, which needs no server but only approximates round
+# trips by counting collection calls and has no transactions.
+
+
+class RoundTrips(monitoring.CommandListener):
+    # Every command sent to the server, getMore included. The driver reports
+    # from its own threads, hence the lock.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, n: int = 1):
+        with self._lock:
+            self.count += n
+
+    def started(self, event):
+        self.add()
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+round_trips = RoundTrips()
+
+
+def use_mongod(uri: str, db_name: str):
+    settings.MONGO_URI = uri
+    settings.MONGO_DB_NAME = db_name
+    core.close()
+    # Registered globally so the client core creates picks it up.
+    monitoring.register(round_trips)
+    return "command_monitoring"
+
+
+# Calls that reach the server once (or start a cursor) on a real deployment.
+_COUNTED = {
+    "find", "find_one", "find_one_and_update", "insert_one", "insert_many", "update_one", "update_many",
+    "replace_one", "delete_one", "delete_many", "bulk_write", "aggregate", "count_documents",
+    "distinct", "create_indexes", "index_information",
+}
+
+
+class _CountingCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in _COUNTED:
+            return attr
+
+        def counted(*args, **kwargs):
+            # mongomock has no sessions; the no-op session below passes None.
+            kwargs.pop("session", None)
+            round_trips.add()
+            return attr(*args, **kwargs)
+        return counted
+
+
+class _MockDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return _CountingCollection(self._database[name])
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+
+class _NoTransactionSession:
+    # Runs the callback once, outside any transaction: enough to exercise the
+    # code path, not its isolation.
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def with_transaction(self, callback):
+        return await callback(None)
+
+
+class _MockAdmin:
+    async def command(self, name, *args, **kwargs):
+        return {"ok": 1.0}
+
+
+class _MockClient:
+    def __init__(self):
+        from mongomock_motor import AsyncMongoMockClient
+        self._client = AsyncMongoMockClient()
+        self.admin = _MockAdmin()
+
+    def __getitem__(self, name):
+        return _MockDatabase(self._client[name])
+
+    async def start_session(self):
+        return _NoTransactionSession()
+
+    def close(self):
+        pass
+
+
+def _patch_mongomock():
+    # pymongo 4.9+ passes sort= to bulk updates and replaces, which mongomock
+    # does not take.
+    import mongomock.collection
+    builder = mongomock.collection.BulkOperationBuilder
+    for name in ("add_update", "add_replace"):
+        original = getattr(builder, name)
+        if getattr(original, "_drops_sort", False):
+            continue
+
+        def drop_sort(self, *args, sort=None, _original=original, **kwargs):
+            return _original(self, *args, **kwargs)
+        drop_sort._drops_sort = True
+        setattr(builder, name, drop_sort)
+
+
+def use_mock(db_name: str):
+    _patch_mongomock()
+    settings.MONGO_DB_NAME = db_name
+    core.close()
+    core._client = _MockClient()
+    return "operation_count"
@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import bson
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import backend  # noqa: E402
+from benchmarks.layouts import _entries, _time  # noqa: E402
+
+# Size and aggregation cost of the two ledger encodings (codec.py). The same
+# entries are written once per layout and encoding into scratch collections;
+# stored document size is measured from the BSON itself, collection and index
+# sizes from collStats (--backend mongod only), and the aggregations the
+# service runs over the ledger are timed against each.
+#
+# python benchmarks/encoding.py --users 1000 --transactions 500 --out encoding.json
+
+
+async def run(args):
+    if args.backend == "mongod":
+        backend.use_mongod(args.mongo_uri, args.db)
+    else:
+        backend.use_mock(args.db)
+
+    from core import db
+    from indexes import INDEXES
+    from ledger import SIGNED_AMOUNT
+    import settings
+    import storage
+
+    stores = {}
+    for version in (1, 2):
+        documents = db[f"transactions_v{version}"]
+        buckets = db[f"ledger_buckets_v{version}"]
+        if args.backend == "mongod":
+            for collection, models in ((documents, INDEXES["transactions"]), (buckets, INDEXES["ledger_buckets"])):
+                await db.drop_collection(collection.name)
+                await collection.create_indexes(models)
+        stores[f"document_v{version}"] = storage.DocumentLedger(documents, version)
+        stores[f"bucketed_v{version}"] = storage.BucketedLedger(buckets, settings.LEDGER_BUCKET_MAX_ENTRIES, version)
+
+    rng = random.Random(args.seed)
+    users = []
+    for user_oid, entries in _entries(args.users, args.transactions, args.days, rng):
+        users.append(user_oid)
+        entries.sort(key=lambda e: e["created_at"])
+        for store in stores.values():
+            await store.insert_many([dict(entry) for entry in entries], ordered=False)
+
+    shapes = {
+        # reconcile.py: every user's ledger sum in one pass.
+        "sum_all_users": lambda store: store.aggregate({}, [
+            {"$group": {"_id": "$user_id", "ledger": {"$sum": SIGNED_AMOUNT}, "entries": {"$sum": 1}}}
+        ], allowDiskUse=True).to_list(length=None),
+        # checkpoints.balance_as_of: one user's replay.
+        "sum_one_user": lambda store: store.aggregate({"user_id": rng.choice(users)}, [
+            {"$group": {"_id": None, "delta": {"$sum": SIGNED_AMOUNT}, "count": {"$sum": 1}}}
+        ]).to_list(length=None),
+    }
+    results = {
+        "meta": {
+            "backend": args.backend,
+            "users": args.users,
+            "transactions_per_user": args.transactions,
+            "samples": args.samples,
+            "bucket_max_entries": settings.LEDGER_BUCKET_MAX_ENTRIES
+        },
+        "sizes": {},
+        "aggregations": {}
+    }
+    for name, store in stores.items():
+        sample = await store.collection.find({}).limit(200).to_list(length=200)
+        sizes = {"avg_document_bytes": round(sum(len(bson.encode(d)) for d in sample) / max(len(sample), 1), 1)}
+        if args.backend == "mongod":
+            info = await db.command("collStats", store.collection.name)
+            sizes.update({
+                "data_bytes": info.get("size", 0),
+                "storage_bytes": info.get("storageSize", 0),
+                "index_bytes": info.get("totalIndexSize", 0),
+                # What has to stay in cache to serve the whole ledger hot.
+                "working_set_bytes": info.get("size", 0) + info.get("totalIndexSize", 0)
+            })
+        results["sizes"][name] = sizes
+        print(f"{name:<12} {sizes['avg_document_bytes']:>10} bytes/document", file=sys.stderr)
+
+    for shape_name, shape in shapes.items():
+        results["aggregations"][shape_name] = {}
+        samples = max(args.samples // 20, 1) if shape_name == "sum_all_users" else args.samples
+        for name, store in stores.items():
+            summary = await _time(lambda: shape(store), samples)
+            results["aggregations"][shape_name][name] = summary
+            print(f"{shape_name:<14} {name:<12} p50 {summary['p50_ms']:>8} ms  p95 {summary['p95_ms']:>8} ms",
+                  file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the v1 and v2 ledger encodings.")
+    parser.add_argument("--backend", choices=("mongod", "mock"), default="mongod")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="wallet_bench_encoding", help="scratch database, its collections are dropped")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=500, help="entries per user")
+    parser.add_argument("--days", type=int, default=365, help="spread entries over this many days")
+    parser.add_argument("--samples", type=int, default=200, help="timed calls per aggregation and store")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
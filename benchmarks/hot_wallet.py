@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+from bson import ObjectId
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import backend  # noqa: E402
+from benchmarks.run import drive, running_app  # noqa: E402
+
+# Write contention on one popular wallet (shards.py). Many senders transfer
+# to the same recipient at once, first with the wallet on a single document
+# and then spread over each requested shard count, and the transfer latency,
+# throughput and error count are compared. Admission control is switched off
+# so the numbers show the storage layer, not the per-account limits.
+# mongomock has no transactions or write conflicts, so only --backend mongod
+# (a replica set) shows the effect.
+#
+# python benchmarks/hot_wallet.py --senders 500 --shards 1,4,16 --concurrency 64 --out hot_wallet.json
+
+
+def _transfer_to(target: str):
+    def request(ctx):
+        return {"json": {"sender_user_id": ctx["rng"].choice(ctx["senders"]), "recipient_user_id": target,
+                         "amount": round(ctx["rng"].uniform(0.01, 1.0), 2), "description": "bench hot"}}
+    return request
+
+
+async def run(args):
+    if args.backend == "mongod":
+        backend.use_mongod(args.mongo_uri, args.db)
+    else:
+        backend.use_mock(args.db)
+
+    from core import db
+    from admission import admission
+    from benchmarks.seed import seed
+    import indexes
+    import settings
+    import shards
+
+    if args.backend == "mongod":
+        for name in await db.list_collection_names():
+            await db.drop_collection(name)
+        await indexes.reconcile_indexes()
+
+    seeded = await seed(args.senders + 1, 1, rng=random.Random(args.seed))
+    target, senders = seeded["user_ids"][0], seeded["user_ids"][1:]
+    admission.enabled = False
+
+    import httpx
+    results = {
+        "meta": {
+            "backend": args.backend,
+            "senders": args.senders,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "credit_strategy": settings.HOT_CREDIT_STRATEGY
+        },
+        "shards": {}
+    }
+    scenario = {"name": "transfer_to_hot_wallet", "method": "POST", "path": lambda ctx: "/transfer",
+                "request": _transfer_to(target)}
+    async with running_app(args.backend) as app:
+        ctx = {"rng": random.Random(args.seed), "senders": senders, "counter": itertools.count()}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            for count in args.shards:
+                changed = await (shards.promote(target, count) if count > 1 else shards.demote(target))
+                if "error" in changed:
+                    raise SystemExit(f"cannot spread the wallet over {count} shards: {changed['error']}")
+                summary = await drive(http, scenario, ctx, args.requests, args.concurrency, args.warmup)
+                summary["final_balance"] = await shards.total_balance(ObjectId(target), use_cache=False)
+                results["shards"][str(count)] = summary
+                print(f"{count:>3} shards  p50 {summary['p50_ms']:>9} ms  p95 {summary['p95_ms']:>9} ms  "
+                      f"p99 {summary['p99_ms']:>9} ms  {summary['throughput_rps']:>8} req/s  "
+                      f"{summary['errors']} errors", file=sys.stderr)
+            await shards.demote(target)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark transfers into one hot wallet per shard count.")
+    parser.add_argument("--backend", choices=("mongod", "mock"), default="mongod")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="wallet_bench_hot", help="scratch database, dropped before seeding")
+    parser.add_argument("--senders", type=int, default=500)
+    parser.add_argument("--shards", default="1,4,16", help="comma separated shard counts, 1 for a plain wallet")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000, help="measured transfers per shard count")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args(argv)
+    args.shards = [int(n) for n in args.shards.split(",")]
+    if args.senders < 1 or any(n < 1 for n in args.shards):
+        parser.error("need at least one sender and shard counts of 1 or more")
+
+    # main.py mounts static/ relative to the working directory.
+    os.chdir(ROOT)
+    results = asyncio.run(run(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
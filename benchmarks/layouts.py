@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from bson import ObjectId
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import backend  # noqa: E402
+from benchmarks.run import _ms, percentile  # noqa: E402
+
+# History reads and on-disk size of the two ledger layouts (storage.py) over
+# the same entries. Both layouts are filled in one scratch database, then each
+# read shape is timed against each. Sizes come from collStats, so they are
+# only reported with --backend mongod.
+#
+# python benchmarks/layouts.py --users 1000 --transactions 500 --out layouts.json
+
+
+def _entries(users: int, per_user: int, days: int, rng: random.Random):
+    now = datetime.now()
+    for _ in range(users):
+        user_oid = ObjectId()
+        yield user_oid, [{
+            "_id": ObjectId(),
+            "user_id": user_oid,
+            "transaction_type": rng.choice(("CREDIT", "CREDIT", "DEBIT")),
+            "amount": round(rng.uniform(1, 100), 2),
+            "description": f"seed {n}",
+            "created_at": now - timedelta(seconds=rng.uniform(0, days * 86400))
+        } for n in range(per_user)]
+
+
+async def _time(call, samples: int):
+    latencies = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {"p50_ms": _ms(percentile(latencies, 0.50)), "p95_ms": _ms(percentile(latencies, 0.95)),
+            "mean_ms": _ms(sum(latencies) / len(latencies))}
+
+
+async def run(args):
+    if args.backend == "mongod":
+        backend.use_mongod(args.mongo_uri, args.db)
+    else:
+        backend.use_mock(args.db)
+
+    from core import db
+    import indexes
+    import settings
+    import storage
+
+    if args.backend == "mongod":
+        for name in ("transactions", "ledger_buckets"):
+            await db.drop_collection(name)
+        await indexes.reconcile_indexes()
+
+    stores = {layout: storage.ledger_for(layout) for layout in ("document", "bucketed")}
+    rng = random.Random(args.seed)
+    users = []
+    entry_ids = []
+    for user_oid, entries in _entries(args.users, args.transactions, args.days, rng):
+        users.append(user_oid)
+        entry_ids.append(entries[-1]["_id"])
+        # Entries arrive in time order, as they would from the service.
+        entries.sort(key=lambda e: e["created_at"])
+        for store in stores.values():
+            await store.insert_many(entries, ordered=False)
+
+    async def deep_cursor(store):
+        rows = await store.history(rng.choice(users), None, 0, 10)
+        return await store.history(rng.choice(users), (rows[-1]["created_at"], rows[-1]["_id"]), 0, 10)
+
+    async def export(store):
+        async for _ in store.range(rng.choice(users)):
+            pass
+
+    shapes = {
+        "history_first_page": lambda store: store.history(rng.choice(users), None, 0, 10),
+        "history_page_10": lambda store: store.history(rng.choice(users), None, 90, 10),
+        "history_cursor_page": deep_cursor,
+        "history_count": lambda store: store.count(rng.choice(users)),
+        "transaction_by_id": lambda store: store.get(rng.choice(entry_ids)),
+        "export_full_history": export,
+    }
+    results = {
+        "meta": {
+            "backend": args.backend,
+            "users": args.users,
+            "transactions_per_user": args.transactions,
+            "days": args.days,
+            "samples": args.samples,
+            "bucket_max_entries": settings.LEDGER_BUCKET_MAX_ENTRIES,
+            "bucket_period": settings.LEDGER_BUCKET_PERIOD
+        },
+        "reads": {}
+    }
+    for name, shape in shapes.items():
+        results["reads"][name] = {}
+        for layout, store in stores.items():
+            summary = await _time(lambda: shape(store), args.samples)
+            results["reads"][name][layout] = summary
+            print(f"{name:<22} {layout:<9} p50 {summary['p50_ms']:>8} ms  p95 {summary['p95_ms']:>8} ms",
+                  file=sys.stderr)
+    if args.backend == "mongod":
+        results["sizes"] = await storage.layout_stats()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the document and bucketed ledger layouts.")
+    parser.add_argument("--backend", choices=("mongod", "mock"), default="mongod")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="wallet_bench_layouts", help="scratch database, ledger collections are dropped")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=500, help="entries per user (at least 100)")
+    parser.add_argument("--days", type=int, default=365, help="spread entries over this many days")
+    parser.add_argument("--samples", type=int, default=500, help="timed calls per read shape and layout")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args(argv)
+    if args.transactions < 100:
+        parser.error("need at least 100 entries per user for the page-10 read")
+
+    results = asyncio.run(run(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
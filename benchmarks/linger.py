@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import backend  # noqa: E402
+from benchmarks.run import drive, running_app  # noqa: E402
+from benchmarks.scenarios import SCENARIOS  # noqa: E402
+
+# Throughput against latency for the ledger group commit (ledger.py). The same
+# write scenario is driven once per max linger setting, plus once with group
+# commit off, and the writer's average batch size is reported next to the
+# request latencies. Admission control is switched off so only the writer
+# shapes the numbers. Only --backend mongod has a real write round trip to
+# amortize; mock runs are a smoke test.
+#
+# python benchmarks/linger.py --linger off,0,1,2,5,10 --scenario add_money --concurrency 128 --out linger.json
+
+
+async def run(args):
+    if args.backend == "mongod":
+        backend.use_mongod(args.mongo_uri, args.db)
+    else:
+        backend.use_mock(args.db)
+
+    from core import db
+    from admission import admission
+    from benchmarks.seed import seed
+    from ledger import ledger_writer
+    import indexes
+
+    if args.backend == "mongod":
+        for name in await db.list_collection_names():
+            await db.drop_collection(name)
+        await indexes.reconcile_indexes()
+
+    seeded = await seed(args.users, 1, rng=random.Random(args.seed))
+    admission.enabled = False
+    scenario = next(s for s in SCENARIOS if s["name"] == args.scenario)
+
+    import httpx
+    results = {
+        "meta": {
+            "backend": args.backend,
+            "scenario": args.scenario,
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "max_batch": args.max_batch
+        },
+        "linger": {}
+    }
+    async with running_app(args.backend) as app:
+        ctx = {"rng": random.Random(args.seed), "user_ids": seeded["user_ids"],
+               "transaction_ids": seeded["transaction_ids"], "counter": itertools.count()}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            for linger in args.linger:
+                await ledger_writer.stop()
+                ledger_writer.enabled = linger is not None
+                ledger_writer.max_linger_ms = linger or 0.0
+                ledger_writer.max_batch = args.max_batch
+                ledger_writer.start()
+                batches, entries = ledger_writer.batches, ledger_writer.entries
+                summary = await drive(http, scenario, ctx, args.requests, args.concurrency, args.warmup)
+                written = ledger_writer.batches - batches
+                summary["avg_batch_size"] = round((ledger_writer.entries - entries) / written, 2) if written else None
+                label = "off" if linger is None else f"{linger:g}"
+                results["linger"][label] = summary
+                print(f"linger {label:>5}  p50 {summary['p50_ms']:>9} ms  p99 {summary['p99_ms']:>9} ms  "
+                      f"{summary['throughput_rps']:>8} req/s  batch {summary['avg_batch_size']}", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ledger group commit across linger settings.")
+    parser.add_argument("--backend", choices=("mongod", "mock"), default="mongod")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="wallet_bench_linger", help="scratch database, dropped before seeding")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--scenario", default="add_money", choices=[s["name"] for s in SCENARIOS if s.get("write")])
+    parser.add_argument("--linger", default="off,0,1,2,5,10",
+                        help="comma separated max linger values in ms, 'off' for no group commit")
+    parser.add_argument("--max-batch", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--requests", type=int, default=5000, help="measured requests per linger setting")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args(argv)
+    try:
+        args.linger = [None if v == "off" else float(v) for v in args.linger.split(",")]
+    except ValueError:
+        parser.error("--linger takes numbers of milliseconds or 'off'")
+    if args.users < 2 or any(v is not None and v < 0 for v in args.linger):
+        parser.error("need at least two users and non-negative linger values")
+
+    # main.py mounts static/ relative to the working directory.
+    os.chdir(ROOT)
+    results = asyncio.run(run(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
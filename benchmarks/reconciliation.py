@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from bson import ObjectId
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import backend  # noqa: E402
+
+# Full reconciliation pass (reconcile.py) over a large ledger: the default
+# seeds 100k users with 100 entries each, 10M ledger rows, skews the stored
+# balance of --drift users, then times one run per worker count. Each run
+# must report exactly the skewed users. Seeding 10M rows takes a while and
+# needs a real server; use --users/--transactions to scale down with --backend
+# mock.
+#
+# python benchmarks/reconciliation.py --users 100000 --transactions 100 --workers 1,4,8 --out reconcile.json
+
+
+async def run(args):
+    if args.backend == "mongod":
+        backend.use_mongod(args.mongo_uri, args.db)
+    else:
+        backend.use_mock(args.db)
+
+    from core import db, users_collection
+    from benchmarks.seed import seed
+    import indexes
+    import reconcile
+
+    if args.backend == "mongod":
+        for name in await db.list_collection_names():
+            await db.drop_collection(name)
+        await indexes.reconcile_indexes()
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    seeded = await seed(args.users, args.transactions, rng=rng)
+    seed_seconds = time.perf_counter() - started
+    drifted = rng.sample(seeded["user_ids"], min(args.drift, args.users))
+    for user_id in drifted:
+        await users_collection.update_one({"_id": ObjectId(user_id)}, {"$inc": {"balance": 1.0}})
+
+    rows = args.users * args.transactions
+    results = {
+        "meta": {
+            "backend": args.backend,
+            "users": args.users,
+            "transactions_per_user": args.transactions,
+            "ledger_rows": rows,
+            "partition_size": args.partition_size,
+            "drift": len(drifted),
+            "seed_seconds": round(seed_seconds, 1)
+        },
+        "workers": {}
+    }
+    for workers in args.workers:
+        started = time.perf_counter()
+        summary = await reconcile.reconcile(workers=workers, partition_size=args.partition_size, restart=True)
+        elapsed = time.perf_counter() - started
+        if summary["users_checked"] != args.users or summary["mismatches"] != len(drifted):
+            raise SystemExit(f"{workers} workers: checked {summary['users_checked']} users and found "
+                             f"{summary['mismatches']} mismatches, expected {args.users} and {len(drifted)}")
+        results["workers"][str(workers)] = {
+            "seconds": round(elapsed, 2),
+            "partitions": summary["partitions"],
+            "rows_per_second": round(rows / elapsed),
+            "users_per_second": round(args.users / elapsed)
+        }
+        print(f"{workers:>3} workers  {elapsed:>9.2f} s  {rows / elapsed:>12.0f} rows/s  "
+              f"{summary['partitions']} partitions", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time a full reconciliation pass over a large ledger.")
+    parser.add_argument("--backend", choices=("mongod", "mock"), default="mongod")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="wallet_bench_reconcile", help="scratch database, dropped before seeding")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--transactions", type=int, default=100, help="ledger entries per user")
+    parser.add_argument("--drift", type=int, default=100, help="users whose stored balance is skewed")
+    parser.add_argument("--partition-size", type=int, default=1000)
+    parser.add_argument("--workers", default="1,4,8", help="comma separated worker counts, one run each")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args(argv)
+    args.workers = [int(n) for n in args.workers.split(",")]
+    if args.users < 1 or args.transactions < 1 or any(n < 1 for n in args.workers):
+        parser.error("users, transactions and worker counts must be at least 1")
+
+    results = asyncio.run(run(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
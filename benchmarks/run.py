@@ -0,0 +1,243 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import backend  # noqa: E402
+from benchmarks.scenarios import SCENARIOS  # noqa: E402
+
+# End-to-end latency of every route: the FastAPI app from main.py runs
+# in-process behind httpx's ASGI transport, against a scratch database on a
+# local mongod (or mongomock-motor with --backend mock). mongomock scans every
+# document per query, so keep volumes small there and treat its numbers as a
+# smoke run rather than something to compare with mongod.
+#
+# python benchmarks/run.py --users 1000 --transactions 50 --concurrency 16 --requests 500 --out results.json
+# python benchmarks/run.py --only transfer,balance --compare results.json   flag regressions against a saved run
+
+
+def percentile(sorted_values: list, fraction: float):
+    # Nearest rank, so every reported value is a latency that was observed.
+    if not sorted_values:
+        return None
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def summarize(latencies: list, errors: int, wall: float, round_trips: int):
+    ordered = sorted(latencies)
+    requests = len(latencies)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / wall, 1) if wall else 0.0,
+        "mean_ms": _ms(sum(ordered) / requests) if requests else None,
+        "p50_ms": _ms(percentile(ordered, 0.50)),
+        "p95_ms": _ms(percentile(ordered, 0.95)),
+        "p99_ms": _ms(percentile(ordered, 0.99)),
+        "max_ms": _ms(ordered[-1]) if ordered else None,
+        "round_trips_per_request": round(round_trips / requests, 2) if requests else None
+    }
+
+
+async def drive(http, scenario: dict, ctx: dict, requests: int, concurrency: int, warmup: int):
+    async def call():
+        kwargs = scenario["request"](ctx) if "request" in scenario else {}
+        started = time.perf_counter()
+        response = await http.request(scenario["method"], scenario["path"](ctx), **kwargs)
+        await response.aread()
+        return time.perf_counter() - started, response.status_code >= 400
+
+    for _ in range(warmup):
+        await call()
+
+    latencies = []
+    errors = 0
+    remaining = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while next(remaining) < requests:
+            latency, failed = await call()
+            latencies.append(latency)
+            errors += failed
+
+    before = backend.round_trips.count
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    return summarize(latencies, errors, wall, backend.round_trips.count - before)
+
+
+@asynccontextmanager
+async def running_app(mode: str):
+    import main
+    from ledger import ledger_writer
+    from shards import refresh_hot_accounts
+    if mode == "mongod":
+        async with main.lifespan(main.app):
+            yield main.app
+        return
+    # mongomock cannot serve change streams or index builds; start only the
+    # pieces the request paths depend on.
+    import rollups
+    await rollups.mark_live()
+    ledger_writer.start()
+    await refresh_hot_accounts()
+    try:
+        yield main.app
+    finally:
+        await ledger_writer.stop()
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=ROOT).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        checks = [
+            ("p95_ms", current["p95_ms"], previous["p95_ms"], 1),
+            ("p99_ms", current["p99_ms"], previous["p99_ms"], 1),
+            ("throughput_rps", current["throughput_rps"], previous["throughput_rps"], -1),
+            ("round_trips_per_request", current["round_trips_per_request"], previous["round_trips_per_request"], 1),
+        ]
+        for metric, now, before, direction in checks:
+            if now is None or not before:
+                continue
+            change = (now - before) / before
+            if direction * change > threshold:
+                regressions.append({"scenario": name, "metric": metric, "baseline": before,
+                                    "current": now, "change": round(change, 3)})
+    return regressions
+
+
+async def run(args):
+    if args.backend == "mongod":
+        source = backend.use_mongod(args.mongo_uri, args.db)
+    else:
+        source = backend.use_mock(args.db)
+
+    from core import db
+    from admission import admission
+    from benchmarks.seed import seed
+    import indexes
+    import rollups
+
+    if args.backend == "mongod":
+        for name in await db.list_collection_names():
+            await db.drop_collection(name)
+        await indexes.reconcile_indexes()
+
+    seed_started = time.perf_counter()
+    seeded = await seed(args.users, args.transactions, rng=random.Random(args.seed))
+    seed_seconds = time.perf_counter() - seed_started
+    # Set explicitly so a run measures the routes, not whatever limits the
+    # environment happens to configure.
+    admission.enabled = args.admission == "on"
+
+    selected = [s for s in SCENARIOS if not args.only or s["name"] in args.only.split(",")]
+    if args.skip_writes:
+        selected = [s for s in selected if not s.get("write")]
+
+    import httpx
+    results = {
+        "meta": {
+            "backend": args.backend,
+            "round_trip_source": source,
+            "users": args.users,
+            "transactions_per_user": args.transactions,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "admission": args.admission,
+            "seed_seconds": round(seed_seconds, 2),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "started_at": datetime.now().isoformat()
+        },
+        "scenarios": {}
+    }
+    async with running_app(args.backend) as app:
+        await rollups.backfill()
+        ctx = {
+            "rng": random.Random(args.seed),
+            "user_ids": seeded["user_ids"],
+            "transaction_ids": seeded["transaction_ids"],
+            "counter": itertools.count()
+        }
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            for scenario in selected:
+                summary = await drive(http, scenario, ctx, args.requests, args.concurrency, args.warmup)
+                results["scenarios"][scenario["name"]] = summary
+                print(f"{scenario['name']:<22} p50 {summary['p50_ms']:>9} ms  p95 {summary['p95_ms']:>9} ms  "
+                      f"p99 {summary['p99_ms']:>9} ms  {summary['throughput_rps']:>8} req/s  "
+                      f"{summary['round_trips_per_request']} rt/req  {summary['errors']} errors", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every API route in-process.")
+    parser.add_argument("--backend", choices=("mongod", "mock"), default="mongod")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="wallet_bench", help="scratch database, dropped before seeding")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=50, help="seeded ledger entries per user (at least 1)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", help="comma separated scenario names")
+    parser.add_argument("--skip-writes", action="store_true", help="run read-only scenarios only")
+    parser.add_argument("--admission", choices=("off", "on"), default="off",
+                        help="per-account admission limits; on measures them with the configured defaults")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change that counts as a regression")
+    args = parser.parse_args(argv)
+    if args.transactions < 1 or args.users < 2:
+        parser.error("need at least 2 users and 1 transaction per user")
+
+    # main.py mounts static/ relative to the working directory.
+    os.chdir(ROOT)
+    results = asyncio.run(run(args))
+    if args.compare:
+        with open(args.compare) as f:
+            results["regressions"] = compare(results, json.load(f), args.threshold)
+        for regression in results["regressions"]:
+            print(f"REGRESSION {regression['scenario']} {regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.1%})", file=sys.stderr)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+from datetime import date, datetime, timedelta
+
+# One entry per route. Each builder gets the seeded ids and a random source
+# and returns the keyword arguments for httpx's request(). Write scenarios use
+# small amounts against the large seeded balances so they keep succeeding.
+
+
+def _user(ctx):
+    return ctx["rng"].choice(ctx["user_ids"])
+
+
+def _pair(ctx):
+    sender, recipient = ctx["rng"].sample(ctx["user_ids"], 2)
+    return sender, recipient
+
+
+def _amount(ctx):
+    return round(ctx["rng"].uniform(0.01, 1.0), 2)
+
+
+def _transfer(ctx):
+    sender, recipient = _pair(ctx)
+    return {"json": {"sender_user_id": sender, "recipient_user_id": recipient, "amount": _amount(ctx)}}
+
+
+def _transfer_batch(ctx):
+    sender = _user(ctx)
+    recipients = ctx["rng"].sample([u for u in ctx["user_ids"] if u != sender], min(50, len(ctx["user_ids"]) - 1))
+    return {"json": {
+        "sender_user_id": sender,
+        "transfers": [{"recipient_user_id": r, "amount": _amount(ctx)} for r in recipients]
+    }}
+
+
+def _bulk(ctx):
+    now = datetime.now().isoformat()
+    return {"json": [
+        {"user_id": _user(ctx), "transaction_type": "CREDIT", "amount": _amount(ctx),
+         "description": "bench bulk", "timestamp": now}
+        for _ in range(100)
+    ]}
+
+
+def _search(field: str, prefix):
+    # A seeded user's value cut to a few characters, so pages hold real matches.
+    def request(ctx):
+        n = ctx["rng"].randrange(len(ctx["user_ids"]))
+        return {"params": {"q": prefix(n), "field": field, "limit": 20}}
+    return request
+
+
+def _create_user(ctx):
+    n = next(ctx["counter"])
+    return {"json": {"username": f"bench_new_{n}", "email": f"bench_new_{n}@example.com", "password": "bench"}}
+
+
+SCENARIOS = [
+    {"name": "create_user", "method": "POST", "path": lambda ctx: "/users", "request": _create_user, "write": True},
+    {"name": "list_users", "method": "GET", "path": lambda ctx: "/users", "request": lambda ctx: {"params": {"limit": 100}}},
+    {"name": "get_user", "method": "GET", "path": lambda ctx: f"/users/{_user(ctx)}"},
+    {"name": "get_users_batch", "method": "GET", "path": lambda ctx: "/users",
+     "request": lambda ctx: {"params": {"ids": ",".join(ctx["rng"].sample(ctx["user_ids"], min(20, len(ctx["user_ids"]))))}}},
+    {"name": "search_username", "method": "GET", "path": lambda ctx: "/users/search",
+     "request": _search("username", lambda n: f"BENCH_{n}"[:9])},
+    {"name": "search_email", "method": "GET", "path": lambda ctx: "/users/search",
+     "request": _search("email", lambda n: f"bench_{n}@"[:10])},
+    {"name": "search_phone", "method": "GET", "path": lambda ctx: "/users/search",
+     "request": _search("phone_number", lambda n: f"+1555{n:07d}"[:9])},
+    {"name": "balance", "method": "GET", "path": lambda ctx: f"/wallet/{_user(ctx)}/balance"},
+    {"name": "balance_as_of", "method": "GET", "path": lambda ctx: f"/wallet/{_user(ctx)}/balance",
+     "request": lambda ctx: {"params": {"as_of": (datetime.now() - timedelta(days=30)).isoformat()}}},
+    {"name": "add_money", "method": "POST", "path": lambda ctx: f"/wallet/{_user(ctx)}/add-money",
+     "request": lambda ctx: {"json": {"amount": _amount(ctx), "description": "bench"}}, "write": True},
+    {"name": "withdraw", "method": "POST", "path": lambda ctx: f"/wallet/{_user(ctx)}/withdraw",
+     "request": lambda ctx: {"json": {"amount": _amount(ctx), "description": "bench"}}, "write": True},
+    {"name": "create_transaction", "method": "POST", "path": lambda ctx: "/transactions",
+     "request": lambda ctx: {"json": {"user_id": _user(ctx), "transaction_type": "CREDIT", "amount": _amount(ctx),
+                                      "description": "bench", "timestamp": datetime.now().isoformat()}},
+     "write": True},
+    {"name": "bulk_transactions", "method": "POST", "path": lambda ctx: "/transactions/bulk", "request": _bulk, "write": True},
+    {"name": "transaction_detail", "method": "GET",
+     "path": lambda ctx: f"/transactions/detail/{ctx['rng'].choice(ctx['transaction_ids'])}"},
+    {"name": "transactions_page", "method": "GET", "path": lambda ctx: f"/transactions/{_user(ctx)}",
+     "request": lambda ctx: {"params": {"limit": 100}}},
+    {"name": "transactions_keyset", "method": "GET", "path": lambda ctx: f"/transactions/{_user(ctx)}",
+     "request": lambda ctx: {"params": {"limit": 100, "include_total": "false"}}},
+    {"name": "transactions_export", "method": "GET", "path": lambda ctx: f"/transactions/{_user(ctx)}/export"},
+    {"name": "analytics", "method": "GET", "path": lambda ctx: f"/analytics/{_user(ctx)}",
+     "request": lambda ctx: {"params": {"from": (date.today() - timedelta(days=90)).isoformat(), "granularity": "week"}}},
+    {"name": "transfer", "method": "POST", "path": lambda ctx: "/transfer", "request": _transfer, "write": True},
+    {"name": "transfer_batch", "method": "POST", "path": lambda ctx: "/transfer/batch", "request": _transfer_batch, "write": True},
+]
@@ -0,0 +1,68 @@
+import random
+from bson import ObjectId
+from datetime import datetime, timedelta
+from core import users_collection
+from model import BALANCE_SIGN, TransactionType
+from storage import ledger_store
+
+# Synthetic users with a ledger spread over the last `days` days. Balances are
+# the sum of each user's entries, so reconciliation starts clean, and every
+# wallet holds enough for the debit and transfer scenarios.
+
+_TYPES = [TransactionType.CREDIT, TransactionType.CREDIT, TransactionType.DEBIT]
+
+
+async def seed(users: int, transactions_per_user: int, days: int = 90, chunk_size: int = 10_000,
+               opening_credit: float = 1_000_000.0, rng: random.Random = None):
+    rng = rng or random.Random(42)
+    now = datetime.now()
+    user_ids = []
+    entries = []
+    transaction_ids = []
+
+    async def flush():
+        if entries:
+            await ledger_store.insert_many(entries, ordered=False)
+            entries.clear()
+
+    user_docs = []
+    for i in range(users):
+        user_oid = ObjectId()
+        user_ids.append(user_oid)
+        balance = 0.0
+        first = now - timedelta(days=days)
+        for n in range(transactions_per_user):
+            transaction_type = TransactionType.CREDIT if n == 0 else rng.choice(_TYPES)
+            amount = opening_credit if n == 0 else round(rng.uniform(1, 100), 2)
+            balance += BALANCE_SIGN[transaction_type] * amount
+            tx_oid = ObjectId()
+            entries.append({
+                "_id": tx_oid,
+                "user_id": user_oid,
+                "transaction_type": transaction_type.value,
+                "amount": amount,
+                "description": f"seed {n}",
+                "created_at": first + timedelta(seconds=rng.uniform(0, days * 86400)) if n else first
+            })
+            if n == transactions_per_user - 1:
+                transaction_ids.append(tx_oid)
+            if len(entries) >= chunk_size:
+                await flush()
+        user_docs.append({
+            "_id": user_oid,
+            "username": f"bench_{i}",
+            "email": f"bench_{i}@example.com",
+            "password": "bench",
+            "phone_number": f"+1555{i:07d}",
+            "balance": balance,
+            "balance_version": 0,
+            "created_at": now,
+            "updated_at": now
+        })
+        if len(user_docs) >= chunk_size:
+            await users_collection.insert_many(user_docs, ordered=False)
+            user_docs = []
+    if user_docs:
+        await users_collection.insert_many(user_docs, ordered=False)
+    await flush()
+    return {"user_ids": [str(u) for u in user_ids], "transaction_ids": [str(t) for t in transaction_ids]}
@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from bson import ObjectId
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.run import _ms, percentile  # noqa: E402
+
+# CPU time per response body for one page of transaction history, built from
+# the BSON documents the ledger returns. "before" is the previous path: a
+# hand-built dict run through FastAPI's jsonable_encoder and its stdlib
+# JSONResponse; "stdlib" is schema.dumps without orjson installed, and
+# "orjson" the default FastJSONResponse. No database is involved.
+#
+# python benchmarks/serialization.py --rows 100 --samples 5000 --out serialization.json
+
+
+def _documents(rows: int, rng: random.Random):
+    now = datetime.now()
+    user_oid = ObjectId()
+    return [{
+        "_id": ObjectId(),
+        "user_id": user_oid,
+        "transaction_type": rng.choice(("CREDIT", "DEBIT", "TRANSFER_IN", "TRANSFER_OUT")),
+        "amount": round(rng.uniform(1, 100), 2),
+        "description": f"bench {n}",
+        "created_at": now - timedelta(seconds=n * 60)
+    } for n in range(rows)]
+
+
+def _before(documents):
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    page = {
+        "transactions": [{
+            "transaction_id": str(doc["_id"]),
+            "transaction_type": doc["transaction_type"],
+            "amount": doc["amount"],
+            "description": doc.get("description"),
+            "created_at": doc["created_at"]
+        } for doc in documents],
+        "limit": len(documents),
+        "next_cursor": None
+    }
+    return JSONResponse(jsonable_encoder(page)).body
+
+
+def _fast(documents):
+    from schema import FastJSONResponse, transaction_summary
+    page = {"transactions": [transaction_summary(doc) for doc in documents], "limit": len(documents),
+            "next_cursor": None}
+    return FastJSONResponse(page).body
+
+
+def _time(render, documents, samples: int):
+    times = []
+    for _ in range(samples):
+        started = time.process_time()
+        render(documents)
+        times.append(time.process_time() - started)
+    times.sort()
+    return {"p50_ms": _ms(percentile(times, 0.50)), "p95_ms": _ms(percentile(times, 0.95)),
+            "mean_ms": _ms(sum(times) / len(times))}
+
+
+def run(args):
+    import schema
+    documents = _documents(args.rows, random.Random(args.seed))
+    expected = json.loads(_before(documents))
+    orjson = schema.orjson
+    results = {"meta": {"rows": args.rows, "samples": args.samples, "orjson": orjson is not None},
+               "paths": {"before": _time(_before, documents, args.samples)}}
+    schema.orjson = None
+    try:
+        assert json.loads(_fast(documents)) == expected
+        results["paths"]["stdlib"] = _time(_fast, documents, args.samples)
+    finally:
+        schema.orjson = orjson
+    if orjson is not None:
+        assert json.loads(_fast(documents)) == expected
+        results["paths"]["orjson"] = _time(_fast, documents, args.samples)
+    results["meta"]["body_bytes"] = len(_fast(documents))
+    for name, timing in results["paths"].items():
+        print(f"{name:>7}  p50 {timing['p50_ms']:>8} ms  p95 {timing['p95_ms']:>8} ms  "
+              f"mean {timing['mean_ms']:>8} ms", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CPU time to serialize one page of transaction history.")
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--samples", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args(argv)
+    if args.rows < 1 or args.samples < 1:
+        parser.error("rows and samples must be at least 1")
+
+    results = run(args)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import backend  # noqa: E402
+from benchmarks.run import drive, running_app  # noqa: E402
+from benchmarks.scenarios import SCENARIOS  # noqa: E402
+
+# Transfer throughput (service.transfer_money, one multi-document transaction
+# per transfer) at each client concurrency. Pairs are drawn at random from the
+# seeded users, so higher concurrency also means more write conflicts and
+# transaction retries. Transactions need a replica set; a single node started
+# with --replSet is enough. Admission control is switched off so only the
+# transfer path shapes the numbers.
+#
+# python benchmarks/transfer.py --users 1000 --concurrency 1,16,128 --requests 2000 --out transfer.json
+
+
+async def run(args):
+    if args.backend == "mongod":
+        backend.use_mongod(args.mongo_uri, args.db)
+    else:
+        backend.use_mock(args.db)
+
+    from core import db
+    from admission import admission
+    from benchmarks.seed import seed
+    import indexes
+
+    if args.backend == "mongod":
+        hello = await db.command("hello")
+        if "setName" not in hello:
+            raise SystemExit("transfers need a replica set; start mongod with --replSet and initiate it")
+        for name in await db.list_collection_names():
+            await db.drop_collection(name)
+        await indexes.reconcile_indexes()
+
+    seeded = await seed(args.users, 1, rng=random.Random(args.seed))
+    admission.enabled = False
+    scenario = next(s for s in SCENARIOS if s["name"] == "transfer")
+
+    import httpx
+    results = {
+        "meta": {
+            "backend": args.backend,
+            "users": args.users,
+            "requests": args.requests
+        },
+        "concurrency": {}
+    }
+    async with running_app(args.backend) as app:
+        ctx = {"rng": random.Random(args.seed), "user_ids": seeded["user_ids"],
+               "transaction_ids": seeded["transaction_ids"], "counter": itertools.count()}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            for concurrency in args.concurrency:
+                summary = await drive(http, scenario, ctx, args.requests, concurrency, args.warmup)
+                results["concurrency"][str(concurrency)] = summary
+                print(f"{concurrency:>4} clients  p50 {summary['p50_ms']:>9} ms  p99 {summary['p99_ms']:>9} ms  "
+                      f"{summary['throughput_rps']:>8} transfers/s  {summary['round_trips_per_request']} round trips  "
+                      f"{summary['errors']} errors", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark transfer throughput per client concurrency.")
+    parser.add_argument("--backend", choices=("mongod", "mock"), default="mongod")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="wallet_bench_transfer", help="scratch database, dropped before seeding")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", default="1,16,128", help="comma separated client counts, one run each")
+    parser.add_argument("--requests", type=int, default=2000, help="measured transfers per concurrency")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args(argv)
+    args.concurrency = [int(n) for n in args.concurrency.split(",")]
+    if args.users < 2 or any(n < 1 for n in args.concurrency):
+        parser.error("need at least two users and client counts of 1 or more")
+
+    # main.py mounts static/ relative to the working directory.
+    os.chdir(ROOT)
+    results = asyncio.run(run(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
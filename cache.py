@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BalanceCache:
+    # Bounded LRU of user_id -> balance with a TTL. Entries carry the user's
+    # balance_version so a slow reader can never overwrite a newer write-through.
+
+    def __init__(self, max_entries: int, ttl_seconds: float, enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str):
+        if not self.enabled:
+            return None
+        entry = self._entries.get(user_id)
+        if entry is None or entry["expires_at"] <= time.monotonic():
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry
+
+    def put(self, user_id: str, balance: float, updated_at=None, version: int = 0):
+        if not self.enabled:
+            return
+        current = self._entries.get(user_id)
+        if current is not None and current["version"] > version:
+            return
+        self._entries[user_id] = {
+            "balance": balance,
+            "updated_at": updated_at,
+            "version": version,
+            "expires_at": time.monotonic() + self.ttl_seconds
+        }
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, user_id: str, version: int = None):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        # Our own write-throughs come back on the change stream too; those are
+        # already reflected in the entry.
+        if version is not None and entry["version"] >= version:
+            return
+        del self._entries[user_id]
+        self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+
+balance_cache = BalanceCache(
+    settings.BALANCE_CACHE_MAX_ENTRIES,
+    settings.BALANCE_CACHE_TTL_SECONDS,
+    settings.BALANCE_CACHE_ENABLED
+)
+
+
+async def watch_balance_changes(collection, cache: BalanceCache = balance_cache):
+    pipeline = [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+    while True:
+        try:
+            async with collection.watch(pipeline) as stream:
+                async for change in stream:
+                    user_id = str(change["documentKey"]["_id"])
+                    updated = change.get("updateDescription", {}).get("updatedFields", {})
+                    if change["operationType"] == "update" and "balance" not in updated:
+                        continue
+                    cache.invalidate(user_id, updated.get("balance_version"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Changes made while the stream was down were never seen, so start
+            # from an empty cache rather than trying to resume.
+            logger.warning("balance change stream interrupted, clearing cache: %s", e)
+            cache.clear()
+            await asyncio.sleep(1)
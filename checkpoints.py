@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import logging
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+from pymongo import DeleteMany
+from pymongo.errors import DuplicateKeyError
+from core import balance_checkpoints_collection, jobs_collection
+from ledger import SIGNED_AMOUNT
+from model import BALANCE_SIGN, TransactionType
+from storage import ledger_store
+import settings
+
+logger = logging.getLogger(__name__)
+
+# A checkpoint records the running ledger balance of one user up to and
+# including the entry (as_of, last_tx_id), in (created_at, _id) order. The
+# balance at time T is the nearest checkpoint at or before T plus the entries
+# between it and T, so the replay never covers more than CHECKPOINT_EVERY
+# entries once an account is checkpointed.
+#
+# Every worker runs the periodic pass, so two passes can checkpoint the same
+# user at once. They compute the same checkpoints, and each is written as an
+# upsert on the unique (user_id, last_tx_id) pair, so the second one is a
+# no-op rather than a duplicate.
+
+_CHECKPOINT_SORT = [("as_of", -1), ("last_tx_id", -1)]
+
+
+def _after(created_at: datetime, tx_id: ObjectId):
+    return {"$or": [
+        {"created_at": {"$gt": created_at}},
+        {"created_at": created_at, "_id": {"$gt": tx_id}}
+    ]}
+
+
+async def checkpoint_user(user_oid: ObjectId, every: int = None, until: datetime = None):
+    # Continues from the user's latest checkpoint, so an interrupted run just
+    # picks up where it stopped.
+    every = every or settings.CHECKPOINT_EVERY
+    until = until or datetime.now() - timedelta(seconds=settings.CHECKPOINT_LAG_SECONDS)
+
+    last = await balance_checkpoints_collection.find_one({"user_id": user_oid}, sort=_CHECKPOINT_SORT)
+    balance = last["balance"] if last else 0.0
+    entries = last["entries"] if last else 0
+
+    query = {"user_id": user_oid, "created_at": {"$lte": until}}
+    if last:
+        query.update(_after(last["as_of"], last["last_tx_id"]))
+
+    cursor = ledger_store.aggregate(query, [
+        {"$sort": {"created_at": 1, "_id": 1}},
+        {"$project": {"transaction_type": 1, "amount": 1, "created_at": 1}}
+    ], batchSize=every)
+
+    written = 0
+    pending = 0
+    async for tx in cursor:
+        balance += BALANCE_SIGN[TransactionType(tx["transaction_type"])] * tx["amount"]
+        entries += 1
+        pending += 1
+        if pending >= every:
+            try:
+                result = await balance_checkpoints_collection.update_one(
+                    {"user_id": user_oid, "last_tx_id": tx["_id"]},
+                    {"$setOnInsert": {
+                        "as_of": tx["created_at"],
+                        "balance": balance,
+                        "entries": entries,
+                        "created_at": datetime.now()
+                    }},
+                    upsert=True
+                )
+                written += result.upserted_id is not None
+            except DuplicateKeyError:
+                # Another pass inserted the same checkpoint first.
+                pass
+            pending = 0
+    return written
+
+
+async def invalidate_checkpoints(starts: dict):
+    # starts maps user ObjectId -> earliest created_at just written for that
+    # user. Checkpoints at or after it no longer cover everything before them
+    # (e.g. after a historical import) and are dropped; the next run rebuilds them.
+    if not starts:
+        return
+    await balance_checkpoints_collection.bulk_write([
+        DeleteMany({"user_id": user_oid, "as_of": {"$gte": created_at}})
+        for user_oid, created_at in starts.items()
+    ], ordered=False)
+
+
+async def run_checkpoints(every: int = None):
+    # Incremental pass: only users with ledger entries written since the last
+    # pass are visited. Progress is an _id high-water mark in the jobs
+    # collection, advanced only after every user below it is checkpointed.
+    lag = timedelta(seconds=settings.CHECKPOINT_LAG_SECONDS)
+    until = datetime.now() - lag
+    # created_at is naive local time, but ObjectId timestamps are UTC.
+    high_water = ObjectId.from_datetime(datetime.now(timezone.utc) - lag)
+    state = await jobs_collection.find_one({"_id": "checkpoints"}) or {}
+
+    match = {"_id": {"$lt": high_water}}
+    if state.get("last_tx_id"):
+        match["_id"]["$gte"] = state["last_tx_id"]
+
+    users = 0
+    written = 0
+    async for row in ledger_store.aggregate(match, [{"$group": {"_id": "$user_id"}}], allowDiskUse=True):
+        written += await checkpoint_user(row["_id"], every, until)
+        users += 1
+
+    await jobs_collection.update_one(
+        {"_id": "checkpoints"},
+        {"$set": {"last_tx_id": high_water, "updated_at": datetime.now()}},
+        upsert=True
+    )
+    return {"users": users, "checkpoints_written": written}
+
+
+async def balance_as_of(user_oid: ObjectId, as_of: datetime):
+    checkpoint = await balance_checkpoints_collection.find_one(
+        {"user_id": user_oid, "as_of": {"$lte": as_of}}, sort=_CHECKPOINT_SORT
+    )
+    match = {"user_id": user_oid, "created_at": {"$lte": as_of}}
+    if checkpoint:
+        match.update(_after(checkpoint["as_of"], checkpoint["last_tx_id"]))
+
+    delta = 0.0
+    replayed = 0
+    async for row in ledger_store.aggregate(match, [
+        {"$group": {"_id": None, "delta": {"$sum": SIGNED_AMOUNT}, "count": {"$sum": 1}}}
+    ]):
+        delta = row["delta"]
+        replayed = row["count"]
+
+    return {
+        "balance": (checkpoint["balance"] if checkpoint else 0.0) + delta,
+        "checkpoint_as_of": checkpoint["as_of"] if checkpoint else None,
+        "entries_replayed": replayed
+    }
+
+
+async def watch_checkpoints():
+    while True:
+        await asyncio.sleep(settings.CHECKPOINT_INTERVAL_SECONDS)
+        try:
+            result = await run_checkpoints()
+            logger.info("checkpointed %d users, %d new checkpoints", result["users"], result["checkpoints_written"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("checkpoint run failed: %s", e)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write balance checkpoints for accounts with new ledger entries.")
+    parser.add_argument("--every", type=int, default=settings.CHECKPOINT_EVERY, help="ledger entries per checkpoint")
+    parser.add_argument("--user", help="checkpoint a single user id")
+    args = parser.parse_args()
+
+    if args.user:
+        print(asyncio.run(checkpoint_user(ObjectId(args.user), args.every)))
+    else:
+        print(asyncio.run(run_checkpoints(args.every)))
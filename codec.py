@@ -0,0 +1,123 @@
+from bson import Int64
+import settings
+
+# On-disk encoding of ledger entries. The API and the rest of the service only
+# ever see version 1 shapes; storage.py encodes on the way in and decodes on
+# the way out, and both versions may sit side by side in one collection.
+#
+#   v1  {_id, user_id, created_at, transaction_type: "CREDIT", amount: 12.5,
+#        description, recipient_user_id, reference_transaction_id, batch_id}
+#   v2  {_id, user_id, created_at, v: 2, t: 1, a: Int64(1250),
+#        d, r, ref, b}
+#
+# v2 stores the amount as int64 minor units and the type as a small int under
+# short keys. user_id, created_at and _id keep their names so every index and
+# range filter works on both. Rollout: deploy (reads both), set
+# LEDGER_ENCODING=2 so new entries are written compactly, then re-encode the
+# history with `python storage.py --reencode 2`.
+
+MINOR_UNITS = 100
+
+TYPE_CODES = {"CREDIT": 1, "DEBIT": 2, "TRANSFER_IN": 3, "TRANSFER_OUT": 4}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+# Long name -> v2 key for the optional fields.
+SHORT_KEYS = {
+    "description": "d",
+    "recipient_user_id": "r",
+    "reference_transaction_id": "ref",
+    "batch_id": "b",
+}
+_LONG_KEYS = {short: long for long, short in SHORT_KEYS.items()}
+_SHARED = ("_id", "user_id", "created_at")
+
+
+def to_minor(amount) -> Int64:
+    return Int64(round(amount * MINOR_UNITS))
+
+
+def encode(entry: dict, version: int = None) -> dict:
+    version = version or settings.LEDGER_ENCODING
+    if version == 1:
+        return entry
+    encoded = {key: entry[key] for key in _SHARED if key in entry}
+    encoded["v"] = 2
+    encoded["t"] = TYPE_CODES[entry["transaction_type"]]
+    encoded["a"] = to_minor(entry["amount"])
+    for long, short in SHORT_KEYS.items():
+        if entry.get(long) is not None:
+            encoded[short] = entry[long]
+    return encoded
+
+
+def decode(doc: dict) -> dict:
+    if doc is None or doc.get("v") != 2:
+        return doc
+    decoded = {key: doc[key] for key in _SHARED if key in doc}
+    if "t" in doc:
+        decoded["transaction_type"] = TYPE_NAMES[doc["t"]]
+    if "a" in doc:
+        decoded["amount"] = doc["a"] / MINOR_UNITS
+    for short, long in _LONG_KEYS.items():
+        if short in doc:
+            decoded[long] = doc[short]
+    return decoded
+
+
+def on_shared_fields(stage: dict) -> bool:
+    # True for a $match or $sort that only reads fields stored under the same
+    # name in every version, so it can run before DECODE_STAGES and use the
+    # indexes; $limit and $skip never depend on the encoding.
+    (operator, spec), = stage.items()
+    if operator in ("$limit", "$skip"):
+        return True
+    if operator == "$sort":
+        return all(field in _SHARED for field in spec)
+    if operator == "$match":
+        return _matches_shared(spec)
+    return False
+
+
+def _matches_shared(query: dict) -> bool:
+    for field, condition in query.items():
+        if field in ("$and", "$or", "$nor"):
+            if not all(_matches_shared(clause) for clause in condition):
+                return False
+        elif field not in _SHARED:
+            return False
+    return True
+
+
+def projection(fields: dict) -> dict:
+    # A v1 projection widened to fetch the same fields from v2 entries.
+    if fields is None:
+        return None
+    widened = dict(fields)
+    widened["v"] = 1
+    for field in fields:
+        if field == "transaction_type":
+            widened["t"] = 1
+        elif field == "amount":
+            widened["a"] = 1
+        elif field in SHORT_KEYS:
+            widened[SHORT_KEYS[field]] = 1
+    return widened
+
+
+def _field(long: str, short_expression):
+    return {"$cond": [{"$eq": ["$v", 2]}, short_expression, f"${long}"]}
+
+
+# Aggregation stages turning every entry into its v1 shape, so pipelines
+# written against v1 run unchanged over a mixed collection. Filters placed
+# before them should stick to _id, user_id and created_at.
+DECODE_STAGES = [
+    {"$addFields": {
+        "transaction_type": _field("transaction_type", {"$arrayElemAt": [
+            [None] + [TYPE_NAMES[code] for code in sorted(TYPE_NAMES)], "$t"
+        ]}),
+        "amount": _field("amount", {"$divide": ["$a", MINOR_UNITS]}),
+        **{long: _field(long, f"${short}") for long, short in SHORT_KEYS.items()},
+    }},
+    {"$project": {key: 0 for key in ("v", "t", "a", *SHORT_KEYS.values())}},
+]
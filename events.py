@@ -0,0 +1,335 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from pymongo.errors import OperationFailure
+from starlette.websockets import WebSocketDisconnect
+from bson import ObjectId
+from codec import decode
+from schema import dumps, transaction_out
+import settings
+import shards
+
+logger = logging.getLogger(__name__)
+
+# Push channel for balance and ledger changes. One change stream over users
+# and transactions feeds every subscriber in this process; each subscriber is
+# a bounded per-account buffer, and one that falls too far behind is dropped
+# with an "evicted" event rather than buffered without limit.
+#
+# Event ids are "<epoch>-<seq>". The last EVENTS_REPLAY_SIZE events are kept,
+# so a client reconnecting with its last id gets what it missed. When that is
+# no longer possible (id too old, from another process or from before the
+# stream lost history) it gets a "reset" event and should re-read its balance.
+#
+# Hot accounts credit balance shards rather than the user document, so their
+# credits arrive as ledger events without a matching balance event. Their
+# balance events carry the whole total, shards included.
+#
+# Change streams need a replica set. On a standalone server the hub turns
+# itself off (the routes answer 503) instead of retrying forever; other
+# failures are retried with exponential backoff up to EVENTS_RETRY_MAX_SECONDS.
+
+# Change-stream errors meaning the saved resume token can no longer be used.
+_HISTORY_LOST = {260, 280, 286}
+# "The $changeStream stage is only supported on replica sets".
+_UNSUPPORTED = {40573}
+
+_PIPELINE = [{"$match": {"$or": [
+    {"ns.coll": "transactions", "operationType": "insert"},
+    {"ns.coll": "ledger_buckets", "operationType": {"$in": ["insert", "update"]}},
+    {"ns.coll": "users", "operationType": "update",
+     "updateDescription.updatedFields.balance": {"$exists": True}},
+]}}]
+
+
+class Subscriber:
+    __slots__ = ("user_id", "events", "max_events", "wake", "evicted")
+
+    def __init__(self, user_id: str, max_events: int, wake: asyncio.Event = None):
+        self.user_id = user_id
+        self.events = deque()
+        self.max_events = max_events
+        # Shared by all of a WebSocket's subscriptions so one wait covers them.
+        self.wake = wake or asyncio.Event()
+        self.evicted = False
+
+    def push(self, event):
+        if len(self.events) >= self.max_events:
+            self.evicted = True
+        else:
+            self.events.append(event)
+        self.wake.set()
+
+    def drain(self):
+        while self.events:
+            yield self.events.popleft()
+
+
+class EventHub:
+    def __init__(self, replay_size: int, queue_size: int, max_subscribers: int, enabled: bool = True):
+        self.available = enabled
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.epoch = os.urandom(4).hex()
+        self._seq = 0
+        # (seq, user_id, event) for the most recent events, for resuming clients.
+        self._recent = deque(maxlen=replay_size)
+        self._subscribers = {}
+        self.subscriber_count = 0
+        self.published = 0
+        self.evictions = 0
+        self.resets = 0
+        self._resume_token = None
+
+    def _event_id(self, seq: int):
+        return f"{self.epoch}-{seq}"
+
+    def _replay(self, subscriber: Subscriber, last_event_id: str):
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch == self.epoch and seq.isdigit():
+            seq = int(seq)
+            # Nothing was dropped between the client's event and the buffer.
+            oldest = self._recent[0][0] if self._recent else self._seq + 1
+            if seq <= self._seq and (seq >= oldest - 1 or len(self._recent) < self._recent.maxlen):
+                for event_seq, user_id, event in self._recent:
+                    if event_seq > seq and user_id == subscriber.user_id:
+                        subscriber.push(event)
+                return
+        self.resets += 1
+        subscriber.push((None, "reset", {"user_id": subscriber.user_id, "reason": "resume point unavailable"}))
+
+    def subscribe(self, user_id: str, last_event_id: str = None, wake: asyncio.Event = None):
+        if self.full():
+            return None
+        subscriber = Subscriber(user_id, self.queue_size, wake)
+        if last_event_id:
+            self._replay(subscriber, last_event_id)
+        if subscriber.evicted:
+            # Missed more than one buffer's worth; the stream sends what fits
+            # and tells the client to reconnect from there.
+            return subscriber
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        self.subscriber_count += 1
+        return subscriber
+
+    def full(self):
+        return self.subscriber_count >= self.max_subscribers
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._subscribers.get(subscriber.user_id)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[subscriber.user_id]
+        self.subscriber_count -= 1
+
+    def publish(self, user_id: str, event_type: str, data: dict):
+        self._seq += 1
+        self.published += 1
+        event = (self._event_id(self._seq), event_type, data)
+        self._recent.append((self._seq, user_id, event))
+        for subscriber in list(self._subscribers.get(user_id, ())):
+            subscriber.push(event)
+            if subscriber.evicted:
+                self.evictions += 1
+                self.unsubscribe(subscriber)
+
+    def reset_all(self, reason: str):
+        # Events were lost: old ids must not resume, and live subscribers are
+        # told to re-read.
+        self.epoch = os.urandom(4).hex()
+        self._recent.clear()
+        for subscribers in list(self._subscribers.values()):
+            for subscriber in subscribers:
+                subscriber.push((None, "reset", {"user_id": subscriber.user_id, "reason": reason}))
+        self.resets += 1
+
+    def disable(self, reason: str):
+        # Every subscriber gets an "unavailable" event and is dropped; their
+        # next attempt to subscribe is refused.
+        self.available = False
+        for subscribers in list(self._subscribers.values()):
+            for subscriber in list(subscribers):
+                subscriber.push((None, "unavailable", {"user_id": subscriber.user_id, "reason": reason}))
+                subscriber.evicted = True
+                self.unsubscribe(subscriber)
+
+    def _ledger_entries(self, change: dict):
+        if change["ns"]["coll"] == "transactions":
+            return [change["fullDocument"]]
+        if change["operationType"] == "insert":
+            return change["fullDocument"]["entries"]
+        # A $push into a bucket shows up as one "entries.<n>" field per entry.
+        updated = change["updateDescription"]["updatedFields"]
+        return [updated[key] for key in sorted((k for k in updated if k.startswith("entries.")),
+                                               key=lambda k: int(k.split(".")[1]))]
+
+    async def handle_change(self, change: dict):
+        if change["ns"]["coll"] != "users":
+            for doc in self._ledger_entries(change):
+                self.publish(str(doc["user_id"]), "ledger", transaction_out(decode(doc)))
+            return
+        updated = change["updateDescription"]["updatedFields"]
+        user_id = str(change["documentKey"]["_id"])
+        balance = updated["balance"]
+        if shards.is_hot(user_id):
+            # users.balance is only shard 0 of a hot wallet.
+            balance += await shards.shard_sum(ObjectId(user_id))
+        self.publish(user_id, "balance", {
+            "user_id": user_id,
+            "balance": balance,
+            "balance_version": updated.get("balance_version"),
+            "last_updated": updated.get("updated_at")
+        })
+
+    async def run(self, database):
+        delay = 1
+        while self.available:
+            try:
+                async with database.watch(_PIPELINE, resume_after=self._resume_token) as stream:
+                    delay = 1
+                    async for change in stream:
+                        await self.handle_change(change)
+                        self._resume_token = stream.resume_token
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in _UNSUPPORTED:
+                    logger.warning("change streams are not supported by this deployment, live events are off: %s", e)
+                    self.disable("change streams unsupported")
+                    return
+                if e.code in _HISTORY_LOST:
+                    logger.warning("event stream history lost, resetting subscribers: %s", e)
+                    self._resume_token = None
+                    self.reset_all("change stream history lost")
+                else:
+                    logger.warning("event stream interrupted, retrying in %ss: %s", delay, e)
+            except Exception as e:
+                # Resumes from the last token, so nothing is missed.
+                logger.warning("event stream interrupted, retrying in %ss: %s", delay, e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, settings.EVENTS_RETRY_MAX_SECONDS)
+
+    def stats(self):
+        return {
+            "available": self.available,
+            "epoch": self.epoch,
+            "subscribers": self.subscriber_count,
+            "accounts": len(self._subscribers),
+            "buffered": len(self._recent),
+            "published": self.published,
+            "evictions": self.evictions,
+            "resets": self.resets
+        }
+
+
+hub = EventHub(settings.EVENTS_REPLAY_SIZE, settings.EVENTS_QUEUE_SIZE, settings.EVENTS_MAX_SUBSCRIBERS,
+               settings.EVENTS_ENABLED)
+
+
+def _sse(event):
+    event_id, event_type, data = event
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event_type}\ndata: ".encode() + dumps(data) + b"\n\n"
+
+
+async def sse_stream(user_id: str, last_event_id: str = None, heartbeat: float = None):
+    # Subscribes on first iteration, so a response that is never started
+    # leaves nothing registered.
+    heartbeat = heartbeat or settings.EVENTS_HEARTBEAT_SECONDS
+    subscriber = hub.subscribe(user_id, last_event_id)
+    if subscriber is None:
+        yield _sse((None, "error", {"error": "Too many subscribers"}))
+        return
+    try:
+        yield b"retry: 2000\n\n"
+        while True:
+            subscriber.wake.clear()
+            for event in subscriber.drain():
+                yield _sse(event)
+            if subscriber.evicted:
+                if hub.available:
+                    yield _sse((None, "evicted", {"user_id": subscriber.user_id}))
+                return
+            try:
+                await asyncio.wait_for(subscriber.wake.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection.
+                yield b": keepalive\n\n"
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+def _frame(user_id: str, event):
+    event_id, event_type, data = event
+    return dumps({"id": event_id, "type": event_type, "user_id": user_id, "data": data}).decode()
+
+
+async def serve_socket(websocket, heartbeat: float = None):
+    # Client messages: {"subscribe": user_id, "last_event_id": "..."} and
+    # {"unsubscribe": user_id}. One socket can follow several accounts.
+    heartbeat = heartbeat or settings.EVENTS_HEARTBEAT_SECONDS
+    if not hub.available:
+        # 1013: try again later.
+        await websocket.close(code=1013)
+        return
+    await websocket.accept()
+    wake = asyncio.Event()
+    subscribers = {}
+
+    async def receive():
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except ValueError:
+                continue
+            if not isinstance(message, dict):
+                continue
+            if message.get("subscribe"):
+                user_id = str(message["subscribe"])
+                if user_id in subscribers:
+                    continue
+                if len(subscribers) >= settings.EVENTS_SOCKET_MAX_ACCOUNTS:
+                    await websocket.send_text(_frame(user_id, (None, "error", {"error": "Too many subscriptions"})))
+                    continue
+                subscriber = hub.subscribe(user_id, message.get("last_event_id"), wake)
+                if subscriber is None:
+                    await websocket.send_text(_frame(user_id, (None, "error", {"error": "Server busy"})))
+                    continue
+                subscribers[user_id] = subscriber
+                wake.set()
+            elif message.get("unsubscribe"):
+                subscriber = subscribers.pop(str(message["unsubscribe"]), None)
+                if subscriber is not None:
+                    hub.unsubscribe(subscriber)
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while not receiver.done():
+            if not hub.available:
+                await websocket.close(code=1013)
+                break
+            wake.clear()
+            for user_id, subscriber in list(subscribers.items()):
+                for event in subscriber.drain():
+                    await websocket.send_text(_frame(user_id, event))
+                if subscriber.evicted:
+                    if hub.available:
+                        await websocket.send_text(_frame(user_id, (None, "evicted", {"user_id": user_id})))
+                    del subscribers[user_id]
+            waiter = asyncio.ensure_future(wake.wait())
+            done, _ = await asyncio.wait({waiter, receiver}, timeout=heartbeat,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if not done:
+                await websocket.send_text(dumps({"type": "ping"}).decode())
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        receiver.cancel()
+        if receiver.done() and not receiver.cancelled():
+            receiver.exception()
+        for subscriber in subscribers.values():
+            hub.unsubscribe(subscriber)
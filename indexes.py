@@ -0,0 +1,514 @@
+import asyncio
+import logging
+import sys
+from bson import ObjectId
+from datetime import datetime
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+from core import db
+
+logger = logging.getLogger(__name__)
+
+
+# Case-insensitive comparison for user search: the search indexes are built
+# with it and every search query must pass the same collation to use them.
+SEARCH_COLLATION = {"locale": "en", "strength": 2}
+
+# Every index the service relies on, per collection. Reconciliation creates
+# whatever is missing and reports anything that differs from this list.
+INDEXES = {
+    "users": [
+        IndexModel([("username", 1)], name="username_unique", unique=True),
+        IndexModel([("email", 1)], name="email_unique", unique=True),
+        *(IndexModel([(field, 1), ("_id", 1)], name=f"{field}_search", collation=SEARCH_COLLATION)
+          for field in ("username", "email", "phone_number")),
+        # Only hot wallets carry hot_shards; every worker polls for them.
+        IndexModel([("hot_shards", 1)], name="hot_shards", sparse=True),
+    ],
+    "transactions": [
+        IndexModel([("user_id", 1), ("created_at", -1), ("_id", -1)], name="user_history"),
+        IndexModel([("reference_transaction_id", 1)], name="reference_transaction", sparse=True),
+        IndexModel([("ref", 1)], name="reference_transaction_v2", sparse=True),
+    ],
+    "ledger_buckets": [
+        IndexModel([("user_id", 1), ("period", -1), ("_id", -1)], name="user_period"),
+        IndexModel([("entries._id", 1)], name="entry_id"),
+    ],
+    "balance_checkpoints": [
+        IndexModel([("user_id", 1), ("as_of", -1), ("last_tx_id", -1)], name="user_as_of"),
+        IndexModel([("user_id", 1), ("last_tx_id", 1)], name="user_last_tx", unique=True),
+    ],
+    "daily_rollups": [
+        IndexModel([("user_id", 1), ("day", 1), ("transaction_type", 1)], name="user_day_type", unique=True),
+    ],
+    "reconcile_mismatches": [
+        IndexModel([("run_id", 1), ("user_id", 1)], name="run_user"),
+    ],
+    "balance_shards": [
+        IndexModel([("user_id", 1), ("shard", 1)], name="user_shard", unique=True),
+    ],
+}
+
+# Options that change index behaviour and therefore count as drift when they differ.
+_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds", "collation")
+
+last_report = None
+
+
+def _spec(model: IndexModel):
+    document = dict(model.document)
+    return {
+        "key": list(document["key"].items()),
+        **{k: document[k] for k in _COMPARED_OPTIONS if k in document}
+    }
+
+
+def _existing_spec(info: dict):
+    spec = {"key": [(field, int(direction) if isinstance(direction, float) else direction)
+                    for field, direction in info["key"]]}
+    for option in _COMPARED_OPTIONS:
+        if option in info:
+            spec[option] = info[option]
+    return spec
+
+
+def _same(declared: dict, existing: dict):
+    if declared["key"] != existing["key"]:
+        return False
+    for option in _COMPARED_OPTIONS:
+        if option == "collation" and option in declared:
+            # The server reports collations with every default filled in, so only
+            # compare the fields that were declared.
+            actual = existing.get(option) or {}
+            if any(actual.get(k) != v for k, v in declared[option].items()):
+                return False
+        elif declared.get(option) != existing.get(option):
+            return False
+    return True
+
+
+async def reconcile_indexes():
+    global last_report
+    report = {"created": [], "drift": [], "failed": []}
+
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        declared_names = set()
+
+        for model in models:
+            name = model.document["name"]
+            declared_names.add(name)
+            declared = _spec(model)
+
+            if name in existing:
+                if not _same(declared, _existing_spec(existing[name])):
+                    report["drift"].append({
+                        "collection": collection_name,
+                        "index": name,
+                        "reason": "definition differs",
+                        "declared": declared,
+                        "existing": _existing_spec(existing[name])
+                    })
+                continue
+
+            try:
+                # Builds on MongoDB 4.2+ only hold exclusive locks at the start and
+                # end, so reads and writes keep flowing while this runs.
+                await collection.create_indexes([model])
+                report["created"].append({"collection": collection_name, "index": name})
+            except OperationFailure as e:
+                report["failed"].append({"collection": collection_name, "index": name, "error": str(e)})
+
+        for name in existing:
+            if name != "_id_" and name not in declared_names:
+                report["drift"].append({
+                    "collection": collection_name,
+                    "index": name,
+                    "reason": "not declared"
+                })
+
+    for entry in report["created"]:
+        logger.info("created index %s.%s", entry["collection"], entry["index"])
+    for entry in report["drift"]:
+        logger.warning("index drift on %s.%s: %s", entry["collection"], entry["index"], entry["reason"])
+    for entry in report["failed"]:
+        logger.error("failed to build index %s.%s: %s", entry["collection"], entry["index"], entry["error"])
+
+    last_report = report
+    return report
+
+
+# Every query shape the service and its jobs issue, per collection. Values
+# are placeholders; only the shape matters to the planner.
+# tests/test_query_shapes.py fails when code sends a filter missing here.
+_SAMPLE_ID = ObjectId()
+_SAMPLE_TIME = datetime(2024, 1, 1)
+# Partition bounds (reconcile.id_range): the first and last ranges are open.
+_RANGES = (
+    ("", {"$gt": _SAMPLE_ID, "$lte": _SAMPLE_ID}),
+    (" (first)", {"$lte": _SAMPLE_ID}),
+    (" (last)", {"$gt": _SAMPLE_ID}),
+)
+# _id windows walked in order by the backfill, migration and checkpoint jobs.
+_ID_WINDOWS = (
+    {"$lt": _SAMPLE_ID},
+    {"$lt": _SAMPLE_ID, "$gt": _SAMPLE_ID},
+    {"$lt": _SAMPLE_ID, "$gte": _SAMPLE_ID},
+    {"$lte": _SAMPLE_ID},
+    {"$lte": _SAMPLE_ID, "$gt": _SAMPLE_ID},
+)
+
+QUERY_SHAPES = [
+    {
+        "name": "user by id",
+        "collection": "users",
+        "filter": {"_id": _SAMPLE_ID},
+    },
+    {
+        # Request loader, bulk ingest and batch-transfer recipient checks.
+        "name": "users by ids",
+        "collection": "users",
+        "filter": {"_id": {"$in": [_SAMPLE_ID]}},
+    },
+    {
+        "name": "user listing page",
+        "collection": "users",
+        "filter": {"_id": {"$gt": _SAMPLE_ID}},
+        "sort": [("_id", 1)],
+    },
+    *({
+        "name": f"user partition{suffix}",
+        "collection": "users",
+        "filter": {"_id": bounds},
+        "sort": [("_id", 1)],
+    } for suffix, bounds in _RANGES),
+    *({
+        "name": f"user search by {field} prefix",
+        "collection": "users",
+        "filter": {field: {"$gte": "ab", "$lt": "ab\uffff"}},
+        "sort": [(field, 1), ("_id", 1)],
+        "collation": SEARCH_COLLATION,
+    } for field in ("username", "email", "phone_number")),
+    *({
+        "name": f"user search by {field} seek",
+        "collection": "users",
+        "filter": {"$or": [
+            {field: {"$gt": "abc", "$lt": "ab\uffff"}},
+            {field: "abc", "_id": {"$gt": _SAMPLE_ID}}
+        ]},
+        "sort": [(field, 1), ("_id", 1)],
+        "collation": SEARCH_COLLATION,
+    } for field in ("username", "email", "phone_number")),
+    {
+        "name": "hot wallets",
+        "collection": "users",
+        "filter": {"hot_shards": {"$exists": True}},
+    },
+    {
+        "name": "guarded balance update",
+        "collection": "users",
+        "filter": {"_id": _SAMPLE_ID, "balance": {"$gte": 1.0}},
+    },
+    *({
+        "name": "reconciliation repair",
+        "collection": "users",
+        "filter": {"_id": _SAMPLE_ID, "balance": 1.0, "balance_version": version},
+    } for version in (1, {"$in": [0, None]})),
+    {
+        "name": "transaction by id",
+        "collection": "transactions",
+        "filter": {"_id": _SAMPLE_ID},
+    },
+    {
+        "name": "transaction history page",
+        "collection": "transactions",
+        "filter": {"user_id": _SAMPLE_ID},
+        "sort": [("created_at", -1), ("_id", -1)],
+    },
+    {
+        "name": "transaction history seek",
+        "collection": "transactions",
+        "filter": {
+            "user_id": _SAMPLE_ID,
+            "$or": [
+                {"created_at": {"$lt": _SAMPLE_TIME}},
+                {"created_at": _SAMPLE_TIME, "_id": {"$lt": _SAMPLE_ID}}
+            ]
+        },
+        "sort": [("created_at", -1), ("_id", -1)],
+    },
+    {
+        "name": "transaction export range",
+        "collection": "transactions",
+        "filter": {"user_id": _SAMPLE_ID, "created_at": {"$gte": _SAMPLE_TIME, "$lte": _SAMPLE_TIME}},
+        "sort": [("created_at", 1), ("_id", 1)],
+    },
+    {
+        "name": "ledger replay",
+        "collection": "transactions",
+        "filter": {"user_id": _SAMPLE_ID, "created_at": {"$lte": _SAMPLE_TIME}},
+        "sort": [("created_at", 1), ("_id", 1)],
+    },
+    {
+        "name": "ledger replay after checkpoint",
+        "collection": "transactions",
+        "filter": {
+            "user_id": _SAMPLE_ID,
+            "created_at": {"$lte": _SAMPLE_TIME},
+            "$or": [
+                {"created_at": {"$gt": _SAMPLE_TIME}},
+                {"created_at": _SAMPLE_TIME, "_id": {"$gt": _SAMPLE_ID}}
+            ]
+        },
+        "sort": [("created_at", 1), ("_id", 1)],
+    },
+    *({
+        "name": f"ledger _id window {n}",
+        "collection": "transactions",
+        "filter": {"_id": window},
+        "sort": [("_id", 1)],
+    } for n, window in enumerate(_ID_WINDOWS)),
+    *({
+        "name": f"reconciliation partition{suffix}",
+        "collection": "transactions",
+        "filter": {"user_id": bounds},
+    } for suffix, bounds in _RANGES),
+    *({
+        "name": f"statement openings{suffix}",
+        "collection": "transactions",
+        "filter": {"user_id": bounds, "created_at": {"$lt": _SAMPLE_TIME}},
+    } for suffix, bounds in _RANGES),
+    *({
+        "name": f"statement month{suffix}",
+        "collection": "transactions",
+        "filter": {"user_id": bounds, "created_at": {"$gte": _SAMPLE_TIME, "$lt": _SAMPLE_TIME}},
+        "sort": [("user_id", -1), ("created_at", 1), ("_id", 1)],
+    } for suffix, bounds in _RANGES),
+    {
+        "name": "transfer leg by reference",
+        "collection": "transactions",
+        "filter": {"reference_transaction_id": _SAMPLE_ID},
+    },
+    {
+        "name": "transfer leg by reference (v2 encoding)",
+        "collection": "transactions",
+        "filter": {"ref": _SAMPLE_ID},
+    },
+    *({
+        "name": f"re-encoding scan{suffix}",
+        "collection": "transactions",
+        "filter": {**window, "v": pending},
+        "sort": [("_id", 1)],
+    } for suffix, window in (("", {}), (" (resumed)", {"_id": {"$gt": _SAMPLE_ID}}))
+      for pending in (2, {"$ne": 2})),
+    {
+        "name": "re-encoding rewrite",
+        "collection": "transactions",
+        "filter": {"_id": _SAMPLE_ID, "v": 2},
+    },
+    {
+        "name": "bucketed history page",
+        "collection": "ledger_buckets",
+        "filter": {"user_id": _SAMPLE_ID, "period": {"$lte": _SAMPLE_TIME}},
+        "sort": [("period", -1), ("_id", -1)],
+    },
+    {
+        "name": "bucketed history",
+        "collection": "ledger_buckets",
+        "filter": {"user_id": _SAMPLE_ID},
+        "sort": [("period", -1), ("_id", -1)],
+    },
+    *({
+        "name": f"bucketed range {n}",
+        "collection": "ledger_buckets",
+        "filter": {"user_id": _SAMPLE_ID, "period": period},
+        "sort": [("period", 1), ("_id", 1)],
+    } for n, period in enumerate(({"$gte": _SAMPLE_TIME}, {"$gte": _SAMPLE_TIME, "$lte": _SAMPLE_TIME}))),
+    {
+        "name": "bucket with room",
+        "collection": "ledger_buckets",
+        "filter": {"user_id": _SAMPLE_ID, "period": _SAMPLE_TIME, "count": {"$lte": 199}},
+    },
+    {
+        "name": "bucketed transaction by id",
+        "collection": "ledger_buckets",
+        "filter": {"entries._id": _SAMPLE_ID},
+    },
+    *({
+        "name": f"bucketed _id window {n}",
+        "collection": "ledger_buckets",
+        "filter": {"entries._id": window},
+    } for n, window in enumerate(_ID_WINDOWS)),
+    *({
+        "name": f"bucketed reconciliation partition{suffix}",
+        "collection": "ledger_buckets",
+        "filter": {"user_id": bounds},
+    } for suffix, bounds in _RANGES),
+    *({
+        "name": f"bucketed statement openings{suffix}",
+        "collection": "ledger_buckets",
+        "filter": {"user_id": bounds, "period": {"$lt": _SAMPLE_TIME}},
+    } for suffix, bounds in _RANGES),
+    *({
+        "name": f"bucketed statement month{suffix}",
+        "collection": "ledger_buckets",
+        "filter": {"user_id": bounds, "period": {"$gte": _SAMPLE_TIME, "$lt": _SAMPLE_TIME}},
+    } for suffix, bounds in _RANGES),
+    {
+        "name": "bucket re-encoding scan",
+        "collection": "ledger_buckets",
+        "filter": {"_id": {"$gt": _SAMPLE_ID}},
+        "sort": [("_id", 1)],
+    },
+    {
+        "name": "bucket re-encoding rewrite",
+        "collection": "ledger_buckets",
+        "filter": {"_id": _SAMPLE_ID, "count": 1},
+    },
+    {
+        "name": "latest balance checkpoint",
+        "collection": "balance_checkpoints",
+        "filter": {"user_id": _SAMPLE_ID},
+        "sort": [("as_of", -1), ("last_tx_id", -1)],
+    },
+    {
+        "name": "nearest balance checkpoint",
+        "collection": "balance_checkpoints",
+        "filter": {"user_id": _SAMPLE_ID, "as_of": {"$lte": _SAMPLE_TIME}},
+        "sort": [("as_of", -1), ("last_tx_id", -1)],
+    },
+    {
+        "name": "checkpoint upsert",
+        "collection": "balance_checkpoints",
+        "filter": {"user_id": _SAMPLE_ID, "last_tx_id": _SAMPLE_ID},
+    },
+    {
+        "name": "checkpoint invalidation",
+        "collection": "balance_checkpoints",
+        "filter": {"user_id": _SAMPLE_ID, "as_of": {"$gte": _SAMPLE_TIME}},
+    },
+    {
+        "name": "rollup upsert",
+        "collection": "daily_rollups",
+        "filter": {"user_id": _SAMPLE_ID, "day": _SAMPLE_TIME, "transaction_type": "CREDIT"},
+    },
+    {
+        "name": "analytics range",
+        "collection": "daily_rollups",
+        "filter": {"user_id": _SAMPLE_ID, "day": {"$gte": _SAMPLE_TIME, "$lte": _SAMPLE_TIME}},
+        "sort": [("day", 1)],
+    },
+    {
+        "name": "hot wallet shards",
+        "collection": "balance_shards",
+        "filter": {"user_id": _SAMPLE_ID},
+    },
+    {
+        "name": "hot wallet shard",
+        "collection": "balance_shards",
+        "filter": {"user_id": _SAMPLE_ID, "shard": 1},
+    },
+    {
+        "name": "hot wallet surplus shards",
+        "collection": "balance_shards",
+        "filter": {"user_id": _SAMPLE_ID, "shard": {"$gte": 1}},
+    },
+    {
+        "name": "hot wallet shards to drain",
+        "collection": "balance_shards",
+        "filter": {"user_id": _SAMPLE_ID, "balance": {"$ne": 0}},
+    },
+    *({
+        "name": f"reconciliation shard partition{suffix}",
+        "collection": "balance_shards",
+        "filter": {"user_id": bounds},
+    } for suffix, bounds in _RANGES),
+    {
+        "name": "reconciliation report",
+        "collection": "reconcile_mismatches",
+        "filter": {"run_id": _SAMPLE_ID},
+        "sort": [("user_id", 1)],
+    },
+    {
+        "name": "reconciliation partition reset",
+        "collection": "reconcile_mismatches",
+        "filter": {"run_id": _SAMPLE_ID, "partition": 0},
+    },
+    {
+        "name": "transfer batch by id",
+        "collection": "transfer_batches",
+        "filter": {"_id": _SAMPLE_ID},
+    },
+    {
+        "name": "transfer batch progress",
+        "collection": "transfer_batches",
+        "filter": {"_id": _SAMPLE_ID, "next_index": 0},
+    },
+    {
+        "name": "transfer batch start",
+        "collection": "transfer_batches",
+        "filter": {"_id": _SAMPLE_ID, "status": {"$ne": "completed"}},
+    },
+    {
+        "name": "job state",
+        "collection": "jobs",
+        "filter": {"_id": "rollups"},
+    },
+    {
+        "name": "reconciliation job progress",
+        "collection": "jobs",
+        "filter": {"_id": "reconcile", "run_id": _SAMPLE_ID},
+    },
+]
+
+
+def _stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
+
+
+async def verify_query_plans():
+    # Returns the shapes whose winning plan scans the whole collection.
+    failures = []
+    for shape in QUERY_SHAPES:
+        cursor = db[shape["collection"]].find(shape["filter"])
+        if shape.get("sort"):
+            cursor = cursor.sort(shape["sort"])
+        if shape.get("collation"):
+            cursor = cursor.collation(shape["collation"])
+        explain = await cursor.explain()
+        stages = set(_stages(explain["queryPlanner"]["winningPlan"]))
+        if "COLLSCAN" in stages:
+            failures.append({"name": shape["name"], "collection": shape["collection"], "stages": sorted(stages)})
+    return failures
+
+
+async def _main(verify: bool):
+    report = await reconcile_indexes()
+    print(f"created: {len(report['created'])}, drift: {len(report['drift'])}, failed: {len(report['failed'])}")
+    for entry in report["drift"]:
+        print(f"  drift {entry['collection']}.{entry['index']}: {entry['reason']}")
+    for entry in report["failed"]:
+        print(f"  failed {entry['collection']}.{entry['index']}: {entry['error']}")
+
+    if not verify:
+        return 1 if report["failed"] else 0
+
+    failures = await verify_query_plans()
+    for failure in failures:
+        print(f"  COLLSCAN in '{failure['name']}' on {failure['collection']}: {', '.join(failure['stages'])}")
+    print(f"verified {len(QUERY_SHAPES)} query shapes, {len(failures)} collection scans")
+    return 1 if failures or report["failed"] else 0
+
+
+if __name__ == "__main__":
+    # python indexes.py            reconcile and report drift
+    # python indexes.py --verify   also explain every query shape and fail on COLLSCAN
+    sys.exit(asyncio.run(_main("--verify" in sys.argv[1:])))
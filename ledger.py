@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import time
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from storage import ledger_store
+from model import BALANCE_SIGN
+import rollups
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Aggregation expression for an entry's effect on the balance: positive for
+# credits, negative for debits.
+SIGNED_AMOUNT = {
+    "$cond": [
+        {"$in": ["$transaction_type", [t.value for t, sign in BALANCE_SIGN.items() if sign > 0]]},
+        "$amount",
+        {"$multiply": ["$amount", -1]}
+    ]
+}
+
+
+class LedgerWriter:
+    # Group commit for ledger entries: concurrent writers queue their document
+    # and one background task flushes whatever has accumulated as a single
+    # insert_many, either once max_batch entries are waiting or max_linger_ms
+    # after the first one arrived. Each caller's write() returns only after
+    # the batch holding its entry has been acknowledged by the server.
+    # on_write, if given, is called with the entries of each acknowledged batch
+    # after its callers have been released, in a background task that retries
+    # failures; stop() waits for those tasks.
+
+    def __init__(self, collection, max_batch: int, max_linger_ms: float, max_queue: int, enabled: bool = True,
+                 on_write=None):
+        self.collection = collection
+        self.on_write = on_write
+        self.max_batch = max_batch
+        self.max_linger_ms = max_linger_ms
+        self.max_queue = max_queue
+        self.enabled = enabled
+        self._queue = None
+        self._task = None
+        self._stopping = False
+        self._hooks = set()
+        self.batches = 0
+        self.entries = 0
+        self.failed_entries = 0
+        self.hook_failures = 0
+        self.last_batch_size = 0
+        self.flush_seconds = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.enabled or self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        # The sentinel lets the task finish the batch it is building rather
+        # than being cancelled with callers still waiting on it.
+        self._stopping = True
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        pending = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                pending.append(item)
+        if pending:
+            await self._flush(pending)
+        if self._hooks:
+            await asyncio.gather(*self._hooks)
+
+    async def write(self, document: dict):
+        document.setdefault("_id", ObjectId())
+        if not self.running or self._stopping:
+            await self.collection.insert_one(document)
+            await self.after_write([document])
+            return document["_id"]
+
+        future = asyncio.get_running_loop().create_future()
+        # Blocks when max_queue entries are already waiting, which pushes back
+        # on callers instead of growing memory without bound.
+        await self._queue.put((document, future))
+        await future
+        return document["_id"]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_linger_ms / 1000
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    item = self._queue.get_nowait()
+                else:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logger.error("ledger writer failed to settle a batch: %s", e)
+
+    async def _flush(self, batch: list):
+        started = time.perf_counter()
+        errors = {}
+        try:
+            await self.collection.insert_many([document for document, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                errors[error["index"]] = BulkWriteError({"writeErrors": [error]})
+        except Exception as e:
+            logger.error("ledger flush of %d entries failed: %s", len(batch), e)
+            errors = {i: e for i in range(len(batch))}
+
+        self.batches += 1
+        self.entries += len(batch) - len(errors)
+        self.failed_entries += len(errors)
+        self.last_batch_size = len(batch)
+        self.flush_seconds += time.perf_counter() - started
+
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i in errors:
+                future.set_exception(errors[i])
+            else:
+                future.set_result(None)
+
+        if len(errors) < len(batch):
+            await self.after_write([document for i, (document, _) in enumerate(batch) if i not in errors])
+
+    async def after_write(self, documents: list):
+        # Also used for entries written to the ledger directly (transfers,
+        # bulk ingest) so they get the same retries.
+        if not self.on_write or not documents:
+            return
+        if not self.running:
+            await self._run_hook(documents)
+            return
+        task = asyncio.create_task(self._run_hook(documents))
+        self._hooks.add(task)
+        task.add_done_callback(self._hooks.discard)
+
+    async def _run_hook(self, documents: list):
+        delay = settings.LEDGER_HOOK_RETRY_MS / 1000
+        for attempt in range(1, settings.LEDGER_HOOK_ATTEMPTS + 1):
+            try:
+                await self.on_write(documents)
+                return
+            except Exception as e:
+                if attempt == settings.LEDGER_HOOK_ATTEMPTS:
+                    self.hook_failures += 1
+                    logger.error("ledger on_write hook gave up on %d entries after %d attempts: %s",
+                                 len(documents), attempt, e)
+                    return
+                logger.warning("ledger on_write hook failed (attempt %d), retrying: %s", attempt, e)
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "max_batch": self.max_batch,
+            "max_linger_ms": self.max_linger_ms,
+            "max_queue": self.max_queue,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+            "entries": self.entries,
+            "failed_entries": self.failed_entries,
+            "pending_hooks": len(self._hooks),
+            "hook_failures": self.hook_failures,
+            "last_batch_size": self.last_batch_size,
+            "avg_batch_size": round(self.entries / self.batches, 2) if self.batches else 0.0,
+            "avg_flush_ms": round(self.flush_seconds * 1000 / self.batches, 3) if self.batches else 0.0
+        }
+
+
+ledger_writer = LedgerWriter(
+    ledger_store,
+    settings.LEDGER_MAX_BATCH,
+    settings.LEDGER_MAX_LINGER_MS,
+    settings.LEDGER_MAX_QUEUE,
+    settings.LEDGER_GROUP_COMMIT,
+    on_write=rollups.record
+)
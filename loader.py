@@ -0,0 +1,121 @@
+import asyncio
+import contextvars
+from bson import ObjectId
+from core import users_collection
+from metrics import current_request
+import settings
+
+# Request-scoped batching of user reads. Every load() issued in the same
+# event-loop tick (typically from coroutines gathered together) is answered by
+# a single {_id: {$in: [...]}} find, and each document is kept for the rest of
+# the request so later lookups of the same user cost nothing. Writers call
+# clear() or prime() for the users they change. Not for use inside a
+# transaction: the loader reads outside any session.
+
+# Users are loaded whole apart from the password hash.
+USER_PROJECTION = {"password": 0}
+
+_current = contextvars.ContextVar("user_loader", default=None)
+
+# Process-wide totals across every loader, for /metrics.
+totals = {"keys": 0, "queries": 0, "hits": 0}
+
+
+class UserLoader:
+    def __init__(self, collection, projection: dict = None):
+        self.collection = collection
+        self.projection = projection
+        self._futures = {}
+        self._queue = []
+
+    def load(self, user_oid: ObjectId):
+        # Resolves to the user document, or None when there is no such user.
+        future = self._futures.get(user_oid)
+        if future is not None:
+            totals["hits"] += 1
+            return future
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._futures[user_oid] = future
+        if not self._queue:
+            # Runs after every callback already scheduled for this tick, so
+            # the other gathered coroutines get to queue their keys first.
+            loop.call_soon(self._dispatch)
+        self._queue.append((user_oid, future))
+        return future
+
+    async def load_many(self, user_oids: list):
+        return await asyncio.gather(*(self.load(oid) for oid in user_oids))
+
+    def prime(self, user_oid: ObjectId, document: dict):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(document)
+        self._futures[user_oid] = future
+
+    def clear(self, user_oid: ObjectId):
+        self._futures.pop(user_oid, None)
+
+    def _dispatch(self):
+        batch, self._queue = self._queue, []
+        asyncio.ensure_future(self._fetch(batch))
+
+    async def _fetch(self, batch: list):
+        totals["keys"] += len(batch)
+        totals["queries"] += 1
+        try:
+            found = {}
+            async for document in self.collection.find({"_id": {"$in": [oid for oid, _ in batch]}}, self.projection):
+                found[document["_id"]] = document
+        except Exception as e:
+            for oid, future in batch:
+                # A failed read is not cached; the next load() tries again.
+                if self._futures.get(oid) is future:
+                    del self._futures[oid]
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for oid, future in batch:
+            if not future.done():
+                future.set_result(found.get(oid))
+
+
+def user_loader():
+    # The current request's loader; outside a request every call gets a
+    # fresh one, which still batches but caches nothing beyond the caller.
+    loader = _current.get()
+    if loader is None:
+        return UserLoader(users_collection, USER_PROJECTION)
+    return loader
+
+
+def stats():
+    return dict(totals)
+
+
+class LoaderMiddleware:
+    # Gives each HTTP request its own loader. With METRICS_ENABLED it also
+    # reports the Mongo commands the request issued before its response
+    # started in an X-Mongo-Round-Trips header; it has to sit inside
+    # MetricsMiddleware, which owns the per-request counts.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        token = _current.set(UserLoader(users_collection, USER_PROJECTION))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and settings.ROUND_TRIP_HEADER:
+                request_stats = current_request.get()
+                if request_stats is not None:
+                    message["headers"] = [*message.get("headers", []),
+                                          (b"x-mongo-round-trips", str(request_stats.commands).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
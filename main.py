@@ -1,9 +1,50 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from app_router import router
+from indexes import reconcile_indexes
+from cache import balance_cache, watch_balance_changes
+from ledger import ledger_writer
+from shards import refresh_hot_accounts, watch_hot_accounts
+from checkpoints import watch_checkpoints
+from rollups import mark_live
+from admission import admission
+from events import hub
+from schema import FastJSONResponse
+from metrics import MetricsMiddleware, render as render_metrics
+from loader import LoaderMiddleware, stats as loader_stats
+from core import connect, close, db, get_client, pool_stats, users_collection
+import settings
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await connect()
+    if settings.ROLLUPS_ENABLED:
+        # Entries written from here on are rolled up live; older ones are left
+        # to `python rollups.py`.
+        await mark_live()
+    ledger_writer.start()
+    await refresh_hot_accounts()
+    # Index builds run alongside request handling rather than blocking startup.
+    tasks = [asyncio.create_task(reconcile_indexes()), asyncio.create_task(watch_hot_accounts())]
+    if settings.CHECKPOINT_INTERVAL_SECONDS > 0:
+        tasks.append(asyncio.create_task(watch_checkpoints()))
+    if settings.EVENTS_ENABLED:
+        tasks.append(asyncio.create_task(hub.run(db)))
+    if settings.BALANCE_CACHE_ENABLED and settings.BALANCE_CACHE_WATCH:
+        tasks.append(asyncio.create_task(watch_balance_changes(users_collection)))
+    yield
+    for task in tasks:
+        task.cancel()
+    await ledger_writer.stop()
+    close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # Enable CORS
 app.add_middleware(
@@ -14,6 +55,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(LoaderMiddleware)
+
+if settings.METRICS_ENABLED:
+    # Added last so it wraps CORS too and times the whole request.
+    app.add_middleware(MetricsMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -23,3 +70,31 @@ app.include_router(router)
 async def read_root():
     return {"message": "Welcome to the Digital Wallet API. Visit /static/index.html for the dashboard."}
 
+
+@app.get("/healthz")
+async def healthz():
+    # Pool saturation is in_use / maxPoolSize per server; sustained values near
+    # 1.0 with a growing "waiting" count mean the pool is too small for the load.
+    status = "ok"
+    try:
+        await asyncio.wait_for(get_client().admin.command("ping"), timeout=2)
+    except Exception:
+        status = "unavailable"
+    body = {
+        "status": status,
+        "pool": pool_stats.snapshot(),
+        "balance_cache": balance_cache.stats(),
+        "ledger_writer": ledger_writer.stats(),
+        "admission": admission.stats(),
+        "events": hub.stats()
+    }
+    return FastJSONResponse(body, status_code=200 if status == "ok" else 503)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Prometheus text exposition: per-route request counts and latency, Mongo
+    # commands per request, per-command latency, and pool/ledger/cache gauges.
+    body = render_metrics(pool_stats.snapshot(), ledger_writer.stats(), balance_cache.stats(), admission.stats(),
+                          hub.stats(), loader_stats())
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
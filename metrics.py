@@ -0,0 +1,276 @@
+import bson
+import contextvars
+import logging
+import threading
+import time
+from pymongo import monitoring
+import settings
+
+slow_logger = logging.getLogger("metrics.slow_commands")
+
+# Request and Mongo command metrics in Prometheus text format. The command
+# listener runs on the driver's executor threads, which Motor starts with a
+# copy of the caller's context, so the per-request stats object set by the
+# middleware is visible there; it is mutated in place rather than re-set.
+
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_COMMAND_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+_COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50, 100)
+
+# Driver housekeeping that says nothing about the request being served.
+_IGNORED_COMMANDS = {"hello", "isMaster", "ismaster", "ping", "endSessions", "saslStart", "saslContinue"}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount: float = 1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = _LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *values):
+        with self._lock:
+            series = self._values.get(values)
+            if series is None:
+                series = self._values[values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for values, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_labels(names, values + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels(names, values + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, values)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, values)} {count}")
+        return lines
+
+
+http_requests = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency, first byte received to last byte sent.",
+                         ("method", "route"))
+http_commands = Histogram("http_request_mongo_commands", "Mongo commands issued per HTTP request.",
+                          ("method", "route"), _COUNT_BUCKETS)
+http_command_seconds = Histogram("http_request_mongo_seconds", "Time per HTTP request spent waiting on Mongo commands.",
+                                 ("method", "route"))
+mongo_commands = Counter("mongo_commands_total", "Mongo commands by name and outcome.", ("command", "outcome"))
+mongo_latency = Histogram("mongo_command_duration_seconds", "Mongo command round-trip time.", ("command",), _COMMAND_BUCKETS)
+mongo_bytes = Counter("mongo_command_bytes_total", "BSON bytes of Mongo commands and replies.", ("direction",))
+
+
+class RequestStats:
+    __slots__ = ("commands", "seconds", "bytes_sent", "bytes_received", "_lock")
+
+    def __init__(self):
+        self.commands = 0
+        self.seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float, sent: int, received: int):
+        with self._lock:
+            self.commands += 1
+            self.seconds += seconds
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def _shape(value, depth: int = 0):
+    # Keeps field names and operators, drops the values, so the log shows
+    # which query ran without leaking what it was run with.
+    if depth > 6:
+        return "..."
+    if isinstance(value, dict):
+        return {k: _shape(v, depth + 1) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_shape(value[0], depth + 1)] if value else []
+    return "?"
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Smoothed command latency in seconds, read by admission control.
+        self.latency_ewma = 0.0
+
+    def _key(self, event):
+        return event.connection_id, event.request_id
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        sent = len(bson.encode(event.command)) if settings.METRICS_COMMAND_BYTES else 0
+        shape = None
+        if settings.SLOW_COMMAND_MS > 0:
+            command = {k: v for k, v in event.command.items() if k not in ("lsid", "$clusterTime", "txnNumber", "$db")}
+            shape = _shape(command)
+        with self._lock:
+            self._pending[self._key(event)] = (current_request.get(), sent, shape, event.database_name)
+
+    def _finish(self, event, outcome: str, reply=None):
+        with self._lock:
+            pending = self._pending.pop(self._key(event), None)
+        if pending is None:
+            return
+        stats, sent, shape, database = pending
+        seconds = event.duration_micros / 1_000_000
+        received = len(bson.encode(reply)) if reply is not None and settings.METRICS_COMMAND_BYTES else 0
+
+        self.latency_ewma += 0.05 * (seconds - self.latency_ewma)
+        mongo_commands.inc(event.command_name, outcome)
+        mongo_latency.observe(seconds, event.command_name)
+        if settings.METRICS_COMMAND_BYTES:
+            mongo_bytes.inc("sent", amount=sent)
+            mongo_bytes.inc("received", amount=received)
+        if stats is not None:
+            stats.add(seconds, sent, received)
+        if shape is not None and seconds * 1000 >= settings.SLOW_COMMAND_MS:
+            slow_logger.warning("slow %s on %s took %.1f ms (%s): %s", event.command_name, database,
+                                seconds * 1000, outcome, shape)
+
+    def succeeded(self, event):
+        self._finish(event, "ok", event.reply)
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+command_metrics = CommandMetrics()
+
+
+class MetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware: no extra task per request,
+    # and streamed bodies are timed to their last chunk.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            route = scope.get("route")
+            # Route templates, not raw paths, so ids do not explode the label set.
+            path = route.path if route is not None and hasattr(route, "path") else "other"
+            method = scope["method"]
+            http_requests.inc(method, path, status)
+            http_latency.observe(time.perf_counter() - started, method, path)
+            http_commands.observe(stats.commands, method, path)
+            http_command_seconds.observe(stats.seconds, method, path)
+
+
+def _gauge(name: str, help: str, labels: tuple, samples: list, kind: str = "gauge"):
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for values, value in samples:
+        lines.append(f"{name}{_labels(labels, values)} {value}")
+    return lines
+
+
+def render(pool: dict = None, ledger: dict = None, balance_cache: dict = None, admission: dict = None,
+           events: dict = None, user_loader: dict = None):
+    lines = []
+    for metric in (http_requests, http_latency, http_commands, http_command_seconds,
+                   mongo_commands, mongo_latency, mongo_bytes):
+        lines.extend(metric.render())
+    if pool is not None:
+        lines.extend(_gauge("mongo_pool_connections", "Pooled connections per server and state.", ("server", "state"), [
+            ((server, state), counts[state])
+            for server, counts in sorted(pool["servers"].items())
+            for state in ("open", "in_use", "waiting")
+        ]))
+        lines.extend(_gauge("mongo_pool_checkout_failures_total", "Connection checkouts that failed or timed out.",
+                            ("server",), [((server,), counts["checkout_failures"])
+                                          for server, counts in sorted(pool["servers"].items())], "counter"))
+        lines.extend(_gauge("mongo_pool_saturation", "Highest in_use / maxPoolSize across servers.", (),
+                            [((), pool["saturation"])]))
+    if ledger is not None:
+        lines.extend(_gauge("ledger_writer_queue_depth", "Ledger entries waiting for group commit.", (),
+                            [((), ledger["queue_depth"])]))
+        lines.extend(_gauge("ledger_writer_avg_batch_size", "Average entries per ledger flush.", (),
+                            [((), ledger["avg_batch_size"])]))
+    if balance_cache is not None:
+        lines.extend(_gauge("balance_cache_entries", "Entries held by the balance cache.", (),
+                            [((), balance_cache["entries"])]))
+        lines.extend(_gauge("balance_cache_lookups_total", "Balance cache lookups by result.", ("result",),
+                            [(("hit",), balance_cache["hits"]), (("miss",), balance_cache["misses"])], "counter"))
+    if admission is not None:
+        lines.extend(_gauge("admission_in_flight", "Wallet mutations admitted and not yet finished.", (),
+                            [((), admission["in_flight"])]))
+        lines.extend(_gauge("admission_capacity", "Current global cap on admitted mutations.", (),
+                            [((), admission["capacity"])]))
+        lines.extend(_gauge("admission_rejected_total", "Wallet mutations shed by admission control.", ("reason",),
+                            [((reason,), n) for reason, n in sorted(admission["rejected"].items())], "counter"))
+    if events is not None:
+        lines.extend(_gauge("event_subscribers", "Open balance/ledger event subscriptions.", (),
+                            [((), events["subscribers"])]))
+        lines.extend(_gauge("event_subscriber_evictions_total", "Subscribers dropped for falling behind.", (),
+                            [((), events["evictions"])], "counter"))
+    if user_loader is not None:
+        lines.extend(_gauge("user_loader_keys_total", "User lookups sent to Mongo by the request loader.", (),
+                            [((), user_loader["keys"])], "counter"))
+        lines.extend(_gauge("user_loader_queries_total", "Batched $in queries the request loader issued.", (),
+                            [((), user_loader["queries"])], "counter"))
+        lines.extend(_gauge("user_loader_hits_total", "User lookups answered from the request's cache.", (),
+                            [((), user_loader["hits"])], "counter"))
+    return "\n".join(lines) + "\n"
@@ -12,6 +12,15 @@ class TransactionType(str, Enum):
     TRANSFER_OUT = "TRANSFER_OUT"
 
 
+# Direction each transaction type moves the wallet balance in.
+BALANCE_SIGN = {
+    TransactionType.CREDIT: 1,
+    TransactionType.DEBIT: -1,
+    TransactionType.TRANSFER_IN: 1,
+    TransactionType.TRANSFER_OUT: -1,
+}
+
+
 
 class User(BaseModel):
     username: str
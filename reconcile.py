@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from bson import ObjectId
+from datetime import datetime
+from pymongo import ReturnDocument
+from core import balance_shards_collection, jobs_collection, reconcile_mismatches_collection, users_collection
+from ledger import SIGNED_AMOUNT
+from storage import ledger_store
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Compares every wallet with its ledger: users.balance plus any hot-wallet
+# shards should equal the signed sum of the user's transactions. Users are cut
+# into _id ranges and a pool of workers runs one $group per range, so the
+# ledger is read once through the user_history index. Finished ranges are
+# recorded in the jobs collection and mismatches in reconcile_mismatches, so a
+# killed run picks up where it stopped.
+
+_JOB_ID = "reconcile"
+
+
+def id_range(field: str, lower, upper):
+    # (lower, upper]: each bound is the last user _id of its partition.
+    bounds = {}
+    if lower is not None:
+        bounds["$gt"] = lower
+    if upper is not None:
+        bounds["$lte"] = upper
+    return {field: bounds} if bounds else {}
+
+
+async def user_partitions(partition_size: int):
+    # The last _id of every partition_size users, found by walking the _id
+    # index. The first and last ranges are open so ledger entries of deleted
+    # users are still covered.
+    bounds = []
+    lower = None
+    while True:
+        query = {"_id": {"$gt": lower}} if lower is not None else {}
+        found = await users_collection.find(query, {"_id": 1}).sort("_id", 1) \
+            .skip(partition_size - 1).limit(1).to_list(length=1)
+        if not found:
+            break
+        lower = found[0]["_id"]
+        bounds.append(lower)
+    return [[lower, upper] for lower, upper in zip([None] + bounds, bounds + [None])]
+
+
+async def _ledger_sums(match: dict):
+    sums = {}
+    async for row in ledger_store.aggregate(match, [
+        {"$group": {"_id": "$user_id", "ledger": {"$sum": SIGNED_AMOUNT}, "entries": {"$sum": 1}}}
+    ]):
+        sums[row["_id"]] = (row["ledger"], row["entries"])
+    return sums
+
+
+async def _shard_sums(match: dict):
+    sums = {}
+    async for row in balance_shards_collection.aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$user_id", "total": {"$sum": "$balance"}}}
+    ]):
+        sums[row["_id"]] = row["total"]
+    return sums
+
+
+async def _compare(user_match: dict, ledger_match: dict, tolerance: float):
+    users = {}
+    async for user in users_collection.find(user_match, {"balance": 1, "balance_version": 1}):
+        users[user["_id"]] = user
+    ledger = await _ledger_sums(ledger_match)
+    shard_totals = await _shard_sums(ledger_match)
+
+    mismatches = []
+    for user_oid in users.keys() | ledger.keys():
+        user = users.get(user_oid)
+        expected, entries = ledger.get(user_oid, (0.0, 0))
+        stored = user["balance"] if user else None
+        shard_total = shard_totals.get(user_oid, 0.0)
+        actual = stored + shard_total if user else None
+        if user and abs(actual - expected) <= tolerance:
+            continue
+        mismatches.append({
+            "user_id": user_oid,
+            "user_missing": user is None,
+            "balance": stored,
+            "balance_version": user.get("balance_version", 0) if user else None,
+            "shard_balance": shard_total,
+            "ledger_balance": expected,
+            "ledger_entries": entries,
+            "difference": actual - expected if user else None
+        })
+    return len(users), mismatches
+
+
+async def _recheck(mismatch: dict, tolerance: float):
+    # The ledger entry and the balance $inc are separate writes, so a wallet
+    # in the middle of one looks wrong for a moment. Only mismatches that are
+    # still there on a second look are reported.
+    user_match = {"_id": mismatch["user_id"]}
+    _, mismatches = await _compare(user_match, {"user_id": mismatch["user_id"]}, tolerance)
+    return mismatches[0] if mismatches else None
+
+
+async def _repair(mismatch: dict):
+    # The ledger is the source of truth. The guard on balance and
+    # balance_version skips wallets that changed after they were checked.
+    if mismatch["user_missing"]:
+        return False
+    version = mismatch["balance_version"]
+    result = await users_collection.update_one(
+        {
+            "_id": mismatch["user_id"],
+            "balance": mismatch["balance"],
+            # Wallets that were never written have no balance_version yet.
+            "balance_version": version if version else {"$in": [0, None]}
+        },
+        {
+            "$set": {"balance": mismatch["ledger_balance"] - mismatch["shard_balance"], "updated_at": datetime.now()},
+            "$inc": {"balance_version": 1}
+        }
+    )
+    return result.modified_count == 1
+
+
+async def _reconcile_partition(run_id: ObjectId, index: int, lower, upper, tolerance: float, repair: bool):
+    users, mismatches = await _compare(
+        id_range("_id", lower, upper), id_range("user_id", lower, upper), tolerance
+    )
+    confirmed = []
+    for mismatch in mismatches:
+        mismatch = await _recheck(mismatch, tolerance)
+        if mismatch is None:
+            continue
+        mismatch["repaired"] = await _repair(mismatch) if repair else False
+        confirmed.append({"run_id": run_id, "partition": index, **mismatch, "found_at": datetime.now()})
+
+    # A run killed between these two writes redoes the partition on resume.
+    await reconcile_mismatches_collection.delete_many({"run_id": run_id, "partition": index})
+    if confirmed:
+        await reconcile_mismatches_collection.insert_many(confirmed)
+    await jobs_collection.update_one(
+        {"_id": _JOB_ID, "run_id": run_id},
+        {
+            "$addToSet": {"done": index},
+            "$inc": {"users_checked": users, "mismatches": len(confirmed)},
+            "$set": {"updated_at": datetime.now()}
+        }
+    )
+    return users, len(confirmed)
+
+
+async def _start_run(partition_size: int, restart: bool):
+    state = await jobs_collection.find_one({"_id": _JOB_ID})
+    if state and state["status"] == "running" and not restart:
+        logger.info("resuming reconciliation run %s", state["run_id"])
+        return state
+
+    now = datetime.now()
+    state = {
+        "_id": _JOB_ID,
+        "run_id": ObjectId(),
+        "status": "running",
+        "partitions": await user_partitions(partition_size),
+        "done": [],
+        "users_checked": 0,
+        "mismatches": 0,
+        "started_at": now,
+        "updated_at": now
+    }
+    await jobs_collection.replace_one({"_id": _JOB_ID}, state, upsert=True)
+    return state
+
+
+async def reconcile(workers: int = None, partition_size: int = None, tolerance: float = None,
+                    repair: bool = False, restart: bool = False):
+    workers = workers or settings.RECONCILE_WORKERS
+    partition_size = partition_size or settings.RECONCILE_PARTITION_SIZE
+    tolerance = settings.RECONCILE_TOLERANCE if tolerance is None else tolerance
+
+    state = await _start_run(partition_size, restart)
+    run_id = state["run_id"]
+    done = set(state["done"])
+    queue = asyncio.Queue()
+    for index, (lower, upper) in enumerate(state["partitions"]):
+        if index not in done:
+            queue.put_nowait((index, lower, upper))
+    total = len(state["partitions"])
+
+    async def worker():
+        while not queue.empty():
+            index, lower, upper = queue.get_nowait()
+            users, mismatches = await _reconcile_partition(run_id, index, lower, upper, tolerance, repair)
+            done.add(index)
+            logger.info("partition %d: %d users, %d mismatches (%d/%d done)",
+                        index, users, mismatches, len(done), total)
+
+    await asyncio.gather(*(worker() for _ in range(min(workers, max(queue.qsize(), 1)))))
+
+    final = await jobs_collection.find_one_and_update(
+        {"_id": _JOB_ID, "run_id": run_id},
+        {"$set": {"status": "completed", "finished_at": datetime.now()}},
+        return_document=ReturnDocument.AFTER
+    )
+    return {
+        "run_id": str(run_id),
+        "partitions": total,
+        "users_checked": final["users_checked"],
+        "mismatches": final["mismatches"],
+        "started_at": final["started_at"],
+        "finished_at": final["finished_at"]
+    }
+
+
+async def mismatch_report(run_id: str):
+    async for mismatch in reconcile_mismatches_collection.find({"run_id": ObjectId(run_id)}).sort("user_id", 1):
+        mismatch.pop("_id")
+        yield mismatch
+
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+async def _main(args):
+    summary = await reconcile(args.workers, args.partition_size, args.tolerance, args.repair, args.restart)
+    out = open(args.report, "w") if args.report else sys.stdout
+    try:
+        async for mismatch in mismatch_report(summary["run_id"]):
+            out.write(json.dumps(mismatch, default=_json_default) + "\n")
+    finally:
+        if args.report:
+            out.close()
+    print(json.dumps(summary, default=_json_default), file=sys.stderr)
+    return 1 if summary["mismatches"] else 0
+
+
+if __name__ == "__main__":
+    # python reconcile.py                       check every wallet, mismatches as NDJSON on stdout
+    # python reconcile.py --report out.ndjson   write the mismatch report to a file
+    # python reconcile.py --repair              also reset drifted balances to the ledger total
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Reconcile wallet balances against the ledger.")
+    parser.add_argument("--workers", type=int, default=settings.RECONCILE_WORKERS, help="partitions checked concurrently")
+    parser.add_argument("--partition-size", type=int, default=settings.RECONCILE_PARTITION_SIZE, help="users per partition")
+    parser.add_argument("--tolerance", type=float, default=settings.RECONCILE_TOLERANCE, help="allowed absolute difference")
+    parser.add_argument("--repair", action="store_true", help="set drifted balances to the ledger total")
+    parser.add_argument("--restart", action="store_true", help="start a new run instead of resuming an unfinished one")
+    parser.add_argument("--report", help="write mismatches to this file instead of stdout")
+    sys.exit(asyncio.run(_main(parser.parse_args())))
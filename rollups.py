@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import logging
+from bson import ObjectId
+from datetime import date, datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from core import client, daily_rollups_collection, jobs_collection
+from model import BALANCE_SIGN, TransactionType
+from storage import ledger_store
+import settings
+
+logger = logging.getLogger(__name__)
+
+# daily_rollups holds one document per (user_id, day, transaction_type) with
+# the summed amount and entry count. The service bumps it with $inc upserts
+# after every ledger write, so analytics read at most one document per type
+# per day instead of scanning the ledger.
+#
+# Live maintenance starts at the "live_since" ObjectId stored in the jobs
+# collection; ledger entries with a smaller _id predate it and are folded in by
+# the backfill, so every entry is counted exactly once.
+
+GRANULARITIES = ("day", "week", "month")
+
+
+def _day(created_at: datetime):
+    return datetime(created_at.year, created_at.month, created_at.day)
+
+
+def _updates(totals: dict):
+    return [
+        UpdateOne(
+            {"user_id": user_oid, "day": day, "transaction_type": transaction_type},
+            {"$inc": {"amount": amount, "count": count}},
+            upsert=True
+        )
+        for (user_oid, day, transaction_type), (amount, count) in totals.items()
+    ]
+
+
+async def record(entries: list):
+    # Called once the entries are durably in the ledger. Entries for the same
+    # user, day and type collapse into a single $inc. On a partial failure the
+    # entries already counted are dropped from the list before raising, so the
+    # caller can retry with the same list without counting anything twice.
+    if not settings.ROLLUPS_ENABLED or not entries:
+        return
+    totals = {}
+    for entry in entries:
+        key = (entry["user_id"], _day(entry["created_at"]), TransactionType(entry["transaction_type"]).value)
+        amount, count = totals.get(key, (0, 0))
+        totals[key] = (amount + entry["amount"], count + 1)
+    keys = list(totals)
+    try:
+        await daily_rollups_collection.bulk_write(_updates(totals), ordered=False)
+    except BulkWriteError as e:
+        failed = {keys[error["index"]] for error in e.details.get("writeErrors", [])}
+        entries[:] = [
+            entry for entry in entries
+            if (entry["user_id"], _day(entry["created_at"]), TransactionType(entry["transaction_type"]).value) in failed
+        ]
+        raise
+
+
+async def mark_live():
+    # The first process to start records the boundary; later ones keep it.
+    await jobs_collection.update_one(
+        {"_id": "rollups"},
+        {"$setOnInsert": {"live_since": ObjectId(), "backfill_last_id": None, "backfill_done": False}},
+        upsert=True
+    )
+    return await jobs_collection.find_one({"_id": "rollups"})
+
+
+async def _backfill_batch(session, lower, upper):
+    match = {"_id": {"$lte": upper}}
+    if lower is not None:
+        match["_id"]["$gt"] = lower
+    totals = {}
+    async for row in ledger_store.aggregate(match, [
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "day": {"$dateFromParts": {
+                    "year": {"$year": "$created_at"},
+                    "month": {"$month": "$created_at"},
+                    "day": {"$dayOfMonth": "$created_at"}
+                }},
+                "transaction_type": "$transaction_type"
+            },
+            "amount": {"$sum": "$amount"},
+            "count": {"$sum": 1}
+        }}
+    ], session=session):
+        key = row["_id"]
+        totals[(key["user_id"], key["day"], key["transaction_type"])] = (row["amount"], row["count"])
+
+    if totals:
+        await daily_rollups_collection.bulk_write(_updates(totals), ordered=False, session=session)
+    # The increments and the progress marker commit together, so a batch is
+    # never applied twice however the job is interrupted.
+    await jobs_collection.update_one(
+        {"_id": "rollups"},
+        {"$set": {"backfill_last_id": upper, "updated_at": datetime.now()}},
+        session=session
+    )
+    return len(totals)
+
+
+async def backfill(batch_size: int = None):
+    batch_size = batch_size or settings.ROLLUP_BACKFILL_BATCH
+    state = await mark_live()
+    if state.get("backfill_done"):
+        return {"batches": 0, "rollups_updated": 0, "done": True}
+
+    lower = state.get("backfill_last_id")
+    batches = 0
+    updated = 0
+    async with await client.start_session() as session:
+        while True:
+            # The batch boundary is the batch_size-th _id after the last one
+            # processed, found by walking the _id index.
+            query = {"_id": {"$lt": state["live_since"]}}
+            if lower is not None:
+                query["_id"]["$gt"] = lower
+            boundary = await ledger_store.aggregate(query, [
+                {"$sort": {"_id": 1}}, {"$skip": batch_size - 1}, {"$limit": 1}, {"$project": {"_id": 1}}
+            ]).to_list(length=1)
+            if not boundary:
+                last = await ledger_store.aggregate(query, [
+                    {"$sort": {"_id": -1}}, {"$limit": 1}, {"$project": {"_id": 1}}
+                ]).to_list(length=1)
+                if not last:
+                    break
+                boundary = last
+            upper = boundary[0]["_id"]
+            updated += await session.with_transaction(lambda s: _backfill_batch(s, lower, upper))
+            batches += 1
+            lower = upper
+            logger.info("rollup backfill reached %s", upper)
+
+    await jobs_collection.update_one(
+        {"_id": "rollups"},
+        {"$set": {"backfill_done": True, "updated_at": datetime.now()}}
+    )
+    return {"batches": batches, "rollups_updated": updated, "done": True}
+
+
+def _period_start(day: date, granularity: str):
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _empty_period():
+    return {"inflow": 0.0, "outflow": 0.0, "net": 0.0, "count": 0, "by_type": {}}
+
+
+def _add(period: dict, transaction_type: str, amount: float, count: int):
+    if BALANCE_SIGN[TransactionType(transaction_type)] > 0:
+        period["inflow"] += amount
+        period["net"] += amount
+    else:
+        period["outflow"] += amount
+        period["net"] -= amount
+    period["count"] += count
+    by_type = period["by_type"].setdefault(transaction_type, {"amount": 0.0, "count": 0})
+    by_type["amount"] += amount
+    by_type["count"] += count
+
+
+async def analytics(user_oid: ObjectId, start: date, end: date, granularity: str = "day"):
+    periods = {}
+    totals = _empty_period()
+    async for rollup in daily_rollups_collection.find(
+        {
+            "user_id": user_oid,
+            "day": {"$gte": datetime(start.year, start.month, start.day),
+                    "$lte": datetime(end.year, end.month, end.day)}
+        },
+        {"_id": 0, "day": 1, "transaction_type": 1, "amount": 1, "count": 1}
+    ).sort([("day", 1)]):
+        key = _period_start(rollup["day"].date(), granularity)
+        if key not in periods:
+            periods[key] = _empty_period()
+        _add(periods[key], rollup["transaction_type"], rollup["amount"], rollup["count"])
+        _add(totals, rollup["transaction_type"], rollup["amount"], rollup["count"])
+
+    return {
+        "periods": [{"period": key.isoformat(), **period} for key, period in sorted(periods.items())],
+        "totals": totals
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fold ledger history written before live rollups into daily_rollups.")
+    parser.add_argument("--batch-size", type=int, default=settings.ROLLUP_BACKFILL_BATCH, help="ledger entries per batch")
+    args = parser.parse_args()
+    print(asyncio.run(backfill(args.batch_size)))
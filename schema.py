@@ -23,50 +23,194 @@
 # }
 
 
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, List, Optional
 from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from model import TransactionType
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def user(item):
+
+# Response bodies are built straight from BSON documents and encoded once by
+# FastJSONResponse. Routes return the response object themselves, so FastAPI
+# skips jsonable_encoder and response-model validation; the models below only
+# describe the bodies in the OpenAPI docs.
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    # orjson encodes datetime, date and enums itself and only calls back for
+    # ObjectId; the json fallback keeps the service running without it.
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def _id(value):
+    return str(value) if value else None
+
+
+def user_out(doc: dict):
     return {
-        "_id": ObjectId(item.get("_id")),
-        "username": item.get("username"),
-        "email": item.get("email"),
-        "password": item.get("password"),
-        "phone_number": item.get("phone_number"),
-        "balance": item.get("balance", 0.00),
-        "created_at": item.get("created_at"),
-        "updated_at": item.get("updated_at")
+        "user_id": str(doc["_id"]),
+        "username": doc.get("username"),
+        "email": doc.get("email"),
+        "phone_number": doc.get("phone_number"),
+        "balance": doc.get("balance", 0.00),
+        "created_at": doc.get("created_at"),
+        "updated_at": doc.get("updated_at")
     }
 
-async def transaction(item):
+
+def transaction_out(doc: dict):
     return {
-    "_id": ObjectId(item.get("_id")),
-    "user_id": ObjectId(item.get("user_id")),
-    "transaction_type": item.get("transaction_type"),
-    "amount": item.get("amount", 0.00),
-    "description": item.get("description"),
-    "reference_transaction_id": ObjectId(item.get("reference_transaction_id")),
-    "recipient_user_id": ObjectId(item.get("recipient_user_id")),
-    "created_at": item.get("created_at")
-}
-
-async def transfer(item):
+        "transaction_id": str(doc["_id"]),
+        "user_id": str(doc["user_id"]),
+        "transaction_type": doc["transaction_type"],
+        "amount": doc["amount"],
+        "description": doc.get("description"),
+        "recipient_user_id": _id(doc.get("recipient_user_id")),
+        "reference_transaction_id": _id(doc.get("reference_transaction_id")),
+        "created_at": doc["created_at"]
+    }
+
+
+def transaction_summary(doc: dict):
     return {
-        "_id": ObjectId(item.get("_id")),
-        "user_id": ObjectId(item.get("user_id")),
-        "transaction_type": item.get("transaction_type"),
-        "amount": item.get("amount", 0.00),
-        "description": item.get("description"),
-        "reference_transaction_id": ObjectId(item.get("reference_transaction_id")),
-        "recipient_user_id": ObjectId(item.get("recipient_user_id")),
-        "created_at": item.get("created_at")
+        "transaction_id": str(doc["_id"]),
+        "transaction_type": doc["transaction_type"],
+        "amount": doc["amount"],
+        "description": doc.get("description"),
+        "created_at": doc["created_at"]
     }
 
-async def return_user_list(items):
-    return [await user(item) for item in items]
 
-async def return_transaction_list(items):
-    return [await transaction(item) for item in items]
+class UserOut(BaseModel):
+    user_id: str
+    username: str
+    email: str
+    phone_number: Optional[str] = None
+    balance: float
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+class UserMatch(BaseModel):
+    user_id: str
+    username: str
+    email: str
+    phone_number: Optional[str] = None
+
+
+class UserSearchPage(BaseModel):
+    users: List[UserMatch]
+    limit: int
+    next_cursor: Optional[str] = None
+
+
+class BalanceOut(BaseModel):
+    user_id: str
+    balance: float
+    last_updated: Optional[datetime] = None
+
+
+class WalletOperationOut(BaseModel):
+    transaction_id: str
+    user_id: str
+    amount: float
+    new_balance: float
+    transaction_type: TransactionType
+
+
+class TransactionOut(BaseModel):
+    transaction_id: str
+    user_id: str
+    transaction_type: TransactionType
+    amount: float
+    description: Optional[str] = None
+    recipient_user_id: Optional[str] = None
+    reference_transaction_id: Optional[str] = None
+    created_at: datetime
+
+
+class TransactionSummary(BaseModel):
+    transaction_id: str
+    transaction_type: TransactionType
+    amount: float
+    description: Optional[str] = None
+    created_at: datetime
+
+
+class TransactionPage(BaseModel):
+    transactions: List[TransactionSummary]
+    total: Optional[int] = None
+    page: Optional[int] = None
+    limit: int
+    next_cursor: Optional[str] = None
+
+
+class BulkTransactionsOut(BaseModel):
+    inserted: int
+    failed: int
+    results: List[dict]
+
+
+class TransferOut(BaseModel):
+    transfer_id: str
+    sender_transaction_id: str
+    recipient_transaction_id: str
+    amount: float
+    sender_new_balance: float
+    recipient_new_balance: float
+    status: str
+
+
+class TransferBatchOut(BaseModel):
+    batch_id: str
+    sender_user_id: str
+    status: str
+    total_transfers: int
+    transfers_completed: int
+    total_amount: float
+    amount_completed: float
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class AnalyticsPeriod(BaseModel):
+    period: Optional[str] = None
+    inflow: float
+    outflow: float
+    net: float
+    count: int
+    by_type: Dict[str, dict]
+
 
-async def return_transfer_list(items):
-    return [await transfer(item) for item in items]
\ No newline at end of file
+class AnalyticsOut(BaseModel):
+    user_id: str
+    from_: date = Field(alias="from")
+    to: date
+    granularity: str
+    periods: List[AnalyticsPeriod]
+    totals: AnalyticsPeriod
@@ -1,9 +1,29 @@
+import base64
+import csv
+import io
+import json
+import logging
+import zlib
 from bson import ObjectId
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from typing import List, Optional
-from core import db , users_collection, transactions_collection
-from model import User
-from schema import *
+from pydantic import ValidationError
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from core import client, db , users_collection, transfer_batches_collection
+from indexes import SEARCH_COLLATION
+from loader import USER_PROJECTION, user_loader
+from cache import balance_cache
+from ledger import ledger_writer
+from storage import ledger_store
+import shards
+import checkpoints
+import rollups
+import settings
+from model import BALANCE_SIGN, Transaction, TransactionType, User
+from schema import dumps, transaction_out, transaction_summary, user_out
+
+logger = logging.getLogger(__name__)
 
 
 
@@ -13,7 +33,10 @@ async def create_user(user: User):
     user_data["created_at"] = datetime.now()
     user_data["updated_at"] = datetime.now()
     
-    result = await users_collection.insert_one(user_data)
+    try:
+        result = await users_collection.insert_one(user_data)
+    except DuplicateKeyError:
+        return {"error": "Username or email already exists"}
     return {
         "user_id": str(result.inserted_id),
         "username": user_data.get("username"),
@@ -28,54 +51,169 @@ async def get_all_users():
     users = []
     cursor = users_collection.find()
     async for user in cursor:
-        users.append({
-            "user_id": str(user["_id"]),
-            "username": user.get("username"),
-            "email": user.get("email"),
-            "phone_number": user.get("phone_number"),
-            "balance": user.get("balance", 0.00),
-            "created_at": user.get("created_at"),
-            "updated_at": user.get("updated_at")
-        })
+        users.append(user_out(user))
     return users
 
+# Fields a user listing may select; password is never readable through it.
+USER_LIST_FIELDS = ("username", "email", "phone_number", "balance", "created_at", "updated_at")
+
+def _selected_user_fields(fields: Optional[str]):
+    if not fields:
+        return list(USER_LIST_FIELDS)
+    return [f.strip() for f in fields.split(",") if f.strip()]
+
+def validate_user_listing(format: str, fields: Optional[str], after: Optional[str]):
+    if format not in ("json", "ndjson"):
+        return "format must be json or ndjson"
+    unknown = [f for f in _selected_user_fields(fields) if f not in USER_LIST_FIELDS]
+    if unknown:
+        return f"Unknown fields: {', '.join(unknown)}"
+    if after and not ObjectId.is_valid(after):
+        return "Invalid cursor"
+    return None
+
+async def stream_users(format: str = "json", fields: Optional[str] = None, after: Optional[str] = None,
+                       limit: Optional[int] = None, batch_size: int = 1000, chunk_bytes: int = 64 * 1024):
+    # Serialises straight off the cursor so memory stays at one driver batch plus
+    # one output chunk regardless of collection size. Rows come back in _id order;
+    # pass the last user_id as `after` to fetch the next page.
+    selected = _selected_user_fields(fields)
+    query = {"_id": {"$gt": ObjectId(after)}} if after else {}
+    cursor = users_collection.find(query, {f: 1 for f in selected}, batch_size=batch_size).sort("_id", 1)
+    if limit:
+        cursor.limit(limit)
+
+    ndjson = format == "ndjson"
+    buffer = [] if ndjson else [b"["]
+    size = 0
+    first = True
+    async for user in cursor:
+        row = {"user_id": str(user["_id"])}
+        for field in selected:
+            row[field] = user.get(field, 0.00 if field == "balance" else None)
+        encoded = dumps(row)
+        if ndjson:
+            buffer.append(encoded + b"\n")
+        else:
+            buffer.append(encoded if first else b"," + encoded)
+        first = False
+        size += len(encoded)
+        if size >= chunk_bytes:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+
+    if not ndjson:
+        buffer.append(b"]")
+    if buffer:
+        yield b"".join(buffer)
+
+# Fields user search can match on, by case-insensitive prefix.
+USER_SEARCH_FIELDS = ("username", "email", "phone_number")
+
+def _encode_search_cursor(value: str, user_oid: ObjectId):
+    raw = json.dumps([value, str(user_oid)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_search_cursor(token: str):
+    value, user_id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    return value, ObjectId(user_id)
+
+async def search_users(q: str, field: str = "username", limit: int = 20, cursor: Optional[str] = None):
+    if field not in USER_SEARCH_FIELDS:
+        return {"error": f"field must be one of {', '.join(USER_SEARCH_FIELDS)}"}
+    q = (q or "").strip()
+    if len(q) < settings.USER_SEARCH_MIN_CHARS:
+        return {"error": f"q must be at least {settings.USER_SEARCH_MIN_CHARS} characters"}
+    if not 1 <= limit <= settings.USER_SEARCH_MAX_LIMIT:
+        return {"error": f"limit must be between 1 and {settings.USER_SEARCH_MAX_LIMIT}"}
+
+    # An anchored prefix as a range, so the collated {field, _id} index is
+    # walked from q to the last key starting with it; "\uffff" sorts after
+    # every character. A cursor seeks past the last row already returned.
+    upper = q + "\uffff"
+    query = {field: {"$gte": q, "$lt": upper}}
+    if cursor:
+        try:
+            value, last_oid = _decode_search_cursor(cursor)
+        except Exception:
+            return {"error": "Invalid cursor"}
+        query = {"$or": [
+            {field: {"$gt": value, "$lt": upper}},
+            {field: value, "_id": {"$gt": last_oid}}
+        ]}
+    rows = await users_collection.find(
+        query, {f: 1 for f in USER_SEARCH_FIELDS}, collation=SEARCH_COLLATION
+    ).sort([(field, 1), ("_id", 1)]).limit(limit).to_list(length=limit)
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = _encode_search_cursor(rows[-1][field], rows[-1]["_id"])
+    return {
+        "users": [{
+            "user_id": str(row["_id"]),
+            "username": row.get("username"),
+            "email": row.get("email"),
+            "phone_number": row.get("phone_number")
+        } for row in rows],
+        "limit": limit,
+        "next_cursor": next_cursor
+    }
+
+async def _load_user(user_id):
+    # Goes through the request's loader, so lookups of several users made
+    # together share one query and repeats within the request are free.
+    try:
+        user_oid = ObjectId(user_id)
+    except Exception:
+        return None
+    return await user_loader().load(user_oid)
+
 async def get_user(user_id):
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
+    user = await _load_user(user_id)
     if user:
-        return {
-            "user_id": str(user["_id"]),
-            "username": user.get("username"),
-            "email": user.get("email"),
-            "phone_number": user.get("phone_number"),
-            "balance": user.get("balance", 0.00),
-            "created_at": user.get("created_at"),
-            "updated_at": user.get("updated_at")
-        }
+        return user_out(user)
     return {"error": "User not found"}
 
+def validate_user_ids(ids: str):
+    user_ids = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+    if not user_ids:
+        return None, "ids must list at least one user id"
+    if len(user_ids) > settings.USER_BATCH_MAX_IDS:
+        return None, f"At most {settings.USER_BATCH_MAX_IDS} ids per request"
+    invalid = [i for i in user_ids if not ObjectId.is_valid(i)]
+    if invalid:
+        return None, f"Invalid user ids: {', '.join(invalid)}"
+    return user_ids, None
+
+async def get_users(user_ids: List[str]):
+    # Found users in the order asked for; unknown ids are listed as missing.
+    users = await user_loader().load_many([ObjectId(i) for i in user_ids])
+    return {
+        "users": [user_out(user) for user in users if user],
+        "missing": [i for i, user in zip(user_ids, users) if not user]
+    }
+
 async def update_user(user_id: str, user_data: dict):
     try:
-        user = await users_collection.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            return {"error": "User not found"}
-
         allowed_updates = {"username", "phone_number"}
         update_data = {k: v for k, v in user_data.items() if k in allowed_updates}
         update_data["updated_at"] = datetime.now()
 
-        await users_collection.update_one(
+        # One round trip: the update reports both whether the user exists
+        # and the document after the change.
+        updated_user = await users_collection.find_one_and_update(
             {"_id": ObjectId(user_id)},
-            {"$set": update_data}
+            {"$set": update_data},
+            projection=USER_PROJECTION,
+            return_document=ReturnDocument.AFTER
         )
-
-        updated_user = await users_collection.find_one({"_id": ObjectId(user_id)})
-        return {
-            "user_id": str(updated_user["_id"]),
-            "username": updated_user["username"],
-            "email": updated_user["email"],
-            "phone_number": updated_user.get("phone_number"),
-            "updated_at": updated_user["updated_at"]
-        }
+        if not updated_user:
+            return {"error": "User not found"}
+        user_loader().prime(updated_user["_id"], updated_user)
+        return user_out(updated_user)
+    except DuplicateKeyError:
+        return {"error": "Username already exists"}
     except Exception as e:
         return {"error": str(e)}
 
@@ -83,23 +221,106 @@ async def update_user(user_id: str, user_data: dict):
 
 # wallet service 
 
+# Every balance write bumps balance_version so cached copies can be ordered.
+_BALANCE_PROJECTION = {"balance": 1, "updated_at": 1, "balance_version": 1}
+
+def _cache_balance(user_id, user: dict):
+    # Any copy of the user the request loaded earlier now has a stale balance.
+    user_loader().clear(ObjectId(user_id))
+    # Hot wallets keep part of their balance on shard documents, so the user
+    # document alone is not something we can cache for them; user["balance"]
+    # already holds their whole total (see _debit and _credit).
+    if shards.is_hot(user_id):
+        balance_cache.invalidate(str(user_id))
+        shards.remember_total(user_id, user["balance"])
+        return
+    balance_cache.put(str(user_id), user["balance"], user.get("updated_at"), user.get("balance_version", 0))
+
+async def _debit(user_oid: ObjectId, amount: float, now: datetime, session=None):
+    # Single round trip: the $gte guard makes the balance check part of the write,
+    # so concurrent debits can never take the wallet below zero.
+    async def guarded():
+        return await users_collection.find_one_and_update(
+            {"_id": user_oid, "balance": {"$gte": amount}},
+            {"$inc": {"balance": -amount, "balance_version": 1}, "$set": {"updated_at": now}},
+            projection=_BALANCE_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+
+    updated = await guarded()
+    if updated is None:
+        # A hot wallet may hold enough across its shards; fold them back into
+        # the user document and try once more. The hot set is refreshed every
+        # HOT_ACCOUNTS_REFRESH_SECONDS, so ordinary wallets skip the extra read.
+        if shards.is_hot(user_oid) and await shards.drain(user_oid, session):
+            updated = await guarded()
+    if updated is not None and shards.is_hot(user_oid):
+        # Read in the same session as the debit, so the total matches what
+        # the transaction commits. Callers publish it once that happened.
+        updated["balance"] += await shards.shard_sum(user_oid, session)
+    return updated
+
+async def _credit(user_oid: ObjectId, amount: float, now: datetime, session=None):
+    shard = shards.pick_credit_shard(user_oid)
+    if shard and await shards.credit_shard(user_oid, shard, amount, session):
+        user = await users_collection.find_one({"_id": user_oid}, {"balance": 1}, session=session)
+        balance = user["balance"] + await shards.shard_sum(user_oid, session)
+        return {"_id": user_oid, "balance": balance, "updated_at": now}
+
+    updated = await users_collection.find_one_and_update(
+        {"_id": user_oid},
+        {"$inc": {"balance": amount, "balance_version": 1}, "$set": {"updated_at": now}},
+        projection=_BALANCE_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    if updated is not None and shards.is_hot(user_oid):
+        updated["balance"] += await shards.shard_sum(user_oid, session)
+    return updated
+
+async def _apply_balance_change(user_id: str, delta: float):
+    if delta < 0:
+        return await _debit(ObjectId(user_id), -delta, datetime.now())
+    return await _credit(ObjectId(user_id), delta, datetime.now())
+
+async def _write_ledger(user_id: str, delta: float, transaction: dict):
+    # The balance moved before the entry was queued. If the entry cannot be
+    # written, move it back so the wallet still matches its ledger, and drop
+    # every cached copy of the balance in between.
+    try:
+        return await ledger_writer.write(transaction)
+    except Exception:
+        reverted = await _apply_balance_change(user_id, -delta)
+        user_oid = ObjectId(user_id)
+        balance_cache.invalidate(str(user_id))
+        shards.forget_total(user_oid)
+        user_loader().clear(user_oid)
+        if reverted is None:
+            logger.error("could not revert %s of %s after a failed ledger write", delta, user_id)
+        raise
+
+async def _balance_change_error(user_id: str, amount: float):
+    # Only reached when the guarded update matched nothing, so the extra read
+    # stays off the hot path.
+    user = await users_collection.find_one({"_id": ObjectId(user_id)}, {"balance": 1})
+    if not user:
+        return {"error": "User not found"}
+    return {
+        "error": "Insufficient balance",
+        "current_balance": await shards.total_balance(user["_id"]) if shards.is_hot(user_id) else user["balance"],
+        "required_amount": amount
+    }
+
 async def withdraw_money(user_id: str, amount: float, description: Optional[str] = None):
     if amount <= 0:
         return {"error": "Amount must be positive"}
 
     try:
-        user = await users_collection.find_one({"_id": ObjectId(user_id)})
-        if not user:
-            return {"error": "User not found"}
-        
-        if user["balance"] < amount:
-            return {
-                "error": "Insufficient balance",
-                "current_balance": user["balance"],
-                "required_amount": amount
-            }
-
-        # Create transaction first
+        updated_user = await _apply_balance_change(user_id, -amount)
+        if not updated_user:
+            return await _balance_change_error(user_id, amount)
+
         transaction = {
             "user_id": ObjectId(user_id),
             "transaction_type": "DEBIT",
@@ -107,17 +328,11 @@ async def withdraw_money(user_id: str, amount: float, description: Optional[str]
             "description": description,
             "created_at": datetime.now()
         }
-        tx_result = await transactions_collection.insert_one(transaction)
-
-        # Update balance atomically
-        await users_collection.update_one(
-            {"_id": ObjectId(user_id)},
-            {"$inc": {"balance": -amount}}
-        )
+        transaction_id = await _write_ledger(user_id, -amount, transaction)
+        _cache_balance(user_id, updated_user)
 
-        updated_user = await users_collection.find_one({"_id": ObjectId(user_id)})
         return {
-            "transaction_id": str(tx_result.inserted_id),
+            "transaction_id": str(transaction_id),
             "user_id": str(user_id),
             "amount": amount,
             "new_balance": updated_user["balance"],
@@ -131,11 +346,10 @@ async def add_money(user_id: str, amount: float, description: Optional[str] = No
         return {"error": "Amount must be positive"}
 
     try:
-        user = await users_collection.find_one({"_id": ObjectId(user_id)})
-        if not user:
+        updated_user = await _apply_balance_change(user_id, amount)
+        if not updated_user:
             return {"error": "User not found"}
 
-        # Create transaction first
         transaction = {
             "user_id": ObjectId(user_id),
             "transaction_type": "CREDIT",
@@ -143,17 +357,11 @@ async def add_money(user_id: str, amount: float, description: Optional[str] = No
             "description": description,
             "created_at": datetime.now()
         }
-        tx_result = await transactions_collection.insert_one(transaction)
-
-        # Update balance atomically
-        await users_collection.update_one(
-            {"_id": ObjectId(user_id)},
-            {"$inc": {"balance": amount}}
-        )
+        transaction_id = await _write_ledger(user_id, amount, transaction)
+        _cache_balance(user_id, updated_user)
 
-        updated_user = await users_collection.find_one({"_id": ObjectId(user_id)})
         return {
-            "transaction_id": str(tx_result.inserted_id),
+            "transaction_id": str(transaction_id),
             "user_id": str(user_id),
             "amount": amount,
             "new_balance": updated_user["balance"],
@@ -163,9 +371,33 @@ async def add_money(user_id: str, amount: float, description: Optional[str] = No
         return {"error": str(e)}
 
 
+def _local_time(value: Optional[datetime]):
+    # Ledger timestamps are stored as naive local time.
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+async def get_balance_as_of(user_id: str, as_of: datetime):
+    user = await _load_user(user_id)
+    if not user:
+        return {"error": "User not found"}
+    as_of = _local_time(as_of)
+    result = await checkpoints.balance_as_of(user["_id"], as_of)
+    return {"user_id": user_id, "as_of": as_of, **result}
+
 async def get_balance(user_id):
-    user = await users_collection.find_one({"_id": ObjectId(user_id)})
+    if shards.is_hot(user_id):
+        total = await shards.total_balance(ObjectId(user_id))
+        if total is not None:
+            return {"user_id": user_id, "balance": total, "last_updated": datetime.now()}
+
+    cached = balance_cache.get(user_id)
+    if cached:
+        return {"user_id": user_id, "balance": cached["balance"], "last_updated": cached["updated_at"] or datetime.now()}
+
+    user = await users_collection.find_one({"_id": ObjectId(user_id)}, _BALANCE_PROJECTION)
     if user:
+        _cache_balance(user_id, user)
         return {"user_id": user_id, "balance": user["balance"], "last_updated": user.get("updated_at", datetime.now())}
     return {"error": "User not found"}
 
@@ -173,155 +405,627 @@ async def get_balance(user_id):
 # transaction service
 
 async def create_transaction(transaction_data: dict):
-    if transaction_data.get("amount", 0) <= 0:
+    amount = transaction_data.get("amount", 0)
+    if amount <= 0:
         return {"error": "Amount must be positive"}
+    user_id = transaction_data["user_id"]
+    transaction_type = TransactionType(transaction_data["transaction_type"])
+
+    try:
+        # The entry counts towards the user's ledger sum, so the balance moves
+        # with it under the same guard as add_money and withdraw_money.
+        sign = BALANCE_SIGN[transaction_type]
+        updated_user = await _apply_balance_change(user_id, sign * amount)
+        if not updated_user:
+            if sign < 0:
+                return await _balance_change_error(user_id, amount)
+            return {"error": "User not found"}
+
+        transaction = {
+            "user_id": ObjectId(user_id),
+            "transaction_type": transaction_type.value,
+            "amount": amount,
+            "description": transaction_data.get("description"),
+            "created_at": datetime.now()
+        }
+        transaction_id = await _write_ledger(user_id, sign * amount, transaction)
+        _cache_balance(user_id, updated_user)
+
+        return {
+            "transaction_id": str(transaction_id),
+            "user_id": str(user_id),
+            "transaction_type": transaction_type.value,
+            "amount": amount,
+            "description": transaction["description"],
+            "created_at": transaction["created_at"],
+            "new_balance": updated_user["balance"]
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+async def _ingest_writes(session, documents: list, deltas: dict, now: datetime):
+    # Inside a transaction, so the entries and the balances they move commit
+    # together. A user whose net change would take the wallet below zero gets
+    # none of their entries written, under the same guard as _debit.
+    rejected = set()
+    credits = []
+    for user_oid, delta in deltas.items():
+        if delta < 0:
+            if await _debit(user_oid, -delta, now, session) is None:
+                rejected.add(user_oid)
+        else:
+            credits.append(UpdateOne(
+                {"_id": user_oid}, {"$inc": {"balance": delta, "balance_version": 1}, "$set": {"updated_at": now}}
+            ))
+    if credits:
+        result = await users_collection.bulk_write(credits, ordered=False, session=session)
+        if result.matched_count != len(credits):
+            raise TransferError({"error": "User not found"})
+    kept = [document for document in documents if document["user_id"] not in rejected]
+    if kept:
+        await ledger_store.insert_many(kept, ordered=False, session=session)
+    return rejected
+
+async def _ingest_chunk(chunk: list, offset: int):
+    # chunk holds raw records; offset is the index of chunk[0] in the whole request.
+    results = [None] * len(chunk)
+    documents = []
+    positions = []
+
+    for i, record in enumerate(chunk):
+        if isinstance(record, Exception):
+            results[i] = {"index": offset + i, "error": str(record)}
+            continue
+        try:
+            transaction = Transaction.model_validate(record)
+            if transaction.amount <= 0:
+                raise ValueError("Amount must be positive")
+            user_oid = ObjectId(transaction.user_id)
+        except ValidationError as e:
+            results[i] = {"index": offset + i, "error": e.errors(include_url=False, include_context=False)}
+            continue
+        except Exception as e:
+            results[i] = {"index": offset + i, "error": str(e)}
+            continue
+        documents.append({
+            "_id": ObjectId(),
+            "user_id": user_oid,
+            "transaction_type": transaction.transaction_type.value,
+            "amount": transaction.amount,
+            "description": transaction.description,
+            "created_at": _local_time(transaction.timestamp)
+        })
+        positions.append(i)
+
+    if documents:
+        known = set()
+        async for user in users_collection.find({"_id": {"$in": list({d["user_id"] for d in documents})}}, {"_id": 1}):
+            known.add(user["_id"])
+        kept = []
+        for document, i in zip(documents, positions):
+            if document["user_id"] in known:
+                kept.append((document, i))
+            else:
+                results[i] = {"index": offset + i, "error": "User not found"}
+        documents = [d for d, _ in kept]
+        positions = [i for _, i in kept]
+
+    if not documents:
+        return results
+
+    # One balance change per user for the whole chunk instead of one per entry.
+    deltas = {}
+    for document in documents:
+        sign = BALANCE_SIGN[TransactionType(document["transaction_type"])]
+        deltas[document["user_id"]] = deltas.get(document["user_id"], 0) + sign * document["amount"]
+    try:
+        async with await client.start_session() as session:
+            rejected = await session.with_transaction(
+                lambda s: _ingest_writes(s, documents, deltas, datetime.now())
+            )
+    except Exception as e:
+        for i in positions:
+            results[i] = {"index": offset + i, "error": str(e)}
+        return results
+
+    starts = {}
+    written = []
+    for document, i in zip(documents, positions):
+        if document["user_id"] in rejected:
+            results[i] = {"index": offset + i, "error": "Insufficient balance"}
+            continue
+        results[i] = {"index": offset + i, "transaction_id": str(document["_id"])}
+        written.append(document)
+        starts[document["user_id"]] = min(starts.get(document["user_id"], document["created_at"]), document["created_at"])
+
+    loader = user_loader()
+    for user_oid in deltas:
+        balance_cache.invalidate(str(user_oid))
+        shards.forget_total(user_oid)
+        loader.clear(user_oid)
+    if written:
+        # Imported history can predate existing balance checkpoints.
+        await checkpoints.invalidate_checkpoints(starts)
+        await ledger_writer.after_write(written)
+    return results
+
+async def parse_ndjson(chunks):
+    # Turns a stream of byte chunks into one record per line; lines that are not
+    # valid JSON come through as exceptions so they get their own item result.
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield ValueError(f"Invalid JSON: {e}")
+    if pending.strip():
+        try:
+            yield json.loads(pending)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+
+async def iterate_records(records: list):
+    for record in records:
+        yield record
+
+async def bulk_create_transactions(records, chunk_size: int = settings.BULK_CHUNK_SIZE):
+    # records is an async iterable of raw dicts (or parse errors as Exception
+    # instances), consumed chunk by chunk so memory is bounded by chunk_size.
+    results = []
+    chunk = []
+    async for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            results.extend(await _ingest_chunk(chunk, len(results)))
+            chunk = []
+    if chunk:
+        results.extend(await _ingest_chunk(chunk, len(results)))
 
-    result = await transactions_collection.insert_one({
-        **transaction_data,
-        "created_at": datetime.now()
-    })
-    return {"transaction_id": str(result.inserted_id), **transaction_data}
+    inserted = sum(1 for r in results if "transaction_id" in r)
+    return {"inserted": inserted, "failed": len(results) - inserted, "results": results}
 
 async def get_transaction(transaction_id: str):
     try:
-        transaction = await transactions_collection.find_one({"_id": ObjectId(transaction_id)})
+        transaction = await ledger_store.get(ObjectId(transaction_id))
         if transaction:
-            return {
-                "transaction_id": str(transaction["_id"]),
-                "user_id": str(transaction["user_id"]),
-                "transaction_type": transaction["transaction_type"],
-                "amount": transaction["amount"],
-                "description": transaction.get("description"),
-                "recipient_user_id": str(transaction.get("recipient_user_id")) if transaction.get("recipient_user_id") else None,
-                "reference_transaction_id": str(transaction.get("reference_transaction_id")) if transaction.get("reference_transaction_id") else None,
-                "created_at": transaction["created_at"]
-            }
+            return transaction_out(transaction)
     except Exception:
         return {"error": "Invalid transaction ID"}
     return {"error": "Transaction not found"}
 
-async def get_user_transactions(user_id: str, page: int = 1, limit: int = 10):
-    skip = (page - 1) * limit
-    total = await transactions_collection.count_documents({"user_id": ObjectId(user_id)})
-    
-    cursor = transactions_collection.find({"user_id": ObjectId(user_id)})
-    cursor.sort("created_at", -1).skip(skip).limit(limit)
-    
-    transactions = []
-    async for tx in cursor:
-        transactions.append({
-            "transaction_id": str(tx["_id"]),
-            "transaction_type": tx["transaction_type"],
-            "amount": tx["amount"],
-            "description": tx.get("description"),
-            "created_at": tx["created_at"]
-        })
-    
+def _encode_cursor(created_at: datetime, tx_id: ObjectId):
+    raw = f"{created_at.isoformat()}|{tx_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(token: str):
+    raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+    created_at, tx_id = raw.split("|")
+    return datetime.fromisoformat(created_at), ObjectId(tx_id)
+
+async def get_user_transactions(user_id: str, page: int = 1, limit: int = 10,
+                                cursor: Optional[str] = None, include_total: Optional[bool] = None):
+    user_oid = ObjectId(user_id)
+
+    # Page mode keeps the exact total for existing clients; cursor mode skips the
+    # count unless asked, since it would be recomputed for every page.
+    if include_total is None:
+        include_total = cursor is None
+    total = await ledger_store.count(user_oid) if include_total else None
+
+    before = None
+    if cursor:
+        try:
+            before = _decode_cursor(cursor)
+        except Exception:
+            return {"error": "Invalid cursor"}
+
+    # A cursor seeks past the last row of the previous page instead of
+    # walking `skip` entries.
+    rows = await ledger_store.history(user_oid, before, 0 if cursor else (page - 1) * limit, limit)
+    transactions = [transaction_summary(tx) for tx in rows]
+    last = rows[-1] if rows else None
+
+    next_cursor = None
+    if last is not None and len(transactions) == limit:
+        next_cursor = _encode_cursor(last["created_at"], last["_id"])
+
     return {
         "transactions": transactions,
         "total": total,
-        "page": page,
-        "limit": limit
+        "page": None if cursor else page,
+        "limit": limit,
+        "next_cursor": next_cursor
     }
 
+EXPORT_FIELDS = ("transaction_id", "created_at", "transaction_type", "amount", "description",
+                 "recipient_user_id", "reference_transaction_id")
+
+async def validate_transaction_export(user_id: str, format: str, start: Optional[datetime], end: Optional[datetime]):
+    if format not in ("csv", "ndjson"):
+        return "format must be csv or ndjson"
+    if start and end and _local_time(start) > _local_time(end):
+        return "from must not be after to"
+    if not await _load_user(user_id):
+        return "User not found"
+    return None
+
+async def stream_user_transactions(user_id: str, format: str = "csv", start: Optional[datetime] = None,
+                                   end: Optional[datetime] = None, batch_size: int = settings.EXPORT_BATCH_SIZE,
+                                   chunk_bytes: int = 64 * 1024):
+    # One cursor over the user's history in ledger order. Rows are encoded
+    # as they arrive and flushed every chunk_bytes, so memory stays at one
+    # driver batch (one time window when bucketed) plus one output chunk
+    # however long the history is.
+    cursor = ledger_store.range(
+        ObjectId(user_id), _local_time(start), _local_time(end), batch_size,
+        {"transaction_type": 1, "amount": 1, "description": 1, "recipient_user_id": 1,
+         "reference_transaction_id": 1, "created_at": 1, "user_id": 1}
+    )
+
+    if format == "ndjson":
+        buffer = []
+        size = 0
+        async for tx in cursor:
+            encoded = dumps(transaction_out(tx)) + b"\n"
+            buffer.append(encoded)
+            size += len(encoded)
+            if size >= chunk_bytes:
+                yield b"".join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield b"".join(buffer)
+        return
+
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(EXPORT_FIELDS)
+    async for tx in cursor:
+        row = transaction_out(tx)
+        row["created_at"] = row["created_at"].isoformat()
+        writer.writerow([row[field] for field in EXPORT_FIELDS])
+        if text.tell() >= chunk_bytes:
+            yield text.getvalue().encode()
+            text.seek(0)
+            text.truncate()
+    if text.tell():
+        yield text.getvalue().encode()
+
+async def gzip_chunks(chunks):
+    # Compresses a byte stream incrementally into a single gzip member.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
 # transfer service
 
-async def transfer_money(sender_id: str, recipient_id: str, amount: float, description: Optional[str] = None):
-    if amount <= 0:
-        return {"error": "Amount must be positive"}
-    
-    try:
-        sender = await users_collection.find_one({"_id": ObjectId(sender_id)})
-        recipient = await users_collection.find_one({"_id": ObjectId(recipient_id)})
+class TransferError(Exception):
+    # Raised inside the transaction callback to abort it and carry the API error back out.
+    def __init__(self, result: dict):
+        super().__init__(result["error"])
+        self.result = result
+
+
+async def _transfer_legs(session, sender_id: str, recipient_id: str, amount: float, description: Optional[str]):
+    sender_oid = ObjectId(sender_id)
+    recipient_oid = ObjectId(recipient_id)
+    now = datetime.now()
 
+    updated_sender = await _debit(sender_oid, amount, now, session)
+    if not updated_sender:
+        sender = await users_collection.find_one({"_id": sender_oid}, {"balance": 1}, session=session)
         if not sender:
-            return {"error": "Sender not found"}
-        if not recipient:
-            return {"error": "Recipient not found"}
-        if sender["balance"] < amount:
-            return {
-                "error": "Insufficient balance",
-                "current_balance": sender["balance"],
-                "required_amount": amount
-            }
-
-        # Create sender's transaction (TRANSFER_OUT)
-        sender_tx = await transactions_collection.insert_one({
-            "user_id": ObjectId(sender_id),
+            raise TransferError({"error": "Sender not found"})
+        raise TransferError({
+            "error": "Insufficient balance",
+            "current_balance": sender["balance"],
+            "required_amount": amount
+        })
+
+    updated_recipient = await _credit(recipient_oid, amount, now, session)
+    if not updated_recipient:
+        raise TransferError({"error": "Recipient not found"})
+
+    # Both ids are allocated up front so each leg can point at the other
+    # and the pair goes out in one insert_many.
+    sender_tx_id = ObjectId()
+    recipient_tx_id = ObjectId()
+    legs = [
+        {
+            "_id": sender_tx_id,
+            "user_id": sender_oid,
             "transaction_type": "TRANSFER_OUT",
             "amount": amount,
             "description": description,
-            "recipient_user_id": ObjectId(recipient_id),
-            "created_at": datetime.now()
-        })
-
-        # Create recipient's transaction (TRANSFER_IN)
-        recipient_tx = await transactions_collection.insert_one({
-            "user_id": ObjectId(recipient_id),
+            "recipient_user_id": recipient_oid,
+            "reference_transaction_id": recipient_tx_id,
+            "created_at": now
+        },
+        {
+            "_id": recipient_tx_id,
+            "user_id": recipient_oid,
             "transaction_type": "TRANSFER_IN",
             "amount": amount,
             "description": description,
-            "reference_transaction_id": sender_tx.inserted_id,
-            "created_at": datetime.now()
-        })
+            "reference_transaction_id": sender_tx_id,
+            "created_at": now
+        }
+    ]
+    await ledger_store.insert_many(legs, session=session)
 
-        # Update sender's transaction with reference
-        await transactions_collection.update_one(
-            {"_id": sender_tx.inserted_id},
-            {"$set": {"reference_transaction_id": recipient_tx.inserted_id}}
-        )
+    result = {
+        "transfer_id": str(sender_tx_id),
+        "sender_transaction_id": str(sender_tx_id),
+        "recipient_transaction_id": str(recipient_tx_id),
+        "amount": amount,
+        "sender_new_balance": updated_sender["balance"],
+        "recipient_new_balance": updated_recipient["balance"],
+        "status": "completed"
+    }
+    return result, updated_sender, updated_recipient, legs
 
-        # Update balances atomically
-        await users_collection.update_one(
-            {"_id": ObjectId(sender_id)},
-            {"$inc": {"balance": -amount}}
-        )
-        await users_collection.update_one(
-            {"_id": ObjectId(recipient_id)},
-            {"$inc": {"balance": amount}}
-        )
 
-        # Get updated balances
-        updated_sender = await users_collection.find_one({"_id": ObjectId(sender_id)})
-        updated_recipient = await users_collection.find_one({"_id": ObjectId(recipient_id)})
+async def transfer_money(sender_id: str, recipient_id: str, amount: float, description: Optional[str] = None):
+    if amount <= 0:
+        return {"error": "Amount must be positive"}
 
-        return {
-            "transfer_id": str(sender_tx.inserted_id),
-            "sender_transaction_id": str(sender_tx.inserted_id),
-            "recipient_transaction_id": str(recipient_tx.inserted_id),
-            "amount": amount,
-            "sender_new_balance": updated_sender["balance"],
-            "recipient_new_balance": updated_recipient["balance"],
-            "status": "completed"
-        }
+    try:
+        # with_transaction retries the whole callback on TransientTransactionError
+        # and retries the commit on UnknownTransactionCommitResult.
+        async with await client.start_session() as session:
+            result, updated_sender, updated_recipient, legs = await session.with_transaction(
+                lambda s: _transfer_legs(s, sender_id, recipient_id, amount, description)
+            )
+        # Only publish balances and rollups once the transaction has committed.
+        _cache_balance(sender_id, updated_sender)
+        _cache_balance(recipient_id, updated_recipient)
+        await ledger_writer.after_write(legs)
+        return result
+    except TransferError as e:
+        return e.result
     except Exception as e:
         return {"error": str(e)}
-    await users_collection.update_one({"_id": ObjectId(recipient_id)}, {"$set": {"balance": recipient["balance"]}})
-
-    # Create transactions for both users
-    sender_transaction = {
-        "user_id": sender_id,
-        "amount": -amount,
-        "description": f"Transfer to {recipient_id}. {description or ''}",
-        "timestamp": datetime.now()
-    }
-    recipient_transaction = {
-        "user_id": recipient_id,
-        "amount": amount,
-        "description": f"Transfer from {sender_id}. {description or ''}",
-        "timestamp": datetime.now()
-    }
 
-    await transactions_collection.insert_one(sender_transaction)
-    await transactions_collection.insert_one(recipient_transaction)
 
+def _batch_status(batch: dict):
     return {
-        "message": "Transfer successful",
-        "sender_new_balance": sender["balance"],
-        "recipient_new_balance": recipient["balance"]
+        "batch_id": str(batch["_id"]),
+        "sender_user_id": str(batch["sender_user_id"]),
+        "status": batch["status"],
+        "total_transfers": batch["total_transfers"],
+        "transfers_completed": batch["next_index"],
+        "total_amount": batch["total_amount"],
+        "amount_completed": batch["amount_completed"],
+        "error": batch.get("error"),
+        "created_at": batch["created_at"],
+        "updated_at": batch["updated_at"]
     }
 
 
+BATCH_BUSY = "Batch is already being processed"
+
+
+async def _transfer_batch_chunk(session, batch: dict, start: int, end: int):
+    items = batch["items"][start:end]
+    sender_oid = batch["sender_user_id"]
+    chunk_total = sum(item["amount"] for item in items)
+    now = datetime.now()
+
+    # One guarded debit covers every recipient in the chunk.
+    updated_sender = await _debit(sender_oid, chunk_total, now, session)
+    if not updated_sender:
+        raise TransferError({"error": "Insufficient balance", "required_amount": chunk_total})
+
+    legs = []
+    credits = {}
+    for item in items:
+        out_id = ObjectId()
+        in_id = ObjectId()
+        legs.append({
+            "_id": out_id,
+            "user_id": sender_oid,
+            "transaction_type": "TRANSFER_OUT",
+            "amount": item["amount"],
+            "description": item.get("description"),
+            "recipient_user_id": item["recipient_user_id"],
+            "reference_transaction_id": in_id,
+            "batch_id": batch["_id"],
+            "created_at": now
+        })
+        legs.append({
+            "_id": in_id,
+            "user_id": item["recipient_user_id"],
+            "transaction_type": "TRANSFER_IN",
+            "amount": item["amount"],
+            "description": item.get("description"),
+            "reference_transaction_id": out_id,
+            "batch_id": batch["_id"],
+            "created_at": now
+        })
+        credits[item["recipient_user_id"]] = credits.get(item["recipient_user_id"], 0) + item["amount"]
+
+    # Progress is committed with the money, so a resumed batch starts exactly
+    # after the last chunk that went through. The next_index guard stops two
+    # runners from settling the same chunk.
+    progressed = await transfer_batches_collection.update_one(
+        {"_id": batch["_id"], "next_index": start},
+        {
+            "$set": {"next_index": end, "updated_at": now},
+            "$inc": {"amount_completed": chunk_total}
+        },
+        session=session
+    )
+    if progressed.matched_count != 1:
+        raise TransferError({"error": BATCH_BUSY})
+
+    credited = await users_collection.bulk_write([
+        UpdateOne({"_id": recipient_oid}, {"$inc": {"balance": amount, "balance_version": 1}, "$set": {"updated_at": now}})
+        for recipient_oid, amount in credits.items()
+    ], ordered=False, session=session)
+    # A recipient deleted since the batch was checked would leave its legs
+    # and the sender's debit with nobody credited.
+    if credited.matched_count != len(credits):
+        raise TransferError({"error": "Recipient not found"})
+    await ledger_store.insert_many(legs, ordered=False, session=session)
+
+    return updated_sender, list(credits), legs
+
+
+async def _run_transfer_batch(batch: dict):
+    chunk_size = batch["chunk_size"]
+    start = batch["next_index"]
+    await transfer_batches_collection.update_one(
+        {"_id": batch["_id"], "status": {"$ne": "completed"}},
+        {"$set": {"status": "processing", "error": None, "updated_at": datetime.now()}}
+    )
+
+    error = None
+    async with await client.start_session() as session:
+        while start < len(batch["items"]):
+            end = min(start + chunk_size, len(batch["items"]))
+            try:
+                updated_sender, recipients, legs = await session.with_transaction(
+                    lambda s: _transfer_batch_chunk(s, batch, start, end)
+                )
+            except TransferError as e:
+                if e.result["error"] == BATCH_BUSY:
+                    # Another runner owns the batch; leave its status to it.
+                    return {"error": BATCH_BUSY}
+                error = e.result["error"]
+                break
+            except Exception as e:
+                error = str(e)
+                break
+            _cache_balance(batch["sender_user_id"], updated_sender)
+            for recipient_oid in recipients:
+                balance_cache.invalidate(str(recipient_oid))
+                shards.forget_total(recipient_oid)
+                user_loader().clear(recipient_oid)
+            await ledger_writer.after_write(legs)
+            start = end
+
+    final = await transfer_batches_collection.find_one_and_update(
+        {"_id": batch["_id"]},
+        {"$set": {
+            "status": "failed" if error else "completed",
+            "error": error,
+            "updated_at": datetime.now()
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+    return _batch_status(final)
+
+
+async def transfer_money_batch(sender_id: str, transfers: list, description: Optional[str] = None,
+                               chunk_size: int = settings.TRANSFER_BATCH_CHUNK_SIZE):
+    if not transfers:
+        return {"error": "No transfers given"}
+    if not isinstance(chunk_size, int) or chunk_size <= 0:
+        return {"error": "chunk_size must be a positive integer"}
+    if len(transfers) > settings.TRANSFER_BATCH_MAX_ITEMS:
+        return {"error": f"A batch can hold at most {settings.TRANSFER_BATCH_MAX_ITEMS} transfers"}
+
+    try:
+        sender_oid = ObjectId(sender_id)
+        items = []
+        for i, transfer in enumerate(transfers):
+            amount = transfer.get("amount")
+            if not isinstance(amount, (int, float)) or amount <= 0:
+                return {"error": f"Transfer {i}: amount must be positive"}
+            if not ObjectId.is_valid(transfer.get("recipient_user_id")):
+                return {"error": f"Transfer {i}: invalid recipient_user_id"}
+            items.append({
+                "recipient_user_id": ObjectId(transfer["recipient_user_id"]),
+                "amount": amount,
+                "description": transfer.get("description", description)
+            })
+    except Exception as e:
+        return {"error": str(e)}
+
+    total = sum(item["amount"] for item in items)
+    sender = await users_collection.find_one({"_id": sender_oid}, {"balance": 1})
+    if not sender:
+        return {"error": "Sender not found"}
+    available = await shards.total_balance(sender_oid) if shards.is_hot(sender_oid) else sender["balance"]
+    if available < total:
+        return {
+            "error": "Insufficient balance",
+            "current_balance": available,
+            "required_amount": total
+        }
+
+    recipient_ids = list({item["recipient_user_id"] for item in items})
+    found = await users_collection.count_documents({"_id": {"$in": recipient_ids}})
+    if found != len(recipient_ids):
+        return {"error": "Recipient not found"}
+
+    now = datetime.now()
+    batch = {
+        "_id": ObjectId(),
+        "sender_user_id": sender_oid,
+        "items": items,
+        "total_transfers": len(items),
+        "total_amount": total,
+        "amount_completed": 0,
+        "chunk_size": chunk_size,
+        "next_index": 0,
+        "status": "pending",
+        "error": None,
+        "created_at": now,
+        "updated_at": now
+    }
+    await transfer_batches_collection.insert_one(batch)
+    return await _run_transfer_batch(batch)
+
+
+async def resume_transfer_batch(batch_id: str):
+    try:
+        batch = await transfer_batches_collection.find_one({"_id": ObjectId(batch_id)})
+    except Exception:
+        return {"error": "Invalid batch ID"}
+    if not batch:
+        return {"error": "Batch not found"}
+    if batch["status"] == "completed":
+        return _batch_status(batch)
+    return await _run_transfer_batch(batch)
+
+
+async def get_transfer_batch(batch_id: str):
+    try:
+        batch = await transfer_batches_collection.find_one({"_id": ObjectId(batch_id)}, {"items": 0})
+    except Exception:
+        return {"error": "Invalid batch ID"}
+    if not batch:
+        return {"error": "Batch not found"}
+    return _batch_status(batch)
+
+
 async def get_transfer_history(user_id):
-    transfers = await transactions_collection.find({"user_id": user_id}).to_list(length=None)
-    return {"user_id": user_id, "transfers": transfers}
\ No newline at end of file
+    transfers = await ledger_store.aggregate({"user_id": user_id}, []).to_list(length=None)
+    return {"user_id": user_id, "transfers": transfers}
+
+# analytics service
+
+async def get_analytics(user_id: str, start: Optional[date] = None, end: Optional[date] = None,
+                        granularity: str = "day"):
+    if granularity not in rollups.GRANULARITIES:
+        return {"error": f"granularity must be one of {', '.join(rollups.GRANULARITIES)}"}
+    end = end or date.today()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        return {"error": "from must not be after to"}
+    if (end - start).days >= settings.ANALYTICS_MAX_DAYS:
+        return {"error": f"Range can span at most {settings.ANALYTICS_MAX_DAYS} days"}
+    user = await _load_user(user_id)
+    if not user:
+        return {"error": "User not found"}
+
+    result = await rollups.analytics(user["_id"], start, end, granularity)
+    return {"user_id": user_id, "from": start, "to": end, "granularity": granularity, **result}
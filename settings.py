@@ -0,0 +1,166 @@
+import os
+
+
+def _env_bool(name: str, default: bool):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name: str, default: int):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# mongo
+# Credentials belong in the environment, never in this file. The server must be
+# a replica set (a single node started with --replSet is enough) or mongos:
+# startup refuses a standalone, e.g. "mongodb://localhost:27017/?replicaSet=rs0".
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "digital_wallet")
+MONGO_MAX_POOL_SIZE = _env_int("MONGO_MAX_POOL_SIZE", 100)
+MONGO_MIN_POOL_SIZE = _env_int("MONGO_MIN_POOL_SIZE", 0)
+MONGO_MAX_IDLE_TIME_MS = _env_int("MONGO_MAX_IDLE_TIME_MS", 0)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = _env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", 0)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 30_000)
+# Comma separated, in order of preference, e.g. "zstd,snappy". zstd needs the
+# zstandard package and snappy needs python-snappy.
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+MONGO_READ_CONCERN = os.getenv("MONGO_READ_CONCERN", "")
+MONGO_WRITE_CONCERN = os.getenv("MONGO_WRITE_CONCERN", "majority")
+MONGO_JOURNAL = _env_bool("MONGO_JOURNAL", True)
+MONGO_SERVER_API = os.getenv("MONGO_SERVER_API", "1")
+
+# balance cache
+BALANCE_CACHE_ENABLED = _env_bool("BALANCE_CACHE_ENABLED", True)
+BALANCE_CACHE_MAX_ENTRIES = _env_int("BALANCE_CACHE_MAX_ENTRIES", 100_000)
+# Upper bound on how stale a cached balance can be when another process changes it
+# and the change stream has not (yet) invalidated the entry.
+BALANCE_CACHE_TTL_SECONDS = _env_float("BALANCE_CACHE_TTL_SECONDS", 2.0)
+# Tail a change stream on users to invalidate entries written by other workers.
+# Needs a replica set.
+BALANCE_CACHE_WATCH = _env_bool("BALANCE_CACHE_WATCH", False)
+
+# ledger storage layout (see storage.py): "document" or "bucketed"
+LEDGER_LAYOUT = os.getenv("LEDGER_LAYOUT", "document")
+LEDGER_BUCKET_MAX_ENTRIES = _env_int("LEDGER_BUCKET_MAX_ENTRIES", 200)
+# Time window per bucket: "day" or "month".
+LEDGER_BUCKET_PERIOD = os.getenv("LEDGER_BUCKET_PERIOD", "month")
+# On-disk encoding for new ledger entries (codec.py): 1 keeps the long field
+# names and float amounts, 2 writes short keys and int64 minor units. Reads
+# accept both, so switch only after every instance runs a build that decodes v2.
+LEDGER_ENCODING = _env_int("LEDGER_ENCODING", 1)
+
+# user search
+USER_SEARCH_MIN_CHARS = _env_int("USER_SEARCH_MIN_CHARS", 1)
+USER_SEARCH_MAX_LIMIT = _env_int("USER_SEARCH_MAX_LIMIT", 100)
+# Most ids one GET /users?ids= call may ask for.
+USER_BATCH_MAX_IDS = _env_int("USER_BATCH_MAX_IDS", 100)
+
+# transaction export
+# Documents per driver round trip while streaming a history export.
+EXPORT_BATCH_SIZE = _env_int("EXPORT_BATCH_SIZE", 5000)
+
+# bulk ledger ingestion
+BULK_CHUNK_SIZE = _env_int("BULK_CHUNK_SIZE", 1000)
+
+# batch transfers
+# Recipients settled per multi-document transaction; the batch can be resumed
+# from the last committed chunk.
+TRANSFER_BATCH_CHUNK_SIZE = _env_int("TRANSFER_BATCH_CHUNK_SIZE", 500)
+TRANSFER_BATCH_MAX_ITEMS = _env_int("TRANSFER_BATCH_MAX_ITEMS", 50_000)
+
+# ledger group commit
+LEDGER_GROUP_COMMIT = _env_bool("LEDGER_GROUP_COMMIT", True)
+LEDGER_MAX_BATCH = _env_int("LEDGER_MAX_BATCH", 500)
+LEDGER_MAX_LINGER_MS = _env_float("LEDGER_MAX_LINGER_MS", 2.0)
+LEDGER_MAX_QUEUE = _env_int("LEDGER_MAX_QUEUE", 10_000)
+# Attempts at the post-write hook (rollups) before its entries are given up
+# on; the delay between attempts doubles from LEDGER_HOOK_RETRY_MS.
+LEDGER_HOOK_ATTEMPTS = _env_int("LEDGER_HOOK_ATTEMPTS", 5)
+LEDGER_HOOK_RETRY_MS = _env_float("LEDGER_HOOK_RETRY_MS", 100.0)
+
+# hot wallet balance shards
+HOT_MAX_SHARDS = _env_int("HOT_MAX_SHARDS", 64)
+# "random" or "round_robin"
+HOT_CREDIT_STRATEGY = os.getenv("HOT_CREDIT_STRATEGY", "random")
+HOT_BALANCE_CACHE_MS = _env_float("HOT_BALANCE_CACHE_MS", 500.0)
+HOT_ACCOUNTS_REFRESH_SECONDS = _env_float("HOT_ACCOUNTS_REFRESH_SECONDS", 10.0)
+
+# balance checkpoints
+# A snapshot is written after this many ledger entries, which bounds how many
+# entries a point-in-time balance query has to replay.
+CHECKPOINT_EVERY = _env_int("CHECKPOINT_EVERY", 1000)
+# How often the background job looks for accounts that need new checkpoints;
+# 0 disables it (run `python checkpoints.py` instead).
+CHECKPOINT_INTERVAL_SECONDS = _env_float("CHECKPOINT_INTERVAL_SECONDS", 300.0)
+# Entries younger than this are left out of checkpoints so writes still in
+# flight cannot land behind one.
+CHECKPOINT_LAG_SECONDS = _env_float("CHECKPOINT_LAG_SECONDS", 60.0)
+
+# daily rollups
+ROLLUPS_ENABLED = _env_bool("ROLLUPS_ENABLED", True)
+ROLLUP_BACKFILL_BATCH = _env_int("ROLLUP_BACKFILL_BATCH", 5000)
+# Widest range GET /analytics/{user_id} accepts.
+ANALYTICS_MAX_DAYS = _env_int("ANALYTICS_MAX_DAYS", 3660)
+
+# balance reconciliation
+RECONCILE_WORKERS = _env_int("RECONCILE_WORKERS", 8)
+# Users per _id range; each range is one $group over its slice of the ledger.
+RECONCILE_PARTITION_SIZE = _env_int("RECONCILE_PARTITION_SIZE", 5000)
+RECONCILE_TOLERANCE = _env_float("RECONCILE_TOLERANCE", 0.005)
+
+# month-end statements
+STATEMENT_DIR = os.getenv("STATEMENT_DIR", "statements")
+# Rendering processes; 0 uses every core.
+STATEMENT_WORKERS = _env_int("STATEMENT_WORKERS", 0)
+STATEMENT_PARTITION_SIZE = _env_int("STATEMENT_PARTITION_SIZE", 1000)
+
+# request metrics
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", True)
+# BSON-encodes every command and reply again just to count bytes, which costs
+# about as much as the driver's own encode; off unless someone is looking at
+# mongo_command_bytes_total.
+METRICS_COMMAND_BYTES = _env_bool("METRICS_COMMAND_BYTES", False)
+# Commands slower than this are logged with their shape (values stripped);
+# 0 disables the slow-command log.
+SLOW_COMMAND_MS = _env_float("SLOW_COMMAND_MS", 0.0)
+# Adds X-Mongo-Round-Trips (commands issued before the response started) to
+# every response; needs METRICS_ENABLED.
+ROUND_TRIP_HEADER = _env_bool("ROUND_TRIP_HEADER", True)
+
+# admission control for wallet mutations (see admission.py)
+ADMISSION_ENABLED = _env_bool("ADMISSION_ENABLED", True)
+# Global cap on mutations admitted at once, queued ones included.
+ADMISSION_MAX_IN_FLIGHT = _env_int("ADMISSION_MAX_IN_FLIGHT", 256)
+# Concurrent requests per wallet on the single-wallet mutation routes. 1 queues
+# them in arrival order; balance updates are guarded, so raising it is safe
+# and trades that ordering for throughput on busy wallets.
+ADMISSION_ACCOUNT_IN_FLIGHT = _env_int("ADMISSION_ACCOUNT_IN_FLIGHT", 1)
+# Token buckets kept in memory; the least recently used are evicted.
+ADMISSION_MAX_BUCKETS = _env_int("ADMISSION_MAX_BUCKETS", 100_000)
+# How long a request may wait behind others for the same account; 0 waits forever.
+ADMISSION_QUEUE_TIMEOUT_MS = _env_float("ADMISSION_QUEUE_TIMEOUT_MS", 2000.0)
+# Above this smoothed Mongo command latency the global cap shrinks in
+# proportion; 0 disables. Needs METRICS_ENABLED for the latency signal.
+ADMISSION_SHED_LATENCY_MS = _env_float("ADMISSION_SHED_LATENCY_MS", 250.0)
+# JSON of per-route overrides, e.g. '{"withdraw": {"rate": 2, "burst": 5}}'.
+ADMISSION_ROUTE_LIMITS = os.getenv("ADMISSION_ROUTE_LIMITS", "")
+
+# balance and ledger push events (see events.py)
+EVENTS_ENABLED = _env_bool("EVENTS_ENABLED", True)
+# Recent events kept for clients resuming with Last-Event-ID.
+EVENTS_REPLAY_SIZE = _env_int("EVENTS_REPLAY_SIZE", 10_000)
+# Undelivered events per subscriber before it is evicted as too slow.
+EVENTS_QUEUE_SIZE = _env_int("EVENTS_QUEUE_SIZE", 256)
+EVENTS_MAX_SUBSCRIBERS = _env_int("EVENTS_MAX_SUBSCRIBERS", 50_000)
+EVENTS_SOCKET_MAX_ACCOUNTS = _env_int("EVENTS_SOCKET_MAX_ACCOUNTS", 200)
+EVENTS_HEARTBEAT_SECONDS = _env_float("EVENTS_HEARTBEAT_SECONDS", 15.0)
+# Longest wait between attempts to reopen a failed change stream.
+EVENTS_RETRY_MAX_SECONDS = _env_float("EVENTS_RETRY_MAX_SECONDS", 60.0)
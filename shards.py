@@ -0,0 +1,193 @@
+import asyncio
+import itertools
+import logging
+import random
+import time
+from bson import ObjectId
+from pymongo import UpdateOne
+from core import client, users_collection, balance_shards_collection
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Hot wallets spread their balance over the user document (shard 0) plus
+# shard documents 1..N-1 in balance_shards, so concurrent credits land on
+# different documents instead of all conflicting on one. The true balance is
+# users.balance + sum(shards). Paths that do not know about shards keep
+# working because crediting or debiting users.balance is always valid.
+
+_hot = {}
+_round_robin = itertools.count()
+_totals = {}
+
+
+def is_hot(user_id):
+    return str(user_id) in _hot
+
+
+def shard_count(user_id):
+    return _hot.get(str(user_id), 1)
+
+
+def pick_credit_shard(user_id):
+    count = shard_count(user_id)
+    if count <= 1:
+        return 0
+    if settings.HOT_CREDIT_STRATEGY == "round_robin":
+        return next(_round_robin) % count
+    return random.randrange(count)
+
+
+async def credit_shard(user_oid: ObjectId, shard: int, amount: float, session=None):
+    # No upsert: shard documents only exist while the wallet is hot. A worker
+    # that has not yet seen a demotion gets False back and must credit the
+    # user document instead, so money never lands on an orphaned shard.
+    result = await balance_shards_collection.update_one(
+        {"user_id": user_oid, "shard": shard},
+        {"$inc": {"balance": amount}},
+        session=session
+    )
+    if result.matched_count:
+        return True
+    _hot.pop(str(user_oid), None)
+    return False
+
+
+def remember_total(user_oid: ObjectId, total: float):
+    # Called with a total computed from committed writes, never from inside a
+    # transaction that may still retry or abort. Changes made by other
+    # workers show up once the entry expires.
+    _totals[str(user_oid)] = (total, time.monotonic() + settings.HOT_BALANCE_CACHE_MS / 1000)
+
+
+def forget_total(user_oid: ObjectId):
+    _totals.pop(str(user_oid), None)
+
+
+async def shard_sum(user_oid: ObjectId, session=None):
+    # Balance held on shards 1..N-1; read in the caller's session so it sees
+    # the caller's own uncommitted writes.
+    async for row in balance_shards_collection.aggregate([
+        {"$match": {"user_id": user_oid}},
+        {"$group": {"_id": None, "total": {"$sum": "$balance"}}}
+    ], session=session):
+        return row["total"]
+    return 0
+
+
+async def total_balance(user_oid: ObjectId, use_cache: bool = True):
+    # Summing the shards is an extra aggregation, so the result is reused for
+    # HOT_BALANCE_CACHE_MS; hot wallets trade a little read staleness for
+    # write throughput.
+    cached = _totals.get(str(user_oid))
+    if use_cache and cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    user = await users_collection.find_one({"_id": user_oid}, {"balance": 1})
+    if not user:
+        return None
+    total = user["balance"] + await shard_sum(user_oid)
+    remember_total(user_oid, total)
+    return total
+
+
+async def _drain(session, user_oid: ObjectId):
+    # Inside a transaction: a credit landing on a shard while this runs is a
+    # write conflict, and with_transaction retries the whole drain.
+    moved = 0
+    async for shard in balance_shards_collection.find(
+        {"user_id": user_oid, "balance": {"$ne": 0}}, {"balance": 1}, session=session
+    ):
+        moved += shard["balance"]
+    if moved:
+        await balance_shards_collection.update_many(
+            {"user_id": user_oid, "balance": {"$ne": 0}},
+            {"$set": {"balance": 0}},
+            session=session
+        )
+        await users_collection.update_one(
+            {"_id": user_oid},
+            {"$inc": {"balance": moved, "balance_version": 1}},
+            session=session
+        )
+    return moved
+
+
+async def drain(user_oid: ObjectId, session=None):
+    # Moves every shard's balance back onto the user document so a guarded
+    # debit there sees the whole wallet. Joins the caller's transaction when
+    # one is given.
+    forget_total(user_oid)
+    if session is not None:
+        return await _drain(session, user_oid)
+    async with await client.start_session() as own_session:
+        return await own_session.with_transaction(lambda s: _drain(s, user_oid))
+
+
+async def _set_hot(session, user_oid: ObjectId, shards: int):
+    await _drain(session, user_oid)
+    await balance_shards_collection.delete_many({"user_id": user_oid, "shard": {"$gte": shards}}, session=session)
+    if shards > 1:
+        await balance_shards_collection.bulk_write([
+            UpdateOne({"user_id": user_oid, "shard": shard}, {"$setOnInsert": {"balance": 0}}, upsert=True)
+            for shard in range(1, shards)
+        ], session=session)
+        await users_collection.update_one({"_id": user_oid}, {"$set": {"hot_shards": shards}}, session=session)
+    else:
+        await users_collection.update_one({"_id": user_oid}, {"$unset": {"hot_shards": ""}}, session=session)
+
+
+async def promote(user_id: str, shards: int):
+    if shards < 2 or shards > settings.HOT_MAX_SHARDS:
+        return {"error": f"shards must be between 2 and {settings.HOT_MAX_SHARDS}"}
+    try:
+        user_oid = ObjectId(user_id)
+    except Exception:
+        return {"error": "Invalid user ID"}
+    if not await users_collection.find_one({"_id": user_oid}, {"_id": 1}):
+        return {"error": "User not found"}
+
+    async with await client.start_session() as session:
+        await session.with_transaction(lambda s: _set_hot(s, user_oid, shards))
+    _hot[str(user_oid)] = shards
+    forget_total(user_oid)
+    return {"user_id": user_id, "hot": True, "shards": shards, "balance": await total_balance(user_oid, use_cache=False)}
+
+
+async def demote(user_id: str):
+    try:
+        user_oid = ObjectId(user_id)
+    except Exception:
+        return {"error": "Invalid user ID"}
+    if not await users_collection.find_one({"_id": user_oid}, {"_id": 1}):
+        return {"error": "User not found"}
+
+    # Stop spreading credits first so nothing new lands on a shard that is
+    # about to be folded back and deleted.
+    _hot.pop(str(user_oid), None)
+    async with await client.start_session() as session:
+        await session.with_transaction(lambda s: _set_hot(s, user_oid, 1))
+    forget_total(user_oid)
+    return {"user_id": user_id, "hot": False, "shards": 1, "balance": await total_balance(user_oid, use_cache=False)}
+
+
+async def refresh_hot_accounts():
+    hot = {}
+    async for user in users_collection.find({"hot_shards": {"$exists": True}}, {"hot_shards": 1}):
+        hot[str(user["_id"])] = user["hot_shards"]
+    _hot.clear()
+    _hot.update(hot)
+    return hot
+
+
+async def watch_hot_accounts():
+    # Other workers promote and demote too; picking that up a few seconds late
+    # is safe because crediting shard 0 (the user document) is always correct.
+    while True:
+        try:
+            await refresh_hot_accounts()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("failed to refresh hot accounts: %s", e)
+        await asyncio.sleep(settings.HOT_ACCOUNTS_REFRESH_SECONDS)
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import time
+from bson import ObjectId
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from core import users_collection
+from ledger import SIGNED_AMOUNT
+from model import BALANCE_SIGN, TransactionType
+from reconcile import id_range, user_partitions
+from schema import dumps
+from storage import ledger_store
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Month-end statements for every user. Users are cut into _id ranges; for each
+# range the event loop pulls opening balances with one $group and the month's
+# ledger with one sorted aggregation, then hands the rows to a process pool
+# that builds the statements and writes them as one gzipped NDJSON file per
+# range. Fetching the next range overlaps with rendering the previous ones.
+#
+# Output goes to <out>/<YYYY-MM>/: manifest.json fixes the ranges for the run
+# and part-NNNNN.ndjson.gz appears only once a range is complete, so an
+# interrupted run resumes by skipping the parts that already exist.
+
+
+def month_bounds(month: str):
+    start = datetime.strptime(month, "%Y-%m")
+    end = datetime(start.year + (start.month == 12), start.month % 12 + 1, 1)
+    return start, end
+
+
+def _previous_month():
+    today = datetime.now()
+    year, month = (today.year, today.month - 1) if today.month > 1 else (today.year - 1, 12)
+    return f"{year:04d}-{month:02d}"
+
+
+def render_partition(path: str, month: str, users: list, openings: dict, entries: list):
+    # Runs in a worker process. entries are grouped by user and in ledger order
+    # within each user.
+    by_user = {}
+    for entry in entries:
+        by_user.setdefault(entry["user_id"], []).append(entry)
+
+    lines = 0
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wb", compresslevel=6) as out:
+        for user in users:
+            balance = openings.get(user["_id"], 0.0)
+            statement = {
+                "user_id": str(user["_id"]),
+                "username": user.get("username"),
+                "email": user.get("email"),
+                "period": month,
+                "opening_balance": balance,
+                "totals": {},
+                # [transaction_id, created_at, transaction_type, amount, description, balance_after]
+                "lines": []
+            }
+            for entry in by_user.get(user["_id"], ()):
+                transaction_type = entry["transaction_type"]
+                balance += BALANCE_SIGN[TransactionType(transaction_type)] * entry["amount"]
+                totals = statement["totals"].setdefault(transaction_type, {"amount": 0.0, "count": 0})
+                totals["amount"] += entry["amount"]
+                totals["count"] += 1
+                statement["lines"].append([
+                    str(entry["_id"]), entry["created_at"], transaction_type,
+                    entry["amount"], entry.get("description"), balance
+                ])
+            statement["closing_balance"] = balance
+            lines += len(statement["lines"])
+            out.write(dumps(statement) + b"\n")
+    os.replace(tmp, path)
+    return len(users), lines, os.path.getsize(path)
+
+
+async def _fetch_partition(lower, upper, start: datetime, end: datetime):
+    users = await users_collection.find(
+        id_range("_id", lower, upper), {"username": 1, "email": 1}
+    ).sort("_id", 1).to_list(length=None)
+
+    openings = {}
+    async for row in ledger_store.aggregate(
+        {**id_range("user_id", lower, upper), "created_at": {"$lt": start}},
+        [{"$group": {"_id": "$user_id", "balance": {"$sum": SIGNED_AMOUNT}}}],
+        allowDiskUse=True
+    ):
+        openings[row["_id"]] = row["balance"]
+
+    # user_id descending with created_at and _id ascending is the user_history
+    # index walked backwards, so in the document layout the sort needs no
+    # in-memory stage.
+    entries = await ledger_store.aggregate(
+        {**id_range("user_id", lower, upper), "created_at": {"$gte": start, "$lt": end}},
+        [
+            {"$sort": {"user_id": -1, "created_at": 1, "_id": 1}},
+            {"$project": {"user_id": 1, "transaction_type": 1, "amount": 1, "description": 1, "created_at": 1}}
+        ],
+        allowDiskUse=True
+    ).to_list(length=None)
+    return users, openings, entries
+
+
+async def _load_manifest(directory: str, month: str, partition_size: int, restart: bool):
+    path = os.path.join(directory, "manifest.json")
+    if os.path.exists(path) and not restart:
+        with open(path) as f:
+            manifest = json.load(f)
+        manifest["partitions"] = [[ObjectId(b) if b else None for b in bounds] for bounds in manifest["partitions"]]
+        return manifest
+
+    for name in os.listdir(directory):
+        if name.startswith("part-"):
+            os.remove(os.path.join(directory, name))
+    manifest = {
+        "month": month,
+        "partitions": await user_partitions(partition_size),
+        "created_at": datetime.now().isoformat()
+    }
+    with open(path, "w") as f:
+        json.dump({**manifest, "partitions": [[str(b) if b else None for b in bounds]
+                                              for bounds in manifest["partitions"]]}, f)
+    return manifest
+
+
+async def generate_statements(month: str = None, out_dir: str = None, workers: int = None,
+                              partition_size: int = None, restart: bool = False):
+    month = month or _previous_month()
+    out_dir = out_dir or settings.STATEMENT_DIR
+    workers = workers or settings.STATEMENT_WORKERS or os.cpu_count()
+    partition_size = partition_size or settings.STATEMENT_PARTITION_SIZE
+    start, end = month_bounds(month)
+
+    directory = os.path.join(out_dir, month)
+    os.makedirs(directory, exist_ok=True)
+    manifest = await _load_manifest(directory, month, partition_size, restart)
+
+    queue = asyncio.Queue()
+    for index, (lower, upper) in enumerate(manifest["partitions"]):
+        path = os.path.join(directory, f"part-{index:05d}.ndjson.gz")
+        if not os.path.exists(path):
+            queue.put_nowait((index, lower, upper, path))
+    skipped = len(manifest["partitions"]) - queue.qsize()
+
+    totals = {"users": 0, "lines": 0, "bytes": 0, "partitions": 0}
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+
+    # spawn rather than fork: the parent already runs the driver's threads.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        async def worker():
+            while not queue.empty():
+                index, lower, upper, path = queue.get_nowait()
+                users, openings, entries = await _fetch_partition(lower, upper, start, end)
+                count, lines, size = await loop.run_in_executor(
+                    pool, render_partition, path, month, users, openings, entries
+                )
+                totals["users"] += count
+                totals["lines"] += lines
+                totals["bytes"] += size
+                totals["partitions"] += 1
+                elapsed = time.perf_counter() - started
+                logger.info("part %d: %d statements, %d lines (%.0f statements/s)",
+                            index, count, lines, totals["users"] / elapsed if elapsed else 0)
+
+        # Twice as many fetchers as processes keeps the pool busy while the
+        # next ranges are read.
+        await asyncio.gather(*(worker() for _ in range(workers * 2)))
+
+    elapsed = time.perf_counter() - started
+    return {
+        "month": month,
+        "directory": directory,
+        "partitions": len(manifest["partitions"]),
+        "partitions_written": totals["partitions"],
+        "partitions_skipped": skipped,
+        "statements": totals["users"],
+        "lines": totals["lines"],
+        "bytes": totals["bytes"],
+        "seconds": round(elapsed, 3),
+        "statements_per_second": round(totals["users"] / elapsed, 1) if elapsed else 0.0,
+        "lines_per_second": round(totals["lines"] / elapsed, 1) if elapsed else 0.0
+    }
+
+
+if __name__ == "__main__":
+    # python statements.py --month 2024-05             statements for May 2024 (default: last month)
+    # python statements.py --month 2024-05 --restart   discard finished parts and start over
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Generate month-end statements for every user.")
+    parser.add_argument("--month", help="YYYY-MM, defaults to the previous month")
+    parser.add_argument("--out", default=settings.STATEMENT_DIR, help="output directory")
+    parser.add_argument("--workers", type=int, default=settings.STATEMENT_WORKERS, help="rendering processes (default: all cores)")
+    parser.add_argument("--partition-size", type=int, default=settings.STATEMENT_PARTITION_SIZE, help="users per output part")
+    parser.add_argument("--restart", action="store_true", help="start over instead of resuming")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(generate_statements(args.month, args.out, args.workers,
+                                                     args.partition_size, args.restart))))
@@ -0,0 +1,424 @@
+import argparse
+import asyncio
+import logging
+from bson import ObjectId
+from datetime import datetime
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from codec import DECODE_STAGES, decode, encode, on_shared_fields, projection as widen
+from core import client, db, jobs_collection, ledger_buckets_collection, transactions_collection
+from model import TransactionType
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Where ledger entries live. Both layouts store and return the same entry
+# documents ({_id, user_id, transaction_type, amount, ...}); only the
+# container differs.
+#
+#   document  one document per entry in `transactions`.
+#   bucketed  entries are $push-ed into `ledger_buckets` documents, one per
+#             user and time window (LEDGER_BUCKET_PERIOD) holding at most
+#             LEDGER_BUCKET_MAX_ENTRIES entries, with the bucket's count and
+#             per-type sums kept in the same update. A history page reads one
+#             or two buckets, and the indexes grow per bucket, not per entry.
+#
+# Aggregations go through aggregate(match, stages): the match selects entries
+# and the stages see one document per entry in either layout.
+#
+# Entries are written in the encoding codec.py is set to (LEDGER_ENCODING)
+# and every read path decodes, so callers only ever see v1 documents.
+
+
+def _prepare(entry: dict):
+    # The caller's entry learns its _id here, and transaction_type is stored
+    # as the plain string even when the caller hands over a TransactionType.
+    entry.setdefault("_id", ObjectId())
+    entry["transaction_type"] = TransactionType(entry["transaction_type"]).value
+    return entry
+
+
+def _encoded(entry: dict, encoding: int):
+    return encode(_prepare(entry), encoding)
+
+
+class DocumentLedger:
+    layout = "document"
+
+    def __init__(self, collection, encoding: int = None):
+        self.collection = collection
+        self.encoding = encoding
+
+    async def insert_one(self, entry: dict, session=None):
+        await self.collection.insert_one(_encoded(entry, self.encoding), session=session)
+
+    async def insert_many(self, entries: list, ordered: bool = True, session=None):
+        await self.collection.insert_many([_encoded(e, self.encoding) for e in entries],
+                                          ordered=ordered, session=session)
+
+    async def get(self, transaction_oid: ObjectId):
+        return decode(await self.collection.find_one({"_id": transaction_oid}))
+
+    async def count(self, user_oid: ObjectId):
+        return await self.collection.count_documents({"user_id": user_oid})
+
+    async def history(self, user_oid: ObjectId, before: tuple = None, skip: int = 0, limit: int = 10):
+        # Newest first. before is the (created_at, _id) of the last row already seen.
+        query = {"user_id": user_oid}
+        if before:
+            query["$or"] = [
+                {"created_at": {"$lt": before[0]}},
+                {"created_at": before[0], "_id": {"$lt": before[1]}}
+            ]
+        cursor = self.collection.find(
+            query, widen({"transaction_type": 1, "amount": 1, "description": 1, "created_at": 1})
+        ).sort([("created_at", -1), ("_id", -1)]).skip(skip).limit(limit)
+        return [decode(entry) for entry in await cursor.to_list(length=limit)]
+
+    async def range(self, user_oid: ObjectId, start: datetime = None, end: datetime = None,
+                    batch_size: int = 1000, projection: dict = None):
+        # Oldest first, start and end inclusive.
+        query = {"user_id": user_oid}
+        if start or end:
+            query["created_at"] = {}
+            if start:
+                query["created_at"]["$gte"] = start
+            if end:
+                query["created_at"]["$lte"] = end
+        cursor = self.collection.find(query, widen(projection), batch_size=batch_size) \
+            .sort([("created_at", 1), ("_id", 1)])
+        async for entry in cursor:
+            yield decode(entry)
+
+    def aggregate(self, match: dict, stages: list, **kwargs):
+        # Leading stages on _id, user_id and created_at go ahead of the decode
+        # so a $sort after the $match is still served by the index instead of
+        # sorting the decoded entries in memory.
+        split = _encoding_independent(stages)
+        return self.collection.aggregate(
+            [{"$match": match}, *stages[:split], *DECODE_STAGES, *stages[split:]], **kwargs)
+
+
+def _encoding_independent(stages: list):
+    split = 0
+    while split < len(stages) and on_shared_fields(stages[split]):
+        split += 1
+    return split
+
+
+def bucket_period(created_at: datetime):
+    if settings.LEDGER_BUCKET_PERIOD == "day":
+        return datetime(created_at.year, created_at.month, created_at.day)
+    return datetime(created_at.year, created_at.month, 1)
+
+
+def _entry_key(entry: dict):
+    return entry["created_at"], entry["_id"]
+
+
+class BucketedLedger:
+    layout = "bucketed"
+
+    def __init__(self, collection, max_entries: int, encoding: int = None):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.encoding = encoding
+
+    def _updates(self, entries: list):
+        # One upsert per (user, window) group, split so no push can take a
+        # bucket past max_entries; a full bucket simply stops matching and the
+        # upsert opens the next one. Returns the ops and, per op, the indexes
+        # of the entries it carries.
+        groups = {}
+        for i, entry in enumerate(entries):
+            groups.setdefault((entry["user_id"], bucket_period(entry["created_at"])), []).append(i)
+
+        ops = []
+        positions = []
+        for (user_oid, period), indexes in groups.items():
+            for n in range(0, len(indexes), self.max_entries):
+                piece = indexes[n:n + self.max_entries]
+                pushed = [_prepare(entries[i]) for i in piece]
+                totals = {"count": len(pushed)}
+                for entry in pushed:
+                    key = f"totals.{entry['transaction_type']}"
+                    totals[key] = totals.get(key, 0) + entry["amount"]
+                ops.append(UpdateOne(
+                    {"user_id": user_oid, "period": period, "count": {"$lte": self.max_entries - len(pushed)}},
+                    {
+                        "$push": {"entries": {"$each": [_encoded(e, self.encoding) for e in pushed]}},
+                        "$inc": totals,
+                        "$min": {"first_at": min(e["created_at"] for e in pushed)},
+                        "$max": {"last_at": max(e["created_at"] for e in pushed)}
+                    },
+                    upsert=True
+                ))
+                positions.append(piece)
+        return ops, positions
+
+    async def insert_one(self, entry: dict, session=None):
+        await self.insert_many([entry], session=session)
+
+    async def insert_many(self, entries: list, ordered: bool = True, session=None):
+        ops, positions = self._updates(entries)
+        if not ops:
+            return
+        try:
+            await self.collection.bulk_write(ops, ordered=ordered, session=session)
+        except BulkWriteError as e:
+            # Report failures per entry, as insert_many would.
+            errors = []
+            for error in e.details.get("writeErrors", []):
+                for i in positions[error["index"]]:
+                    errors.append({**error, "index": i})
+            raise BulkWriteError({**e.details, "writeErrors": errors})
+
+    async def get(self, transaction_oid: ObjectId):
+        bucket = await self.collection.find_one(
+            {"entries._id": transaction_oid}, {"entries": {"$elemMatch": {"_id": transaction_oid}}}
+        )
+        return decode(bucket["entries"][0]) if bucket else None
+
+    async def count(self, user_oid: ObjectId):
+        total = 0
+        async for bucket in self.collection.find({"user_id": user_oid}, {"count": 1}):
+            total += bucket["count"]
+        return total
+
+    def _buckets(self, user_oid: ObjectId, newest_first: bool, start: datetime = None, end: datetime = None):
+        query = {"user_id": user_oid}
+        if start or end:
+            query["period"] = {}
+            if start:
+                query["period"]["$gte"] = bucket_period(start)
+            if end:
+                query["period"]["$lte"] = end
+        direction = -1 if newest_first else 1
+        return self.collection.find(query, {"period": 1, "entries": 1}, batch_size=8) \
+            .sort([("period", direction), ("_id", direction)])
+
+    async def _by_period(self, buckets, newest_first: bool):
+        # Entries within a window may arrive out of order, so each window is
+        # sorted as a whole; windows themselves never overlap.
+        period = None
+        pending = []
+        async for bucket in buckets:
+            if bucket["period"] != period and pending:
+                yield sorted(pending, key=_entry_key, reverse=newest_first)
+                pending = []
+            period = bucket["period"]
+            pending.extend(decode(entry) for entry in bucket["entries"])
+        if pending:
+            yield sorted(pending, key=_entry_key, reverse=newest_first)
+
+    async def history(self, user_oid: ObjectId, before: tuple = None, skip: int = 0, limit: int = 10):
+        rows = []
+        async for entries in self._by_period(self._buckets(user_oid, True, end=before[0] if before else None), True):
+            rows.extend(e for e in entries if before is None or _entry_key(e) < before)
+            if len(rows) >= skip + limit:
+                break
+        return rows[skip:skip + limit]
+
+    async def range(self, user_oid: ObjectId, start: datetime = None, end: datetime = None,
+                    batch_size: int = 1000, projection: dict = None):
+        async for entries in self._by_period(self._buckets(user_oid, False, start, end), False):
+            for entry in entries:
+                if (start is None or entry["created_at"] >= start) and (end is None or entry["created_at"] <= end):
+                    yield entry
+
+    def _prefilter(self, match: dict):
+        # A bucket-level filter that keeps every bucket holding a matching
+        # entry, built only from fields both encodings share: _id is checked
+        # through the array and created_at bounds become period bounds so the
+        # user_period index applies.
+        prefilter = {}
+        for field, condition in match.items():
+            if field == "user_id":
+                prefilter["user_id"] = condition
+            elif field == "created_at" and isinstance(condition, dict):
+                period = {}
+                for op in ("$gte", "$gt"):
+                    if op in condition:
+                        period["$gte"] = bucket_period(condition[op])
+                for op in ("$lte", "$lt"):
+                    if op in condition:
+                        period[op] = condition[op]
+                if period:
+                    prefilter["period"] = period
+            elif field == "_id":
+                prefilter["entries._id"] = condition
+        return prefilter
+
+    def aggregate(self, match: dict, stages: list, **kwargs):
+        split = _encoding_independent(stages)
+        return self.collection.aggregate([
+            {"$match": self._prefilter(match)},
+            {"$unwind": "$entries"},
+            {"$replaceRoot": {"newRoot": "$entries"}},
+            {"$match": match},
+            *stages[:split],
+            *DECODE_STAGES,
+            *stages[split:]
+        ], **kwargs)
+
+
+def ledger_for(layout: str, encoding: int = None):
+    if layout == "bucketed":
+        return BucketedLedger(ledger_buckets_collection, settings.LEDGER_BUCKET_MAX_ENTRIES, encoding)
+    if layout == "document":
+        return DocumentLedger(transactions_collection, encoding)
+    raise ValueError(f"Unknown ledger layout {layout!r}")
+
+
+ledger_store = ledger_for(settings.LEDGER_LAYOUT)
+
+
+# Migration between layouts. Entries are copied in _id order in batches; each
+# batch and its progress marker commit in one transaction, so an interrupted
+# run resumes where it stopped and never copies an entry twice. Each run
+# copies everything written before it started: run it, switch LEDGER_LAYOUT
+# and restart the service, then run it again to pick up entries the old
+# layout received in between. The source is left in place.
+
+async def _migrate_batch(session, source, target, job_id: str, lower, upper):
+    match = {"_id": {"$lte": upper}}
+    if lower is not None:
+        match["_id"]["$gt"] = lower
+    entries = await source.aggregate(match, [{"$sort": {"_id": 1}}], session=session).to_list(length=None)
+    await target.insert_many(entries, session=session)
+    await jobs_collection.update_one(
+        {"_id": job_id},
+        {"$set": {"last_id": upper, "updated_at": datetime.now()}},
+        session=session
+    )
+    return len(entries)
+
+
+async def migrate(to: str, batch_size: int = 5000, restart: bool = False):
+    source = ledger_for("bucketed" if to == "document" else "document")
+    target = ledger_for(to)
+    job_id = f"ledger_layout_{to}"
+    if restart:
+        await jobs_collection.delete_one({"_id": job_id})
+    state = await jobs_collection.find_one({"_id": job_id}) or {}
+    lower = state.get("last_id")
+    until = ObjectId()
+
+    batches = 0
+    copied = 0
+    async with await client.start_session() as session:
+        while True:
+            match = {"_id": {"$lt": until}}
+            if lower is not None:
+                match["_id"]["$gt"] = lower
+            boundary = await source.aggregate(match, [
+                {"$sort": {"_id": 1}}, {"$skip": batch_size - 1}, {"$limit": 1}, {"$project": {"_id": 1}}
+            ]).to_list(length=1)
+            if not boundary:
+                boundary = await source.aggregate(match, [
+                    {"$sort": {"_id": -1}}, {"$limit": 1}, {"$project": {"_id": 1}}
+                ]).to_list(length=1)
+                if not boundary:
+                    break
+            upper = boundary[0]["_id"]
+            copied += await session.with_transaction(
+                lambda s: _migrate_batch(s, source, target, job_id, lower, upper)
+            )
+            batches += 1
+            lower = upper
+            logger.info("ledger migration to %s reached %s (%d entries)", to, upper, copied)
+    return {"to": to, "batches": batches, "entries_copied": copied}
+
+
+# Re-encoding in place. Walks the current layout in _id order and rewrites
+# entries not yet in the target encoding; progress is saved after every batch
+# and each write is guarded on the state it read, so the job can be stopped,
+# rerun and run next to live traffic. pause_ms between batches keeps it from
+# competing with the service for the working set.
+
+async def reencode(version: int, batch_size: int = 1000, pause_ms: float = 0, restart: bool = False):
+    store = ledger_store
+    job_id = f"ledger_encoding_v{version}_{store.layout}"
+    if restart:
+        await jobs_collection.delete_one({"_id": job_id})
+    state = await jobs_collection.find_one({"_id": job_id}) or {}
+    lower = state.get("last_id")
+    pending = {"v": 2} if version == 1 else {"v": {"$ne": 2}}
+
+    batches = 0
+    rewritten = 0
+    stale = 0
+    while True:
+        query = {"_id": {"$gt": lower}} if lower is not None else {}
+        if store.layout == "document":
+            docs = await store.collection.find({**query, **pending}).sort("_id", 1) \
+                .limit(batch_size).to_list(length=batch_size)
+            ops = [ReplaceOne({"_id": d["_id"], "v": d.get("v")}, encode(decode(d), version)) for d in docs]
+        else:
+            # A bucket is rewritten whole and only if no entry was pushed
+            # into it since it was read.
+            docs = await store.collection.find(query, {"count": 1, "entries": 1}).sort("_id", 1) \
+                .limit(batch_size).to_list(length=batch_size)
+            ops = [UpdateOne(
+                {"_id": b["_id"], "count": b["count"]},
+                {"$set": {"entries": [encode(decode(e), version) for e in b["entries"]]}}
+            ) for b in docs if any((e.get("v") == 2) != (version == 2) for e in b["entries"])]
+        if not docs:
+            break
+        if ops:
+            result = await store.collection.bulk_write(ops, ordered=False)
+            rewritten += result.matched_count
+            stale += len(ops) - result.matched_count
+        lower = docs[-1]["_id"]
+        await jobs_collection.update_one(
+            {"_id": job_id},
+            {"$set": {"last_id": lower, "updated_at": datetime.now()}},
+            upsert=True
+        )
+        batches += 1
+        logger.info("ledger re-encoding to v%d reached %s (%d rewritten)", version, lower, rewritten)
+        if pause_ms:
+            await asyncio.sleep(pause_ms / 1000)
+    if stale:
+        logger.warning("%d buckets changed while being re-encoded; rerun with --restart to finish them", stale)
+    return {"layout": store.layout, "version": version, "batches": batches, "rewritten": rewritten, "stale": stale}
+
+
+async def layout_stats():
+    # Entry counts and on-disk sizes of both layouts, for comparing them.
+    stats = {}
+    for layout in ("document", "bucketed"):
+        store = ledger_for(layout)
+        info = await db.command("collStats", store.collection.name)
+        stats[layout] = {
+            "documents": info.get("count", 0),
+            "data_bytes": info.get("size", 0),
+            "storage_bytes": info.get("storageSize", 0),
+            "index_bytes": info.get("totalIndexSize", 0),
+            "avg_document_bytes": info.get("avgObjSize", 0)
+        }
+    return stats
+
+
+if __name__ == "__main__":
+    # python storage.py --to bucketed          copy the document ledger into buckets
+    # python storage.py --to document          and back
+    # python storage.py --stats                sizes of both layouts
+    # python storage.py --reencode 2           rewrite the current layout in the v2 encoding
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Migrate ledger entries between storage layouts.")
+    parser.add_argument("--to", choices=("document", "bucketed"))
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--restart", action="store_true", help="ignore saved progress")
+    parser.add_argument("--stats", action="store_true")
+    parser.add_argument("--reencode", type=int, choices=(1, 2), help="rewrite entries in this encoding")
+    parser.add_argument("--pause-ms", type=float, default=0, help="sleep between re-encoding batches")
+    args = parser.parse_args()
+    if args.stats:
+        print(asyncio.run(layout_stats()))
+    elif args.reencode:
+        print(asyncio.run(reencode(args.reencode, args.batch_size, args.pause_ms, args.restart)))
+    elif args.to:
+        print(asyncio.run(migrate(args.to, args.batch_size, args.restart)))
+    else:
+        parser.error("pass --to, --reencode or --stats")
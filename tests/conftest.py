@@ -0,0 +1,38 @@
+import itertools
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import backend  # noqa: E402
+
+# Every test gets its own mongomock-motor database (benchmarks/backend.py), so
+# nothing here needs a server. Tests that depend on mongod behaviour (explain,
+# change streams, transactions) take the `mongod` fixture and are skipped
+# unless TEST_MONGO_URI points at a scratch deployment.
+
+_databases = itertools.count()
+
+
+@pytest.fixture(autouse=True)
+def mock_db():
+    name = f"wallet_test_{next(_databases)}"
+    backend.use_mock(name)
+    yield name
+
+
+@pytest.fixture
+def mongod():
+    uri = os.getenv("TEST_MONGO_URI")
+    if not uri:
+        pytest.skip("set TEST_MONGO_URI to run tests against mongod")
+    name = f"wallet_test_{next(_databases)}"
+    backend.use_mongod(uri, name)
+    yield name
+    import core
+    from pymongo import MongoClient
+    core.close()
+    with MongoClient(uri) as sync_client:
+        sync_client.drop_database(name)
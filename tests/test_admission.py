@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+
+
+def _controller():
+    from admission import AdmissionController
+    controller = AdmissionController(max_in_flight=100, max_buckets=100, queue_timeout_ms=50, shed_latency_ms=0)
+    controller.limits["withdraw"]["in_flight"] = 1
+    return controller
+
+
+def test_waiter_released_while_timing_out(monkeypatch):
+    # wait_for can yield between cancelling the waiter and raising; a release
+    # landing there pops the cancelled waiter before the timeout handler runs.
+    async def scenario():
+        import admission
+        controller = _controller()
+        await controller.acquire("withdraw", "alice")
+
+        async def timeout_with_release(waiter, timeout):
+            waiter.cancel()
+            controller.release("alice")
+            raise asyncio.TimeoutError()
+
+        monkeypatch.setattr(admission.asyncio, "wait_for", timeout_with_release)
+        with pytest.raises(HTTPException) as rejected:
+            await controller.acquire("withdraw", "alice")
+        assert rejected.value.status_code == 429
+        assert controller.rejected["queue_timeout"] == 1
+        assert controller.stats()["accounts_active"] == 0 and controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_requests_for_one_account_queue_in_arrival_order():
+    async def scenario():
+        from admission import AdmissionController
+        controller = AdmissionController(max_in_flight=100, max_buckets=100, queue_timeout_ms=1000, shed_latency_ms=0)
+        assert controller.limits["withdraw"]["in_flight"] == 1
+        await controller.acquire("withdraw", "bob")
+        admitted = []
+
+        async def request(n):
+            await controller.acquire("withdraw", "bob")
+            admitted.append(n)
+
+        waiting = [asyncio.create_task(request(n)) for n in range(3)]
+        for n in range(3):
+            await asyncio.sleep(0)
+            assert admitted == list(range(n))
+            controller.release("bob")
+            await asyncio.sleep(0)
+        await asyncio.gather(*waiting)
+        assert admitted == [0, 1, 2]
+
+    asyncio.run(scenario())
+
+
+def test_account_in_flight_is_configurable(monkeypatch):
+    async def scenario():
+        import settings
+        monkeypatch.setattr(settings, "ADMISSION_ACCOUNT_IN_FLIGHT", 8)
+        from admission import AdmissionController
+        controller = AdmissionController(max_in_flight=100, max_buckets=100, queue_timeout_ms=50, shed_latency_ms=0)
+        for _ in range(8):
+            await controller.acquire("withdraw", "carol")
+        assert controller.in_flight == 8
+
+    asyncio.run(scenario())
@@ -0,0 +1,138 @@
+import asyncio
+import time
+from bson import ObjectId
+from tests.test_service import _user
+
+
+def test_writes_go_through_and_stale_reads_end_with_the_ttl(monkeypatch):
+    async def scenario():
+        import service
+        from cache import balance_cache
+        from core import users_collection
+        monkeypatch.setattr(balance_cache, "ttl_seconds", 0.2)
+        user_id = await _user("quinn", 10)
+        assert balance_cache.get(user_id)["balance"] == 10
+
+        await service.add_money(user_id, 5)
+        assert balance_cache.get(user_id)["balance"] == 15
+        assert (await service.get_balance(user_id))["balance"] == 15
+
+        # Out of band: no write-through and no change stream here, so the
+        # cached value may be served until it expires, but never after.
+        await users_collection.update_one({"_id": ObjectId(user_id)}, {"$inc": {"balance": 100}})
+        written = time.monotonic()
+        while (await service.get_balance(user_id))["balance"] != 115:
+            assert time.monotonic() - written <= 0.2
+            await asyncio.sleep(0.02)
+
+    asyncio.run(scenario())
+
+
+def test_an_older_version_never_replaces_a_newer_one():
+    from cache import BalanceCache
+    cache = BalanceCache(10, 60)
+    cache.put("u", 20, version=3)
+    cache.put("u", 10, version=2)
+    assert cache.get("u")["balance"] == 20
+    cache.invalidate("u", version=3)
+    assert cache.get("u")["balance"] == 20
+    cache.invalidate("u", version=4)
+    assert cache.get("u") is None
+
+
+class _Stream:
+    def __init__(self, changes):
+        self._changes = changes
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for change in self._changes:
+            if isinstance(change, Exception):
+                raise change
+            yield change
+
+
+class _WatchedCollection:
+    def __init__(self, *streams):
+        self._streams = list(streams)
+
+    def watch(self, pipeline):
+        if not self._streams:
+            raise asyncio.CancelledError()
+        return _Stream(self._streams.pop(0))
+
+
+def _update(user_id, fields):
+    return {"operationType": "update", "documentKey": {"_id": user_id},
+            "updateDescription": {"updatedFields": fields}}
+
+
+def test_change_stream_invalidates_other_writers_balances(monkeypatch):
+    async def scenario():
+        import cache as cache_module
+        from cache import BalanceCache, watch_balance_changes
+        cache = BalanceCache(10, 60)
+        for user_id in ("own", "other", "renamed", "deleted", "later"):
+            cache.put(user_id, 1, version=5)
+        pause = asyncio.sleep
+        monkeypatch.setattr(cache_module.asyncio, "sleep", lambda seconds: pause(0))
+
+        seen = []
+        collection = _WatchedCollection(
+            [
+                _update("own", {"balance": 1, "balance_version": 5}),
+                _update("other", {"balance": 2, "balance_version": 6}),
+                _update("renamed", {"username": "x"}),
+                {"operationType": "delete", "documentKey": {"_id": "deleted"}},
+                RuntimeError("stream lost"),
+            ],
+        )
+        original_clear = cache.clear
+
+        def clear():
+            seen.append(sorted(cache._entries))
+            original_clear()
+        cache.clear = clear
+
+        try:
+            await watch_balance_changes(collection, cache)
+        except asyncio.CancelledError:
+            pass
+        # Before the stream broke only foreign balance changes were dropped;
+        # losing the stream then empties the cache.
+        assert seen == [["later", "own", "renamed"]]
+        assert cache.stats()["entries"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_out_of_band_write_is_seen_within_the_bound(mongod):
+    async def scenario():
+        import service
+        import settings
+        from cache import balance_cache, watch_balance_changes
+        from core import users_collection
+        user_id = await _user("rita", 10)
+        watcher = asyncio.create_task(watch_balance_changes(users_collection))
+        try:
+            await asyncio.sleep(0.5)
+            assert (await service.get_balance(user_id))["balance"] == 10
+            assert balance_cache.get(user_id) is not None
+            await users_collection.update_one({"_id": ObjectId(user_id)},
+                                              {"$inc": {"balance": 5, "balance_version": 1}})
+            written = time.monotonic()
+            while (await service.get_balance(user_id))["balance"] != 15:
+                assert time.monotonic() - written <= settings.BALANCE_CACHE_TTL_SECONDS
+                await asyncio.sleep(0.01)
+        finally:
+            watcher.cancel()
+
+    asyncio.run(scenario())
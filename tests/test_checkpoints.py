@@ -0,0 +1,66 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from tests.test_service import _user
+
+
+class _NoCheckpointYet:
+    # What a pass sees when another one is writing the same user's
+    # checkpoints at the same time: none there yet.
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def find_one(self, *args, **kwargs):
+        return None
+
+
+def test_overlapping_passes_write_each_checkpoint_once(monkeypatch):
+    async def scenario():
+        import checkpoints
+        import service
+        from core import balance_checkpoints_collection
+        from indexes import INDEXES
+        monkeypatch.setattr(checkpoints.settings, "CHECKPOINT_LAG_SECONDS", 0)
+        await balance_checkpoints_collection.create_indexes(
+            [m for m in INDEXES["balance_checkpoints"] if m.document.get("unique")])
+        user_id = await _user("frank")
+        for _ in range(6):
+            await service.add_money(user_id, 1)
+
+        assert await checkpoints.checkpoint_user(ObjectId(user_id), 2) == 3
+        monkeypatch.setattr(checkpoints, "balance_checkpoints_collection",
+                            _NoCheckpointYet(balance_checkpoints_collection))
+        assert await checkpoints.checkpoint_user(ObjectId(user_id), 2) == 0
+        assert await balance_checkpoints_collection.count_documents({"user_id": ObjectId(user_id)}) == 3
+        monkeypatch.undo()
+        assert (await checkpoints.balance_as_of(ObjectId(user_id), datetime.now()))["balance"] == 6
+
+    asyncio.run(scenario())
+
+
+def test_high_water_mark_is_utc(monkeypatch):
+    # West of UTC a naive local "now" read as UTC lies in the past, which
+    # used to leave the newest entries out of every pass.
+    monkeypatch.setenv("TZ", "Etc/GMT+5")
+    time.tzset()
+    try:
+        async def scenario():
+            import checkpoints
+            from storage import ledger_store
+            monkeypatch.setattr(checkpoints.settings, "CHECKPOINT_LAG_SECONDS", 0)
+            written = datetime.now(timezone.utc) - timedelta(seconds=5)
+            await ledger_store.insert_one({
+                "_id": ObjectId.from_datetime(written), "user_id": ObjectId(), "transaction_type": "CREDIT",
+                "amount": 1.0, "created_at": datetime.now() - timedelta(seconds=5)
+            })
+            result = await checkpoints.run_checkpoints(every=1)
+            assert result == {"users": 1, "checkpoints_written": 1}
+
+        asyncio.run(scenario())
+    finally:
+        monkeypatch.undo()
+        time.tzset()
@@ -0,0 +1,30 @@
+import asyncio
+import pytest
+
+
+class _Admin:
+    def __init__(self, hello):
+        self.hello = hello
+
+    async def command(self, name):
+        assert name == "hello"
+        return self.hello
+
+
+class _Client:
+    def __init__(self, hello):
+        self.admin = _Admin(hello)
+
+
+@pytest.mark.parametrize("hello", [{"setName": "rs0"}, {"msg": "isdbgrid"}])
+def test_connect_accepts_replica_sets_and_mongos(monkeypatch, hello):
+    import core
+    monkeypatch.setattr(core, "get_client", lambda: _Client(hello))
+    assert asyncio.run(core.connect()).admin.hello == hello
+
+
+def test_connect_refuses_a_standalone_server(monkeypatch):
+    import core
+    monkeypatch.setattr(core, "get_client", lambda: _Client({"isWritablePrimary": True}))
+    with pytest.raises(RuntimeError, match="replica set"):
+        asyncio.run(core.connect())
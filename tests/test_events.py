@@ -0,0 +1,103 @@
+import asyncio
+import gc
+import tracemalloc
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+import pytest
+
+
+def _hub(**kwargs):
+    from events import EventHub
+    return EventHub(replay_size=1000, queue_size=256, max_subscribers=100_000, **kwargs)
+
+
+def test_idle_subscribers_stay_small():
+    async def scenario():
+        hub = _hub()
+        count = 5000
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        subscribers = [hub.subscribe(str(ObjectId())) for _ in range(count)]
+        # Traffic for accounts nobody follows only fills the fixed replay ring.
+        for n in range(5000):
+            hub.publish(str(ObjectId()), "balance", {"balance": n})
+        per_subscriber = (tracemalloc.get_traced_memory()[0] - before) / count
+        tracemalloc.stop()
+
+        assert per_subscriber < 4096
+        assert all(not s.events for s in subscribers)
+        for subscriber in subscribers:
+            hub.unsubscribe(subscriber)
+        assert hub.stats()["subscribers"] == 0 and hub.stats()["accounts"] == 0
+
+    asyncio.run(scenario())
+
+
+class _FailingDatabase:
+    def __init__(self, error):
+        self.error = error
+        self.attempts = 0
+
+    def watch(self, *args, **kwargs):
+        self.attempts += 1
+        raise self.error
+
+
+def test_hub_turns_off_without_change_streams():
+    async def scenario():
+        hub = _hub()
+        subscriber = hub.subscribe("u1")
+        database = _FailingDatabase(OperationFailure("only supported on replica sets", code=40573))
+        await asyncio.wait_for(hub.run(database), 1)
+        assert database.attempts == 1
+        assert not hub.available
+        assert [event[1] for event in subscriber.drain()] == ["unavailable"]
+        assert hub.stats()["subscribers"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_hub_backs_off_between_failed_attempts(monkeypatch):
+    import events
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+        if len(delays) == 8:
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(events.asyncio, "sleep", sleep)
+    monkeypatch.setattr(events.settings, "EVENTS_RETRY_MAX_SECONDS", 30)
+
+    async def scenario():
+        with pytest.raises(asyncio.CancelledError):
+            await _hub().run(_FailingDatabase(ConnectionError("no server")))
+
+    asyncio.run(scenario())
+    assert delays == [1, 2, 4, 8, 16, 30, 30, 30]
+
+
+def test_hot_wallet_balance_event_carries_the_total():
+    async def scenario():
+        import shards
+        from core import balance_shards_collection
+        hub = _hub()
+        user_oid = ObjectId()
+        await balance_shards_collection.insert_many([
+            {"user_id": user_oid, "shard": 1, "balance": 7.0},
+            {"user_id": user_oid, "shard": 2, "balance": 3.0},
+        ])
+        shards._hot[str(user_oid)] = 3
+        try:
+            subscriber = hub.subscribe(str(user_oid))
+            await hub.handle_change({
+                "ns": {"coll": "users"}, "documentKey": {"_id": user_oid},
+                "updateDescription": {"updatedFields": {"balance": 40.0, "balance_version": 5}}
+            })
+        finally:
+            shards._hot.pop(str(user_oid), None)
+        (_, event_type, data), = subscriber.drain()
+        assert event_type == "balance" and data["balance"] == 50.0
+
+    asyncio.run(scenario())
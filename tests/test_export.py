@@ -0,0 +1,67 @@
+import asyncio
+import tracemalloc
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+# The export must hold one driver batch plus one output chunk whatever the
+# history length, so the peak traced allocation while draining it is
+# compared for two history sizes an order of magnitude apart.
+
+_START = datetime(2024, 1, 1)
+
+
+def _row(user_oid, i):
+    return {"_id": ObjectId(), "user_id": user_oid, "transaction_type": "CREDIT", "amount": 1.5,
+            "description": f"statement line {i}", "created_at": _START + timedelta(seconds=i)}
+
+
+class _GeneratedLedger:
+    # Yields rows as they are asked for, like a server cursor; mongomock
+    # materializes every match up front, which would hide what the export
+    # itself keeps.
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def range(self, user_oid, start=None, end=None, batch_size=1000, projection=None):
+        for i in range(self.rows):
+            yield _row(user_oid, i)
+
+
+async def _peak(user_id, format):
+    import service
+    tracemalloc.start()
+    try:
+        size = 0
+        async for chunk in service.stream_user_transactions(user_id, format):
+            size += len(chunk)
+        return tracemalloc.get_traced_memory()[1], size
+    finally:
+        tracemalloc.stop()
+
+
+def test_export_memory_does_not_grow_with_history(monkeypatch):
+    async def scenario():
+        import service
+        user_id = str(ObjectId())
+        for format in ("csv", "ndjson"):
+            monkeypatch.setattr(service, "ledger_store", _GeneratedLedger(4_000))
+            small, small_size = await _peak(user_id, format)
+            monkeypatch.setattr(service, "ledger_store", _GeneratedLedger(40_000))
+            large, large_size = await _peak(user_id, format)
+            assert large_size > 9 * small_size
+            assert large < 1024 * 1024 and large < small * 1.5
+
+    asyncio.run(scenario())
+
+
+def test_export_memory_is_bounded_against_mongod(mongod):
+    async def scenario():
+        from storage import ledger_store
+        user_oid = ObjectId()
+        for offset in range(0, 200_000, 10_000):
+            await ledger_store.insert_many([_row(user_oid, i) for i in range(offset, offset + 10_000)])
+        peak, size = await _peak(str(user_oid), "csv")
+        assert size > 200_000 * 40
+        assert peak < 16 * 1024 * 1024
+
+    asyncio.run(scenario())
@@ -0,0 +1,53 @@
+import asyncio
+from bson import ObjectId
+
+
+def _writer(on_write):
+    from ledger import LedgerWriter
+    from storage import ledger_store
+    return LedgerWriter(ledger_store, 100, 1.0, 1000, on_write=on_write)
+
+
+def _entry():
+    from datetime import datetime
+    return {"user_id": ObjectId(), "transaction_type": "CREDIT", "amount": 1.0, "created_at": datetime.now()}
+
+
+def test_writes_return_before_the_hook_finishes():
+    async def scenario():
+        release = asyncio.Event()
+        seen = []
+
+        async def slow_hook(documents):
+            await release.wait()
+            seen.extend(documents)
+
+        writer = _writer(slow_hook)
+        writer.start()
+        await asyncio.wait_for(asyncio.gather(*(writer.write(_entry()) for _ in range(10))), 1)
+        assert seen == [] and writer.stats()["pending_hooks"] == 1
+        release.set()
+        await writer.stop()
+        assert len(seen) == 10 and writer.stats()["pending_hooks"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_failed_hooks_are_retried(monkeypatch):
+    async def scenario():
+        import settings
+        monkeypatch.setattr(settings, "LEDGER_HOOK_RETRY_MS", 1.0)
+        calls = []
+
+        async def flaky_hook(documents):
+            calls.append(len(documents))
+            if len(calls) < 3:
+                raise RuntimeError("rollups unavailable")
+
+        writer = _writer(flaky_hook)
+        writer.start()
+        await asyncio.gather(*(writer.write(_entry()) for _ in range(5)))
+        await writer.stop()
+        assert calls == [5, 5, 5] and writer.stats()["hook_failures"] == 0
+
+    asyncio.run(scenario())
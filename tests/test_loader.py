@@ -0,0 +1,49 @@
+import asyncio
+from tests.test_service import _user
+
+
+class _CountingFinds:
+    # Stands in for command monitoring, which mongomock does not emit: every
+    # find counts towards the request's X-Mongo-Round-Trips.
+    def __init__(self, collection):
+        self._collection = collection
+        self.finds = []
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def find(self, *args, **kwargs):
+        from metrics import current_request
+        self.finds.append(args[0])
+        stats = current_request.get()
+        if stats is not None:
+            stats.add(0.0, 0, 0)
+        return self._collection.find(*args, **kwargs)
+
+
+def test_loads_in_one_request_share_one_query(monkeypatch):
+    from fastapi.testclient import TestClient
+    import loader
+    import main
+    user_ids = asyncio.run(_seed())
+    counting = _CountingFinds(loader.users_collection)
+    monkeypatch.setattr(loader, "users_collection", counting)
+    client = TestClient(main.app)
+
+    one_by_one = [client.get(f"/users/{user_id}") for user_id in user_ids]
+    assert all(r.status_code == 200 for r in one_by_one)
+    assert sum(int(r.headers["x-mongo-round-trips"]) for r in one_by_one) == len(user_ids) == len(counting.finds)
+
+    counting.finds.clear()
+    missing = "0" * 24
+    batched = client.get("/users", params={"ids": ",".join(user_ids + [user_ids[0], missing])})
+    assert batched.status_code == 200
+    assert [u["user_id"] for u in batched.json()["users"]] == user_ids
+    assert batched.json()["missing"] == [missing]
+    assert batched.headers["x-mongo-round-trips"] == "1"
+    assert len(counting.finds) == 1
+    assert sorted(str(oid) for oid in counting.finds[0]["_id"]["$in"]) == sorted(user_ids + [missing])
+
+
+async def _seed():
+    return [await _user(f"loader{i}") for i in range(5)]
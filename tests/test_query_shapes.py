@@ -0,0 +1,142 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from bson import ObjectId
+import pytest
+from benchmarks import backend
+from metrics import _shape
+from model import User
+
+# QUERY_SHAPES (indexes.py) is what `python indexes.py --verify` explains
+# against a live server. This runs every code path that queries the database
+# against mongomock, records the filters it sends, and fails on any shape
+# missing from the list, so the verification cannot silently fall behind.
+
+_FILTERED = {"find", "find_one", "find_one_and_update", "update_one", "update_many", "delete_one",
+             "delete_many", "replace_one", "count_documents"}
+
+
+def _filters(name: str, args: tuple, kwargs: dict):
+    if name in _FILTERED:
+        return [args[0] if args else kwargs.get("filter", {})]
+    if name == "aggregate":
+        pipeline = args[0] if args else kwargs["pipeline"]
+        return [pipeline[0]["$match"]] if pipeline and "$match" in pipeline[0] else [{}]
+    if name == "bulk_write":
+        return [op._filter for op in args[0] if hasattr(op, "_filter")]
+    return []
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    seen = []
+    original = backend._CountingCollection.__getattr__
+
+    def recording(self, name):
+        attr = original(self, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            for query in _filters(name, args, kwargs):
+                seen.append((self._collection.name, _shape(query)))
+            return attr(*args, **kwargs)
+        return call
+    monkeypatch.setattr(backend._CountingCollection, "__getattr__", recording)
+    return seen
+
+
+def _use_layout(monkeypatch, layout: str):
+    # Modules bind ledger_store at import, so each one is pointed at the store.
+    import checkpoints, ledger, reconcile, rollups, service, statements, storage
+    store = storage.ledger_for(layout)
+    for module in (checkpoints, reconcile, rollups, service, statements, storage):
+        monkeypatch.setattr(module, "ledger_store", store)
+    monkeypatch.setattr(ledger.ledger_writer, "collection", store)
+
+
+async def _workload(layout: str):
+    import checkpoints
+    import reconcile
+    import rollups
+    import service
+    import shards
+    import statements
+    import storage
+
+    ids = []
+    for name in ("alice", "bob", "carol"):
+        created = await service.create_user(User(username=name, email=f"{name}@example.com", password="p",
+                                                 phone_number="+15550000"))
+        ids.append(created["user_id"])
+    a, b, c = ids
+
+    await service.update_user(a, {"username": "alice2"})
+    await service.get_user(a)
+    await service.get_users([a, b])
+    [chunk async for chunk in service.stream_users("json", None, a, 10)]
+    for field in ("username", "email", "phone_number"):
+        page = await service.search_users("a" if field != "phone_number" else "+1", field, 1)
+        if page.get("next_cursor"):
+            await service.search_users("a" if field != "phone_number" else "+1", field, 1, page["next_cursor"])
+
+    await service.add_money(a, 500)
+    await service.withdraw_money(a, 10)
+    await service.withdraw_money(a, 10_000)
+    await service.create_transaction({"user_id": b, "transaction_type": "CREDIT", "amount": 5,
+                                      "description": "x", "timestamp": datetime.now()})
+    await service.bulk_create_transactions(service.iterate_records([
+        {"user_id": c, "transaction_type": "CREDIT", "amount": 3, "description": "bulk",
+         "timestamp": (datetime.now() - timedelta(days=3)).isoformat()}
+    ]))
+    transfer = await service.transfer_money(a, b, 20)
+    batch = await service.transfer_money_batch(a, [{"recipient_user_id": b, "amount": 1},
+                                                   {"recipient_user_id": c, "amount": 2}])
+    await service.get_transfer_batch(batch["batch_id"])
+    await service.resume_transfer_batch(batch["batch_id"])
+    await service.get_balance(a)
+    await service.get_balance_as_of(a, datetime.now())
+    # Everything above predates the live boundary and goes to the backfill.
+    await rollups.mark_live()
+
+    page = await service.get_user_transactions(a, 1, 2)
+    if page.get("next_cursor"):
+        await service.get_user_transactions(a, 1, 2, cursor=page["next_cursor"])
+    await service.validate_transaction_export(a, "csv", None, None)
+    [chunk async for chunk in service.stream_user_transactions(a, "csv", datetime.now() - timedelta(days=1),
+                                                                 datetime.now())]
+    await service.get_transaction(transfer["sender_transaction_id"])
+    await service.get_transfer_history(ObjectId(a))
+    await service.get_analytics(a, date.today() - timedelta(days=7), date.today())
+
+    await shards.promote(a, 4)
+    for _ in range(4):
+        await service.add_money(a, 5)
+    await service.withdraw_money(a, 400)
+    await service.transfer_money(b, a, 1)
+    await shards.refresh_hot_accounts()
+    await shards.demote(a)
+
+    await checkpoints.run_checkpoints(every=1)
+    await checkpoints.balance_as_of(ObjectId(a), datetime.now())
+    await checkpoints.invalidate_checkpoints({ObjectId(c): datetime.now() - timedelta(days=30)})
+    await rollups.backfill()
+
+    run = await reconcile.reconcile(partition_size=1, repair=True, restart=True)
+    [m async for m in reconcile.mismatch_report(run["run_id"])]
+    for lower, upper in await reconcile.user_partitions(1):
+        await statements._fetch_partition(lower, upper, datetime.now() - timedelta(days=30), datetime.now())
+
+    if layout == "document":
+        await storage.migrate("bucketed", batch_size=2)
+    await storage.reencode(2, restart=True)
+
+
+@pytest.mark.parametrize("layout", ["document", "bucketed"])
+def test_every_query_shape_is_declared(recorded, monkeypatch, layout):
+    from indexes import QUERY_SHAPES
+    _use_layout(monkeypatch, layout)
+    asyncio.run(_workload(layout))
+    declared = {(shape["collection"], repr(_shape(shape["filter"]))) for shape in QUERY_SHAPES}
+    missing = sorted({(collection, repr(shape)) for collection, shape in recorded
+                      if shape and (collection, repr(shape)) not in declared})
+    assert not missing, "\n".join(f"{collection}: {shape}" for collection, shape in missing)
@@ -0,0 +1,21 @@
+import asyncio
+from bson import ObjectId
+from tests.test_service import _user
+
+
+def test_partitions_hold_partition_size_users():
+    async def scenario():
+        import reconcile
+        from core import users_collection
+        user_ids = sorted([ObjectId(await _user(f"user{i}", 10)) for i in range(10)])
+        partitions = await reconcile.user_partitions(3)
+        sizes = [await users_collection.count_documents(reconcile.id_range("_id", lower, upper))
+                 for lower, upper in partitions]
+        assert sizes == [3, 3, 3, 1]
+        assert [upper for _, upper in partitions] == [user_ids[2], user_ids[5], user_ids[8], None]
+
+        result = await reconcile.reconcile(workers=2, partition_size=3)
+        assert result["partitions"] == 4
+        assert result["users_checked"] == 10 and result["mismatches"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,58 @@
+import asyncio
+
+
+async def _seed(names):
+    from tests.test_service import _user
+    for name in names:
+        await _user(name)
+
+
+def test_prefix_search_pages_through_matches():
+    async def scenario():
+        import service
+        await _seed(["anna", "annabel", "anne", "bob", "annika", "zed"])
+        first = await service.search_users("ann", limit=2)
+        second = await service.search_users("ann", limit=2, cursor=first["next_cursor"])
+        third = await service.search_users("ann", limit=2, cursor=second["next_cursor"])
+        names = [u["username"] for page in (first, second, third) for u in page["users"]]
+        assert names == ["anna", "annabel", "anne", "annika"]
+        assert third["next_cursor"] is None
+
+    asyncio.run(scenario())
+
+
+class _RecordingFind:
+    def __init__(self, collection):
+        self._collection = collection
+        self.calls = []
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def find(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+        return self._collection.find(*args, **kwargs)
+
+
+def test_prefix_search_uses_the_index(mongod, monkeypatch):
+    async def scenario():
+        import indexes
+        import service
+        from core import db, users_collection
+        await indexes.reconcile_indexes()
+        await _seed([f"user{i:04d}" for i in range(500)])
+        recorder = _RecordingFind(users_collection)
+        monkeypatch.setattr(service, "users_collection", recorder)
+        first = await service.search_users("user01", limit=20)
+        await service.search_users("user01", limit=20, cursor=first["next_cursor"])
+
+        for (query, projection), kwargs in recorder.calls:
+            plan = await db.command("explain", {
+                "find": "users", "filter": query, "projection": projection, "sort": {"username": 1, "_id": 1},
+                "limit": 20, "collation": kwargs["collation"]
+            }, verbosity="executionStats")
+            text = str(plan["queryPlanner"]["winningPlan"])
+            assert "IXSCAN" in text and "COLLSCAN" not in text and "'SORT'" not in text
+            assert plan["executionStats"]["totalDocsExamined"] <= 20
+
+    asyncio.run(scenario())
@@ -0,0 +1,250 @@
+import asyncio
+from datetime import datetime
+from bson import ObjectId
+from model import User, TransactionType
+
+
+async def _user(name: str, balance: float = 0.0):
+    import service
+    created = await service.create_user(User(username=name, email=f"{name}@example.com", password="secret"))
+    if balance:
+        await service.add_money(created["user_id"], balance)
+    return created["user_id"]
+
+
+def test_create_transaction_moves_the_balance_with_the_ledger():
+    async def scenario():
+        import service
+        user_id = await _user("carol", 100)
+        result = await service.create_transaction({
+            "user_id": user_id, "transaction_type": TransactionType.CREDIT, "amount": 5,
+            "description": "refund", "timestamp": datetime(2001, 1, 1)
+        })
+        assert result["new_balance"] == 105
+        assert result["transaction_type"] == "CREDIT"
+        assert "timestamp" not in result
+
+        entry = await service.get_transaction(result["transaction_id"])
+        assert entry["created_at"].year != 2001
+        assert (await service.get_balance(user_id))["balance"] == 105
+        assert (await service.get_balance_as_of(user_id, datetime.now()))["balance"] == 105
+
+        overdraw = await service.create_transaction({
+            "user_id": user_id, "transaction_type": TransactionType.DEBIT, "amount": 500,
+            "description": "too much", "timestamp": datetime.now()
+        })
+        assert overdraw["error"] == "Insufficient balance"
+        assert (await service.get_balance(user_id))["balance"] == 105
+
+    asyncio.run(scenario())
+
+
+def test_update_user_rejects_a_taken_username():
+    async def scenario():
+        import service
+        from core import users_collection
+        from indexes import INDEXES
+        await users_collection.create_indexes([m for m in INDEXES["users"] if m.document.get("unique")])
+        await _user("dave")
+        erin = await _user("erin")
+        result = await service.update_user(erin, {"username": "dave"})
+        assert result == {"error": "Username already exists"}
+        assert (await service.get_user(erin))["username"] == "erin"
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_withdrawals_never_overdraw():
+    async def scenario():
+        import service
+        from ledger import ledger_writer
+        from storage import ledger_store
+        user_id = await _user("grace", 100)
+        ledger_writer.start()
+        try:
+            results = await asyncio.gather(*(service.withdraw_money(user_id, 7) for _ in range(40)))
+        finally:
+            await ledger_writer.stop()
+        succeeded = [r for r in results if "error" not in r]
+        assert len(succeeded) == 14
+        assert all(r["error"] == "Insufficient balance" for r in results if "error" in r)
+        assert sorted(r["new_balance"] for r in succeeded) == [2 + 7 * i for i in range(14)]
+        assert (await service.get_balance(user_id))["balance"] == 2
+        # The opening credit plus one ledger entry per successful withdrawal.
+        assert await ledger_store.count(ObjectId(user_id)) == 15
+
+    asyncio.run(scenario())
+
+
+class _CountingFindOne:
+    def __init__(self, collection):
+        self._collection = collection
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def find_one(self, *args, **kwargs):
+        self.calls += 1
+        return await self._collection.find_one(*args, **kwargs)
+
+
+def test_short_debit_drains_shards_only_for_hot_wallets(monkeypatch):
+    import service
+    import shards
+    monkeypatch.setattr(shards, "_hot", {})
+    counting = _CountingFindOne(service.users_collection)
+    monkeypatch.setattr(service, "users_collection", counting)
+
+    async def scenario():
+        cold = await _user("cold", 5)
+        hot = await _user("hot", 5)
+        assert (await shards.promote(hot, 4))["hot"]
+        await shards.credit_shard(ObjectId(hot), 2, 10)
+
+        counting.calls = 0
+        assert (await service.withdraw_money(cold, 10))["error"] == "Insufficient balance"
+        # Only the lookup that tells a missing user from a short balance.
+        assert counting.calls == 1
+        # The user document alone holds 5; the shards make up the rest.
+        assert (await service.withdraw_money(hot, 12))["new_balance"] == 3
+
+    asyncio.run(scenario())
+
+
+class _FailingInserts:
+    def __init__(self, store):
+        self._store = store
+
+    def __getattr__(self, name):
+        return getattr(self._store, name)
+
+    async def insert_many(self, *args, **kwargs):
+        raise RuntimeError("ledger unavailable")
+
+
+def test_failed_ledger_write_leaves_the_balance_alone(monkeypatch):
+    async def scenario():
+        import service
+        from ledger import ledger_writer
+        from storage import ledger_store
+        user_id = await _user("heidi", 50)
+        monkeypatch.setattr(ledger_writer, "collection", _FailingInserts(ledger_store))
+        ledger_writer.start()
+        try:
+            results = [
+                await service.withdraw_money(user_id, 20),
+                await service.add_money(user_id, 30),
+                await service.create_transaction({"user_id": user_id, "transaction_type": "DEBIT", "amount": 5})
+            ]
+        finally:
+            await ledger_writer.stop()
+        assert [r["error"] for r in results] == ["ledger unavailable"] * 3
+        assert (await service.get_balance(user_id))["balance"] == 50
+        assert await ledger_store.count(ObjectId(user_id)) == 1
+
+    asyncio.run(scenario())
+
+
+def test_bulk_ingest_stores_aware_timestamps_as_local_time():
+    async def scenario():
+        import service
+        from datetime import timezone
+        user_id = await _user("ivan")
+        aware = datetime(2024, 3, 1, 12, tzinfo=timezone.utc)
+        result = await service.bulk_create_transactions(service.iterate_records([
+            {"user_id": user_id, "transaction_type": "CREDIT", "amount": 10, "description": "import",
+             "timestamp": aware.isoformat()}
+        ]))
+        entry = await service.get_transaction(result["results"][0]["transaction_id"])
+        assert entry["created_at"] == aware.astimezone().replace(tzinfo=None)
+
+    asyncio.run(scenario())
+
+
+def test_bulk_ingest_never_overdraws():
+    async def scenario():
+        import service
+        from storage import ledger_store
+        judy = await _user("judy", 30)
+        ken = await _user("ken", 5)
+        now = datetime.now().isoformat()
+        records = [
+            {"user_id": judy, "transaction_type": "DEBIT", "amount": 20, "description": "a", "timestamp": now},
+            {"user_id": ken, "transaction_type": "CREDIT", "amount": 10, "description": "b", "timestamp": now},
+            {"user_id": ken, "transaction_type": "DEBIT", "amount": 40, "description": "c", "timestamp": now},
+            {"user_id": judy, "transaction_type": "CREDIT", "amount": 1, "description": "d", "timestamp": now},
+        ]
+        result = await service.bulk_create_transactions(service.iterate_records(records))
+        assert result["inserted"] == 2
+        assert [r.get("error") for r in result["results"]] == [None, "Insufficient balance", "Insufficient balance", None]
+        assert (await service.get_balance(judy))["balance"] == 11
+        assert (await service.get_balance(ken))["balance"] == 5
+        assert await ledger_store.count(ObjectId(ken)) == 1
+
+    asyncio.run(scenario())
+
+
+async def _timed(calls):
+    import time
+
+    async def timed(call):
+        started = time.perf_counter()
+        result = await call()
+        return time.perf_counter() - started, result
+
+    return await asyncio.gather(*(timed(call) for call in calls))
+
+
+def _p99(latencies):
+    from benchmarks.run import percentile
+    return percentile(sorted(latencies), 0.99) * 1000
+
+
+async def _read_modify_write(user_id: str, amount: float):
+    # The pre-guard withdraw: read, check, then write, with a gap for others.
+    from core import users_collection
+    from storage import ledger_store
+    user = await users_collection.find_one({"_id": ObjectId(user_id)})
+    if user["balance"] < amount:
+        return {"error": "Insufficient balance"}
+    await ledger_store.insert_one({"user_id": user["_id"], "transaction_type": "DEBIT", "amount": amount,
+                                   "description": "baseline", "created_at": datetime.now()})
+    await users_collection.update_one({"_id": user["_id"]}, {"$inc": {"balance": -amount}})
+    return {}
+
+
+def test_thousands_of_concurrent_withdrawals_against_mongod(mongod, record_property):
+    async def scenario():
+        import indexes
+        import service
+        from ledger import SIGNED_AMOUNT, ledger_writer
+        from storage import ledger_store
+        await indexes.reconcile_indexes()
+        calls = 2000
+        guarded = await _user("mallory", 1000)
+        baseline = await _user("oscar", 1000)
+
+        ledger_writer.start()
+        try:
+            timed = await _timed([lambda: service.withdraw_money(guarded, 1.5) for _ in range(calls)])
+        finally:
+            await ledger_writer.stop()
+        baseline_timed = await _timed([lambda: _read_modify_write(baseline, 1.5) for _ in range(calls)])
+
+        async def ledger_sum(user_id):
+            rows = await ledger_store.aggregate({"user_id": ObjectId(user_id)}, [
+                {"$group": {"_id": None, "total": {"$sum": SIGNED_AMOUNT}}}
+            ]).to_list(length=1)
+            return rows[0]["total"]
+
+        balance = (await service.get_balance(guarded))["balance"]
+        assert sum("error" not in r for _, r in timed) == 666
+        assert balance >= 0 and balance == await ledger_sum(guarded) == 1
+        p99, baseline_p99 = _p99([t for t, _ in timed]), _p99([t for t, _ in baseline_timed])
+        record_property("withdraw_p99_ms", round(p99, 3))
+        record_property("read_modify_write_p99_ms", round(baseline_p99, 3))
+        print(f"\n{calls} concurrent withdrawals: guarded p99 {p99:.1f} ms, "
+              f"read-modify-write p99 {baseline_p99:.1f} ms")
+
+    asyncio.run(scenario())
@@ -0,0 +1,37 @@
+import asyncio
+from bson import ObjectId
+from tests.test_service import _user
+
+
+def test_hot_wallet_balances_come_from_the_writes():
+    async def scenario():
+        import service
+        import shards
+        from core import balance_shards_collection
+        user_id = await _user("hot", 100)
+        assert (await shards.promote(user_id, 4))["balance"] == 100
+
+        expected = 100
+        for _ in range(8):
+            result = await service.add_money(user_id, 5)
+            expected += 5
+            assert result["new_balance"] == expected
+        assert (await service.get_balance(user_id))["balance"] == expected
+
+        # Another worker credits a shard; a stale cached total must not leak
+        # into the balance this worker's next write reports.
+        await balance_shards_collection.update_one({"user_id": ObjectId(user_id), "shard": 1},
+                                                   {"$inc": {"balance": 50}})
+        expected += 50
+        result = await service.withdraw_money(user_id, 30)
+        expected -= 30
+        assert result["new_balance"] == expected
+        assert await shards.total_balance(ObjectId(user_id)) == expected
+        assert await shards.total_balance(ObjectId(user_id), use_cache=False) == expected
+
+        other_id = await _user("cold", 0)
+        transfer = await service.transfer_money(user_id, other_id, 20)
+        assert transfer["sender_new_balance"] == expected - 20
+        assert transfer["recipient_new_balance"] == 20
+
+    asyncio.run(scenario())
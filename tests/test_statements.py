@@ -0,0 +1,92 @@
+import asyncio
+import gzip
+import json
+import os
+from datetime import datetime
+from bson import ObjectId
+from tests.test_service import _user
+
+
+def _entry(user_id, transaction_type, amount, created_at):
+    return {"_id": ObjectId(), "user_id": ObjectId(user_id), "transaction_type": transaction_type,
+            "amount": amount, "description": transaction_type.lower(), "created_at": created_at}
+
+
+async def _seed(names):
+    from storage import ledger_store
+    user_ids = [await _user(name) for name in names]
+    for user_id in user_ids:
+        await ledger_store.insert_many([
+            _entry(user_id, "CREDIT", 100, datetime(2024, 4, 20)),
+            _entry(user_id, "DEBIT", 30, datetime(2024, 4, 28)),
+            _entry(user_id, "CREDIT", 12.5, datetime(2024, 5, 2)),
+            _entry(user_id, "TRANSFER_OUT", 40, datetime(2024, 5, 15)),
+            _entry(user_id, "DEBIT", 2.5, datetime(2024, 5, 31, 23, 59)),
+            _entry(user_id, "CREDIT", 1000, datetime(2024, 6, 1)),
+        ])
+    return sorted(user_ids, key=ObjectId)
+
+
+def _statements(directory):
+    statements = {}
+    for name in sorted(os.listdir(directory)):
+        if name.startswith("part-"):
+            with gzip.open(os.path.join(directory, name)) as f:
+                for line in f:
+                    statement = json.loads(line)
+                    statements[statement["user_id"]] = statement
+    return statements
+
+
+def test_statement_runs_from_opening_to_closing_balance(tmp_path):
+    async def scenario():
+        import statements
+        (user_id,) = await _seed(["yara"])
+        result = await statements.generate_statements("2024-05", str(tmp_path), workers=1, partition_size=10)
+        assert result["statements"] == 1 and result["lines"] == 3
+
+        statement = _statements(result["directory"])[user_id]
+        assert statement["period"] == "2024-05" and statement["username"] == "yara"
+        assert statement["opening_balance"] == 70
+        assert [line[2:] for line in statement["lines"]] == [
+            ["CREDIT", 12.5, "credit", 82.5],
+            ["TRANSFER_OUT", 40, "transfer_out", 42.5],
+            ["DEBIT", 2.5, "debit", 40],
+        ]
+        assert statement["closing_balance"] == 40
+        assert statement["totals"] == {"CREDIT": {"amount": 12.5, "count": 1},
+                                       "TRANSFER_OUT": {"amount": 40, "count": 1},
+                                       "DEBIT": {"amount": 2.5, "count": 1}}
+
+    asyncio.run(scenario())
+
+
+def test_manifest_fixes_the_ranges_and_resume_skips_finished_parts(tmp_path):
+    async def scenario():
+        import statements
+        user_ids = await _seed([f"user{i}" for i in range(5)])
+        first = await statements.generate_statements("2024-05", str(tmp_path), workers=1, partition_size=2)
+        directory = first["directory"]
+        assert first["partitions"] == 3 and first["partitions_written"] == 3 and first["statements"] == 5
+
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+        assert manifest["month"] == "2024-05"
+        assert manifest["partitions"] == [[None, user_ids[1]], [user_ids[1], user_ids[3]], [user_ids[3], None]]
+
+        # Users added later do not move the ranges of a run in progress.
+        await _seed(["late"])
+        kept = os.path.join(directory, "part-00000.ndjson.gz")
+        kept_mtime = os.stat(kept).st_mtime_ns
+        os.remove(os.path.join(directory, "part-00001.ndjson.gz"))
+        resumed = await statements.generate_statements("2024-05", str(tmp_path), workers=1, partition_size=2)
+        assert resumed["partitions_skipped"] == 2 and resumed["partitions_written"] == 1
+        assert resumed["statements"] == 2
+        assert os.stat(kept).st_mtime_ns == kept_mtime
+        assert sorted(_statements(directory)) == user_ids
+
+        restarted = await statements.generate_statements("2024-05", str(tmp_path), workers=1, partition_size=2,
+                                                         restart=True)
+        assert restarted["partitions_written"] == 4 and restarted["statements"] == 6
+
+    asyncio.run(scenario())
@@ -0,0 +1,80 @@
+import asyncio
+from datetime import datetime
+from bson import ObjectId
+import pytest
+from model import TransactionType
+
+
+def _stores():
+    from core import ledger_buckets_collection, transactions_collection
+    import storage
+    return [
+        storage.DocumentLedger(transactions_collection),
+        storage.BucketedLedger(ledger_buckets_collection, 100),
+    ]
+
+
+@pytest.mark.parametrize("encoding", [1, 2])
+def test_enum_transaction_type_is_stored_as_string(encoding):
+    async def scenario():
+        user_oid = ObjectId()
+        for store in _stores():
+            store.encoding = encoding
+            entry = {"user_id": user_oid, "transaction_type": TransactionType.CREDIT, "amount": 12.5,
+                     "description": "enum", "created_at": datetime(2024, 5, 1, 12)}
+            await store.insert_one(entry)
+            assert entry["transaction_type"] == "CREDIT"
+
+            stored = await store.get(entry["_id"])
+            assert stored["transaction_type"] == "CREDIT"
+            assert type(stored["transaction_type"]) is str
+            if store.layout == "bucketed":
+                bucket = await store.collection.find_one({"user_id": user_oid})
+                assert bucket["totals"] == {"CREDIT": 12.5}
+
+    asyncio.run(scenario())
+
+
+class _Pipelines:
+    def __init__(self):
+        self.pipelines = []
+
+    def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+
+
+def test_index_stages_run_before_decoding():
+    import storage
+    from codec import DECODE_STAGES
+    collection = _Pipelines()
+    match = {"user_id": ObjectId()}
+    sort = {"$sort": {"created_at": 1, "_id": 1}}
+    project = {"$project": {"amount": 1}}
+    storage.DocumentLedger(collection).aggregate(match, [sort, {"$limit": 10}, project])
+    storage.DocumentLedger(collection).aggregate(match, [{"$match": {"amount": {"$gt": 5}}}, sort])
+    assert collection.pipelines == [
+        [{"$match": match}, sort, {"$limit": 10}, *DECODE_STAGES, project],
+        [{"$match": match}, *DECODE_STAGES, {"$match": {"amount": {"$gt": 5}}}, sort],
+    ]
+
+
+def test_sorted_history_uses_the_index(mongod):
+    async def scenario():
+        from core import db, transactions_collection
+        import indexes
+        import storage
+        await indexes.reconcile_indexes()
+        user_oid = ObjectId()
+        store = storage.DocumentLedger(transactions_collection, 2)
+        for i in range(20):
+            await store.insert_one({"user_id": user_oid, "transaction_type": "CREDIT", "amount": i,
+                                    "created_at": datetime(2024, 5, 1, i)})
+        store.collection = _Pipelines()
+        store.aggregate({"user_id": user_oid}, [{"$sort": {"created_at": 1, "_id": 1}}])
+        pipeline = store.collection.pipelines[0]
+        plan = await db.command("explain", {"aggregate": "transactions", "pipeline": pipeline, "cursor": {}},
+                                verbosity="queryPlanner")
+        text = str(plan)
+        assert "IXSCAN" in text and "'stage': 'SORT'" not in text and "'$sort'" not in text
+
+    asyncio.run(scenario())
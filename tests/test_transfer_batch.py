@@ -0,0 +1,98 @@
+import asyncio
+from bson import ObjectId
+from tests.test_service import _user
+
+
+async def _balance(user_id):
+    import service
+    return (await service.get_balance(user_id))["balance"]
+
+
+async def _pending_batch(monkeypatch, sender, transfers, chunk_size):
+    # Creates the batch through the real entry point but stops before it runs.
+    import service
+    created = {}
+
+    async def hold(batch):
+        created.update(batch)
+        return {"batch_id": str(batch["_id"])}
+
+    monkeypatch.setattr(service, "_run_transfer_batch", hold)
+    await service.transfer_money_batch(sender, transfers, chunk_size=chunk_size)
+    monkeypatch.undo()
+    return created
+
+
+def test_batch_pays_every_recipient():
+    async def scenario():
+        import service
+        from storage import ledger_store
+        sender = await _user("sam", 100)
+        recipients = [await _user(f"rec{i}") for i in range(3)]
+        result = await service.transfer_money_batch(
+            sender, [{"recipient_user_id": r, "amount": 10 * (i + 1)} for i, r in enumerate(recipients)], chunk_size=2)
+        assert result["status"] == "completed" and result["error"] is None
+        assert result["transfers_completed"] == 3 and result["amount_completed"] == 60
+        assert await _balance(sender) == 40
+        assert [await _balance(r) for r in recipients] == [10, 20, 30]
+        assert await ledger_store.count(ObjectId(sender)) == 4
+
+    asyncio.run(scenario())
+
+
+def test_batch_stops_at_the_chunk_that_overdraws_and_resumes(monkeypatch):
+    async def scenario():
+        import service
+        sender = await _user("tina", 60)
+        recipients = [await _user(f"dst{i}") for i in range(3)]
+        batch = await _pending_batch(monkeypatch, sender,
+                                     [{"recipient_user_id": r, "amount": 20} for r in recipients], 1)
+        # Spent elsewhere after the batch was accepted.
+        await service.withdraw_money(sender, 25)
+
+        failed = await service.resume_transfer_batch(str(batch["_id"]))
+        assert failed["status"] == "failed" and failed["error"] == "Insufficient balance"
+        assert failed["transfers_completed"] == 1
+        assert await _balance(sender) == 15 and await _balance(recipients[2]) == 0
+
+        await service.add_money(sender, 25)
+        resumed = await service.resume_transfer_batch(str(batch["_id"]))
+        assert resumed["status"] == "completed" and resumed["transfers_completed"] == 3
+        assert await _balance(sender) == 0
+        assert [await _balance(r) for r in recipients] == [20, 20, 20]
+
+    asyncio.run(scenario())
+
+
+def test_a_second_runner_does_not_settle_a_chunk_twice(monkeypatch):
+    async def scenario():
+        import service
+        from storage import ledger_store
+        sender = await _user("uma", 50)
+        recipient = await _user("vic")
+        batch = await _pending_batch(monkeypatch, sender, [{"recipient_user_id": recipient, "amount": 10}], 1)
+        stale = dict(batch)
+        assert (await service.resume_transfer_batch(str(batch["_id"])))["status"] == "completed"
+
+        assert await service._run_transfer_batch(stale) == {"error": service.BATCH_BUSY}
+        status = await service.get_transfer_batch(str(batch["_id"]))
+        assert status["status"] == "completed" and status["error"] is None
+        assert await _balance(recipient) == 10
+        assert await ledger_store.count(ObjectId(recipient)) == 1
+
+    asyncio.run(scenario())
+
+
+def test_batch_fails_when_a_recipient_disappears(monkeypatch):
+    async def scenario():
+        import service
+        from core import users_collection
+        sender = await _user("wes", 50)
+        recipient = await _user("xia")
+        batch = await _pending_batch(monkeypatch, sender, [{"recipient_user_id": recipient, "amount": 10}], 1)
+        await users_collection.delete_one({"_id": ObjectId(recipient)})
+
+        result = await service.resume_transfer_batch(str(batch["_id"]))
+        assert result["status"] == "failed" and result["error"] == "Recipient not found"
+
+    asyncio.run(scenario())
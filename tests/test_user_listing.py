@@ -0,0 +1,61 @@
+import asyncio
+import json
+from tests.test_service import _user
+
+
+def _client(user_count=5):
+    from fastapi.testclient import TestClient
+    import main
+    user_ids = asyncio.run(_seed(user_count))
+    return TestClient(main.app), sorted(user_ids)
+
+
+async def _seed(count):
+    return [await _user(f"lister{i}", i) for i in range(count)]
+
+
+def test_listing_streams_every_user_without_passwords():
+    client, user_ids = _client()
+    rows = client.get("/users").json()
+    assert [row["user_id"] for row in rows] == user_ids
+    assert set(rows[0]) == {"user_id", "username", "email", "phone_number", "balance", "created_at", "updated_at"}
+    assert sorted(row["balance"] for row in rows) == [0, 1, 2, 3, 4]
+
+    response = client.get("/users", params={"format": "ndjson", "fields": "username,balance"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["user_id"] for row in rows] == user_ids
+    assert all(set(row) == {"user_id", "username", "balance"} for row in rows)
+
+
+def test_after_pages_through_users_in_id_order():
+    client, user_ids = _client()
+    first = client.get("/users", params={"limit": 2}).json()
+    second = client.get("/users", params={"limit": 2, "after": first[-1]["user_id"]}).json()
+    last = client.get("/users", params={"limit": 2, "after": second[-1]["user_id"]}).json()
+    done = client.get("/users", params={"limit": 2, "after": last[-1]["user_id"]}).json()
+    assert [row["user_id"] for row in first + second + last] == user_ids
+    assert done == []
+
+
+def test_listing_rejects_bad_parameters():
+    client, _ = _client(1)
+    for params, detail in (
+        ({"fields": "username,password"}, "Unknown fields: password"),
+        ({"after": "not-an-id"}, "Invalid cursor"),
+        ({"format": "csv"}, "format must be json or ndjson"),
+    ):
+        response = client.get("/users", params=params)
+        assert response.status_code == 400 and response.json()["detail"] == detail
+
+
+def test_output_is_flushed_in_chunks():
+    async def scenario():
+        import service
+        for i in range(20):
+            await _user(f"chunked{i}")
+        chunks = [chunk async for chunk in service.stream_users("json", "username", chunk_bytes=200)]
+        assert len(chunks) > 3
+        assert len(json.loads(b"".join(chunks))) == 20
+
+    asyncio.run(scenario())